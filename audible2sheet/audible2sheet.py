@@ -5,23 +5,120 @@ Script to export someone's audible library into a Google Sheet.
 import sys
 import os
 import time
+import io
+import re
 import json
+import gzip
+import hashlib
+import mmap
+import shutil
+import random
+import tempfile
+import threading
+import typing
 import logging
 import configparser
+import contextlib
 from pathlib import Path
 from datetime import datetime, timezone
 from warnings import warn
 import argparse
 import csv
-import audible
-import pygsheets
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
+from array import array
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # Some constants
 CONFIG_FILE_PATH = os.environ['HOME'] + '/.audible2sheet.ini'
 AUDIBLE_FILE_PATH_DEFAULT = 'audible_books.txt'
 AUDIBLE_RAW_FILE_PATH_DEFAULT = 'audible_raw_books.txt'
+AUDIBLE_SYNC_STATE_FILE_PATH_DEFAULT = 'audible_sync_state.txt'
+AUDIBLE_SNAPSHOT_DIR_DEFAULT = ''    # no snapshots unless a snapshot_dir is specified
+RAW_LIBRARY_INDEX_SUFFIX = '.idx'
+RAW_LIBRARY_STATS_SUFFIX = '.stats'
+# Fields with more different values (titles, summaries, ...) have no histogram in the field stats of the whole raw cache file
+RAW_FIELD_STATS_MAX_VALUES = 1000
+COMPRESSED_FILE_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_COMPRESS_LEVEL       = 6
 GSHEET_FILE_PATH_DEFAULT  = 'gsheet_books.txt'
+GSHEET_LOCAL_FILE_PATH_DEFAULT = 'gsheet_local.json'
+GSHEET_MANIFEST_SUFFIX = '.manifest'
+# Above that many runs of rows unknown to the manifest, the whole sheet is downloaded instead
+GSHEET_MAX_ROW_FETCHES = 10
+AUDIBLE_PAGE_SIZE         = 500
+AUDIBLE_INCREMENTAL_PAGE_SIZE = 50
+AUDIBLE_MAX_PAGES         = 99
+AUDIBLE_RESPONSE_GROUPS   = 'product_desc,contributors,product_attrs,category_ladders,series'
+AUDIBLE_FETCH_WORKERS_DEFAULT = 4
+AUDIBLE_REQUESTS_PER_SECOND_DEFAULT = 5
+AUDIBLE_MAX_REQUESTS_IN_FLIGHT_DEFAULT = 8
+AUDIBLE_MAX_RETRIES_DEFAULT = 5
+AUDIBLE_RETRY_STATUSES    = (429, 500, 502, 503, 504)
+AUDIBLE_TOKEN_REFRESH_MARGIN = 300
+AUDIBLE_RESPONSE_CACHE_DIR_DEFAULT = 'audible_response_cache'
+AUDIBLE_RESPONSE_CACHE_MAX_SIZE_MB_DEFAULT = 0
+REBUILD_BATCH_SIZE        = 1000
+REBUILD_PROCESS_POOL_MIN_SIZE = 16 * 1024 * 1024
+REBUILD_CHUNK_SIZE        = 4 * 1024 * 1024
+
+# Instrumentation of the stages of a sync
+class Profiler:
+    """
+    Wall time, number of calls, items and bytes recorded per stage of a sync (e.g. one call per Audible page)
+    Recording is cheap enough to be always on; --profile prints the summary table (or saves it as JSON)
+    Stages running in several threads at once add up their times (and so can add up to more than the total)
+    and so the critical path of the sync (stages that determined its total time) is printed along with the table
+    """
+    def __init__(self):
+        self.stages        = dict()
+        self.critical_path = []
+        self._lock         = threading.Lock()
+
+    def add(self, name, seconds=0.0, items=0, n_bytes=0):
+        with self._lock:
+            stats = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'items': 0, 'bytes': 0})
+            stats['calls']   += 1
+            stats['seconds'] += seconds
+            stats['items']   += items
+            stats['bytes']   += n_bytes
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Record the wall time of the block; the items and bytes of the yielded dict are recorded as well
+        """
+        counts = {'items': 0, 'bytes': 0}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(name, time.perf_counter() - start, counts['items'], counts['bytes'])
+
+    def reset(self):
+        with self._lock:
+            self.stages        = dict()
+            self.critical_path = []
+
+    def print_summary(self, file=None):
+        file = file or sys.stderr
+        name_width = max([len("STAGE")] + [len(name) for name in self.stages])
+        print(f"{'STAGE':<{name_width}}  {'CALLS':>6}  {'SECONDS':>9}  {'ITEMS':>9}  {'BYTES':>12}", file=file)
+        for name, stats in self.stages.items():
+            print(f"{name:<{name_width}}  {stats['calls']:>6}  {stats['seconds']:>9.3f}  {stats['items']:>9}  {stats['bytes']:>12}",
+                  file=file)
+        if self.critical_path:
+            print(f"Critical path: {format_critical_path(self.critical_path)}", file=file)
+
+    def save(self, file_path):
+        with open(file_path, 'w') as profile_file:
+            json.dump(self.stages, profile_file, indent=2)
+
+
+# Stages of the current process
+profiler = Profiler()
+
 
 # Book Class
 class Book:
@@ -41,6 +138,7 @@ class Book:
         FIELD_NAME_PURCHASE_DATE,
     ]
     UNKNOWN_VALUE            = '???'
+    __slots__ = ('asin', 'title', 'authors', 'duration', 'purchase_date')
     def __init__(self, asin, title, authors, duration, purchase_date):
         self.asin            = asin
         self.title           = title
@@ -90,11 +188,13 @@ class Book:
     def __repr__(self):
         return '%s(%s)' % (
             type(self).__name__,
-            ', '.join('%s=%s' % item for item in vars(self).items())
+            ', '.join('%s=%s' % (name, getattr(self, name)) for name in self.__slots__)
         )
 
 
 # Useful functions to convert time and date formats
+# The conversions are cached since the same durations and dates come up over and over in a library
+@lru_cache(maxsize=None)
 def convert_length_in_minutes_to_hr_min_str(length_minutes=0):
     """
     Convert minutes into something like 02h03m if given 123.
@@ -107,30 +207,81 @@ def convert_length_in_minutes_to_hr_min_str(length_minutes=0):
     return "%02dh%02dm" % (hour, minutes)
 
 
-def convert_utc_time_to_ccyymmdd(utc_time=""):
+def convert_lengths_in_minutes_to_hr_min_str(lengths_minutes):
     """
-    Convert a UTC datetime like: 2019-06-30T23:58:29.551Z and convert time to a local time/date string: CCYYMMDD.
+    Convert a whole column of lengths in minutes at once (see convert_length_in_minutes_to_hr_min_str)
     """
-    utc_datetime = None
-    try:
-        utc_datetime = datetime.strptime(utc_time, "%Y-%m-%dT%H:%M:%S.%f%z")
-    except ValueError:
+    return [convert_length_in_minutes_to_hr_min_str(length_minutes) for length_minutes in lengths_minutes]
+
+
+def parse_utc_time(utc_time):
+    """
+    Parse a UTC datetime like: 2019-06-30T23:58:29.551Z or 2019-06-30T23:58:29Z
+    Return None if the format is unknown
+    """
+    # fast path for the usual CCYY-MM-DDTHH:MM:SS[.fff]Z format
+    if (
+            len(utc_time) >= 20 and utc_time[-1] == 'Z' and utc_time[19] in '.Z' and
+            utc_time[4] == '-' and utc_time[7] == '-' and utc_time[10] == 'T' and utc_time[13] == ':' and utc_time[16] == ':'
+    ):
         try:
-            utc_datetime = datetime.strptime(utc_time, "%Y-%m-%dT%H:%M:%S%z")
+            return datetime.fromisoformat(utc_time[:-1] + '+00:00')
         except ValueError:
-            warn(f"Unknown date format for: {utc_time}")
+            pass
+    for utc_format in ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z"):
+        try:
+            return datetime.strptime(utc_time, utc_format)
+        except ValueError:
+            pass
 
-    if utc_datetime:
-        local_datetime = utc_datetime.replace(tzinfo=timezone.utc).astimezone(tz=None)
-        ccyymmdd = local_datetime.strftime("%Y%m%d")
-    else:
-        print(f"HERE!!!!!{utc_datetime} {utc_time[5:2]}")
+    return None
+
+
+@lru_cache(maxsize=65536)
+def convert_known_utc_time_to_ccyymmdd(utc_time):
+    """
+    Convert a UTC datetime to a local time/date string: CCYYMMDD
+    Return None if the format is unknown (cached like any other result: the unknown format is reported
+    by convert_utc_time_to_ccyymmdd which warns outside of the cache)
+    """
+    utc_datetime = parse_utc_time(utc_time)
+    if utc_datetime is None:
+        return None
+    local_datetime = utc_datetime.replace(tzinfo=timezone.utc).astimezone(tz=None)
+
+    return local_datetime.strftime("%Y%m%d")
+
+
+def convert_utc_time_to_ccyymmdd(utc_time=""):
+    """
+    Convert a UTC datetime like: 2019-06-30T23:58:29.551Z and convert time to a local time/date string: CCYYMMDD.
+    """
+    ccyymmdd = convert_known_utc_time_to_ccyymmdd(utc_time)
+    if ccyymmdd is None:
+        warn(f"Unknown date format for: {utc_time}")
         # poor man handling of unknown format but assuming the format ccyy-mm-dd
         ccyymmdd = "".join([utc_time[0:4], utc_time[5:7], utc_time[8:10]])
 
     return ccyymmdd
 
 
+def convert_utc_times_to_ccyymmdd(utc_times):
+    """
+    Convert a whole column of UTC datetimes at once (see convert_utc_time_to_ccyymmdd)
+    Each distinct datetime is parsed and converted to local time only once
+    """
+    with profiler.stage('date_conversion') as counts:
+        converted = dict()
+        ccyymmdds = []
+        for utc_time in utc_times:
+            if utc_time not in converted:
+                converted[utc_time] = convert_utc_time_to_ccyymmdd(utc_time)
+            ccyymmdds.append(converted[utc_time])
+        counts['items'] = len(ccyymmdds)
+
+    return ccyymmdds
+
+
 def extract_authors_from_json_data(json_data=''):
     """
     Audible provides a list of authors which might includes translators, foreword, adaptors and other contributors.
@@ -191,18 +342,286 @@ def extract_categories_from_json_data(json_data=''):
 
     return categories
 
+# raw field -> function extracting the useful information out of its data (any other field is left as-is)
+FIELD_EXTRACTORS = {
+    'authors':          extract_authors_from_json_data,
+    'narrators':        extract_authors_from_json_data,
+    'category_ladders': extract_categories_from_json_data,
+    'series':           extract_series_from_json_data,
+}
+
+
+def get_field_extractor(field):
+    """
+    Get the function extracting the useful information out of the data of a raw field
+    """
+    return FIELD_EXTRACTORS.get(field, str)
+
+
 def extract_correct_information_from_field_data(field, data):
-    if field == 'authors' or field == 'narrators':
-        information = extract_authors_from_json_data(data)
-    elif field == 'category_ladders':
-        information = extract_categories_from_json_data(data)
-    elif field == 'series':
-        information = extract_series_from_json_data(data)
-    else:
-        # leave as-is
-        information = str(data)
+    return get_field_extractor(field)(data)
+
+
+def extract_titles_from_items(items):
+    """
+    Build the TITLE column: "title: subtitle" or just the title when there's no subtitle
+    """
+    titles = []
+    for item in items:
+        title = item["title"]
+        subtitle = item["subtitle"]
+        titles.append(title + ": " + subtitle if subtitle else title)
+
+    return titles
+
+
+# Built-in book columns: header -> function building the whole column out of a list of raw items
+BOOK_COLUMN_EXTRACTORS = {
+    Book.FIELD_NAME_ASIN:          lambda items: [item["asin"] for item in items],
+    Book.FIELD_NAME_TITLE:         extract_titles_from_items,
+    Book.FIELD_NAME_AUTHORS:       lambda items: [extract_authors_from_json_data(item["authors"]) for item in items],
+    Book.FIELD_NAME_DURATION:      lambda items: convert_lengths_in_minutes_to_hr_min_str([item["runtime_length_min"] for item in items]),
+    Book.FIELD_NAME_PURCHASE_DATE: lambda items: convert_utc_times_to_ccyymmdd([item["purchase_date"] for item in items]),
+}
+
+# Columns are (header, raw field) pairs where a None raw field stands for a built-in book column
+DEFAULT_BOOK_COLUMNS = tuple((field, None) for field in Book.FIELD_NAMES)
+
+
+def create_raw_field_column_extractor(field):
+    """
+    Create the function building a whole column out of a raw field (Book.UNKNOWN_VALUE when missing, like -R)
+    """
+    extractor = get_field_extractor(field)
+
+    def extract_column(items):
+        values = []
+        for item in items:
+            data = item.get(field)
+            value = extractor(data) if data is not None else None
+            values.append(value if value is not None else Book.UNKNOWN_VALUE)
+        return values
+
+    return extract_column
+
+
+class ProjectionPlan:
+    """
+    Columns compiled once into the functions building them so that rows don't dispatch on field names per cell
+        * headers: header of each column
+        * fields: raw fields needed to build the columns (used to decode only those)
+        * column_extractors: function building each column out of a list of raw items
+    """
+    def __init__(self, columns):
+        self.headers           = [header for header, _ in columns]
+        self.fields            = []
+        self.column_extractors = []
+        for header, field in columns:
+            if field is None:
+                self.column_extractors.append(BOOK_COLUMN_EXTRACTORS[header])
+            else:
+                self.column_extractors.append(create_raw_field_column_extractor(field))
+                if field not in self.fields:
+                    self.fields.append(field)
+
+    def project(self, items):
+        """
+        Get the rows (lists of values in the headers order) of a list of raw items
+        """
+        return [list(row) for row in zip(*(extract_column(items) for extract_column in self.column_extractors))]
+
+
+@lru_cache(maxsize=None)
+def compile_projection_plan(columns):
+    """
+    Compile a tuple of (header, raw field) columns into a ProjectionPlan (only once per distinct columns)
+    """
+    return ProjectionPlan(columns)
+
+
+def get_book_columns(cfg):
+    """
+    Get the exported columns: the built-in book columns plus the ones of the [google_sheet_columns] section
+    which maps a header to a raw field (HEADER = raw_field); a header matching a built-in column replaces it
+    except for the ASIN column which is the key of the books in the cache files and the sheet
+    """
+    columns = dict(DEFAULT_BOOK_COLUMNS)
+    if cfg.has_section('google_sheet_columns'):
+        for header, field in cfg.items('google_sheet_columns'):
+            header = header.strip()
+            field = field.strip()
+            if not header or not field or '|' in header:
+                raise Exception(f"Invalid column mapping in [google_sheet_columns]: {header} = {field}")
+            if header == Book.FIELD_NAME_ASIN and field != 'asin':
+                raise Exception(f"The {Book.FIELD_NAME_ASIN} column can't be mapped to another field than asin in [google_sheet_columns]")
+            columns[header] = field
+
+    return tuple(columns.items())
+
+
+def get_error_status_and_headers(error):
+    """
+    Get the HTTP status and headers of a failed request from its exception (None, {} if it has none)
+    Handles both urllib (code/headers) and requests/httpx/audible (code or response.status_code/response.headers) style errors
+    The headers of the response are used whenever the error has one (audible errors have a code but no headers)
+    """
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'code', None)
+    if not isinstance(status, int):
+        status = getattr(response, 'status_code', None)
+    if not isinstance(status, int):
+        return None, {}
+    headers = getattr(response, 'headers', None) if response is not None else getattr(error, 'headers', None)
+
+    return status, headers or {}
+
+
+def parse_retry_after(retry_after):
+    """
+    Convert a Retry-After header (either a number of seconds or an HTTP date) into a number of seconds
+    Return None if it can't be parsed
+    """
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """
+    Run requests (any function) with:
+        * a token bucket rate limit: requests_per_second on average with bursts of up to burst requests (0 for no limit)
+        * at most max_in_flight requests running at the same time
+        * up to max_retries retries with exponential backoff and (full) jitter of the requests failing with
+          a throttle/server error status (AUDIBLE_RETRY_STATUSES) or a connection error
+    A Retry-After header pauses all the requests (not only the failed one) for that long since the whole client is throttled.
+    """
+    def __init__(self, requests_per_second=0, burst=1, max_in_flight=None, max_retries=AUDIBLE_MAX_RETRIES_DEFAULT,
+                 backoff_base=0.5, backoff_max=30.0):
+        self.requests_per_second = requests_per_second
+        self.burst               = max(1, burst)
+        self.max_retries         = max_retries
+        self.backoff_base        = backoff_base
+        self.backoff_max         = backoff_max
+        self.requests            = 0
+        self.retries             = 0
+        self._lock               = threading.Lock()
+        self._in_flight          = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self._tokens             = float(self.burst)
+        self._updated            = time.monotonic()
+        self._paused_until       = 0.0
+
+    def _wait_for_token(self):
+        # the wait is worked out under the lock but the sleep happens without it (so that a pause isn't blocked)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if self.requests_per_second:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.requests_per_second)
+                    self._updated = now
+                    if wait <= 0 and self._tokens >= 1:
+                        self._tokens -= 1
+                        self.requests += 1
+                        return
+                    wait = max(wait, (1 - self._tokens) / self.requests_per_second)
+                elif wait <= 0:
+                    self.requests += 1
+                    return
+            time.sleep(wait)
+
+    def _pause(self, delay):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def get_retry_delay(self, error, attempt):
+        """
+        Return how long to wait before retrying a request after its attempt-th failure (None if it's not worth retrying)
+        """
+        status, headers = get_error_status_and_headers(error)
+        if status is None:
+            if not (isinstance(error, (OSError, TimeoutError)) or 'Timeout' in type(error).__name__ or
+                    'Connect' in type(error).__name__):
+                return None
+        elif status not in AUDIBLE_RETRY_STATUSES:
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after is not None:
+            self._pause(retry_after)
+            delay = max(delay, retry_after)
 
-    return information
+        return delay
+
+    def run(self, request, *args, **kwargs):
+        """
+        Run request(*args, **kwargs) and return its result, retrying it if needed
+        The error of the last attempt is raised when all the retries failed
+        """
+        attempt = 0
+        while True:
+            self._wait_for_token()
+            if self._in_flight:
+                self._in_flight.acquire()
+            try:
+                return request(*args, **kwargs)
+            except Exception as error:
+                delay = self.get_retry_delay(error, attempt) if attempt < self.max_retries else None
+                if delay is None:
+                    raise
+                print(f"Retrying Audible request in {delay:.2f}s after: {error}", file=sys.stderr)
+            finally:
+                if self._in_flight:
+                    self._in_flight.release()
+            attempt += 1
+            self.retries += 1
+            time.sleep(delay)
+
+
+def get_audible_request_scheduler(audible_cfg):
+    """
+    Create the scheduler of the Audible requests from the Audible cfg data
+    """
+    fetch_workers = int(audible_cfg.get('fetch_workers', AUDIBLE_FETCH_WORKERS_DEFAULT))
+    return RequestScheduler(
+        requests_per_second = float(audible_cfg.get('requests_per_second', AUDIBLE_REQUESTS_PER_SECOND_DEFAULT)),
+        burst               = fetch_workers,
+        max_in_flight       = int(audible_cfg.get('max_requests_in_flight', AUDIBLE_MAX_REQUESTS_IN_FLIGHT_DEFAULT)),
+        max_retries         = int(audible_cfg.get('max_retries', AUDIBLE_MAX_RETRIES_DEFAULT)),
+    )
+
+
+def load_audible_session_file(session_file_path):
+    """
+    Load the saved Audible session (None if there's none or it can't be read)
+    """
+    try:
+        with open(session_file_path) as session_file:
+            return json.load(session_file)
+    except (OSError, ValueError):
+        return None
+
+
+def has_audible_session_expired(session):
+    if "expires" in session:
+        if session["expires"] == None or time.time() < session["expires"]:
+            return False
+    logging.info("Session has expired")
+    return True
+
+
+def is_audible_device_registered(session):
+    """
+    A session saved after registering the device has the tokens/keys needed to sign the requests
+    """
+    return bool(session.get("adp_token") and session.get("device_private_key"))
 
 
 class AudibleClient:
@@ -210,54 +629,61 @@ class AudibleClient:
     Audible client session which can be created by either:
         * from an already saved session file
         * or by providing credentials
+    The session file is parsed once and the device is only registered when the saved session isn't already registered.
+    The access token is refreshed in the background (and saved) AUDIBLE_TOKEN_REFRESH_MARGIN seconds before it expires
+    so that a long-lived client (see get_audible_client) never has to log in again.
+    Requests go through a RequestScheduler (rate limit, retries) which can be shared between clients
     """
 
     def __init__(
-        self, email, password, locale="us", session_file="/tmp/audible_session_file.txt"
+        self, email, password, locale="us", session_file="/tmp/audible_session_file.txt", scheduler=None
     ):
         self._email = email
         self._password = password
         self._locale = locale
         self._session_file = session_file
+        self._scheduler = scheduler or RequestScheduler()
+        self._auth_lock = threading.Lock()
+        self._refresh_timer = None
 
-        if not os.path.exists(self._session_file) or self._has_session_expired():
+        session = load_audible_session_file(self._session_file)
+        if session is None or has_audible_session_expired(session):
             self._create_with_credentials()
+        else:
+            try:
+                self._restore_from_session_file(register=not is_audible_device_registered(session))
+            except Exception as msg:  # pylint: disable=W0702
+                print(f"Can't log into Audible: {msg}", file=sys.stderr)
 
-        try:
-            self._restore_from_session_file()
-        except Exception as msg:  # pylint: disable=W0702
-            print(f"Can't log into Audible: {msg}", file=sys.stderr)
-
-            # If that doesn't work, try logging in with credentials
-            self._create_with_credentials()
+                # If that doesn't work, try logging in with credentials
+                self._create_with_credentials()
+        self._schedule_access_token_refresh()
 
-    def _restore_from_session_file(self):
+    def _restore_from_session_file(self, register=False):
         # Try to restore session from file if possible
+        # audible (and its dependencies) are only imported when the network is needed since they're slow to import
+        import audible
         try:
             auth = audible.FileAuthenticator(
                 filename=self._session_file, locale=self._locale, 
-                register=True
+                register=register
             )
+            if register:
+                # save the registered device so that it's not registered again next time
+                auth.to_file(self._session_file, encryption=False)
+            self._auth = auth
             self._client = audible.AudibleAPI(auth)
         except Exception as msg:
             msg = f"Can't log into Audible using session file ({self._session_file}): {msg}"
             raise Exception(msg)
 
-    def _has_session_expired(self):
-        with open(self._session_file) as session_file:
-            session = json.load(session_file)
-            if "expires" in session:
-                if session["expires"] == None or time.time() < session["expires"]:
-                    return False
-        logging.info("Session has expired")
-        return True
-
     def _create_with_credentials(self):
+        import audible
         if self._email and self._password:
             try:
                 logging.info("Creating session using login/password credentials")
                 auth = audible.LoginAuthenticator(
-                    self._email, self._password, locale=self._locale
+                    self._email, self._password, locale=self._locale, register=True
                 )
             except Exception as msg:
                 print(f"Can't log into Audible using credentials: {msg}", file=sys.stderr)
@@ -267,18 +693,74 @@ class AudibleClient:
 
         # save session after initializing
         auth.to_file(self._session_file, encryption=False)
+        self._auth = auth
         self._client = audible.AudibleAPI(auth)
 
+    def _schedule_access_token_refresh(self):
+        expires = getattr(getattr(self, "_auth", None), "expires", None)
+        if not expires:
+            return
+        delay = max(0.0, expires - time.time() - AUDIBLE_TOKEN_REFRESH_MARGIN)
+        self._refresh_timer = threading.Timer(delay, self._refresh_access_token)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh_access_token(self):
+        try:
+            with self._auth_lock:
+                self._auth.refresh_access_token(force=True)
+                self._auth.to_file(self._session_file, encryption=False)
+        except Exception as msg:
+            logging.warning(f"Can't refresh the Audible access token: {msg}")
+            return
+        logging.info("Audible access token refreshed")
+        self._schedule_access_token_refresh()
+
+    def close(self):
+        """Stop refreshing the access token in the background."""
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+
     def is_logged_in(self):
         """Check if an Audible connection has been sucessfully established."""
         return hasattr(self, "_client")
 
     def get(self, *args, **kwarg):
-        """Run query and get results on Audible connection."""
+        """Run query and get results on Audible connection (retried by the scheduler when worth it)."""
         try:
-            return self._client.get(*args, **kwarg)
-        except:
+            return self._scheduler.run(self._client.get, *args, **kwarg)
+        except Exception:
             print("Failed to get data from Audible", file=sys.stderr)
+            raise
+
+
+# Logged in Audible clients (and their HTTP connections) reused by the whole process: (locale, session file) -> AudibleClient
+audible_clients = dict()
+audible_clients_lock = threading.Lock()
+
+
+def get_audible_client(email, password, locale, session_file, scheduler=None):
+    """
+    Get the Audible client of a session file, logging in only the first time
+    """
+    key = (locale, os.path.abspath(session_file))
+    with audible_clients_lock:
+        audible_client = audible_clients.get(key)
+        if audible_client is None or not audible_client.is_logged_in():
+            audible_client = AudibleClient(email, password, locale, session_file, scheduler)
+            audible_clients[key] = audible_client
+
+    return audible_client
+
+
+def close_audible_clients():
+    """
+    Stop refreshing the access tokens of the Audible clients in the background and forget the clients
+    """
+    with audible_clients_lock:
+        for audible_client in audible_clients.values():
+            audible_client.close()
+        audible_clients.clear()
 
 
 def create_books_dict_from_file(file):
@@ -286,7 +768,7 @@ def create_books_dict_from_file(file):
     Create a list of books dict using ASIN as key from a "|"-separated file
     """
     books_dict = dict()
-    with open(file, 'r', newline='') as csv_file:
+    with open_cache_file(file, 'r', newline='') as csv_file:
         csv_reader = csv.DictReader(csv_file, delimiter='|')
         for book_dict in csv_reader:
             book = None
@@ -300,7 +782,258 @@ def create_books_dict_from_file(file):
     return books_dict
 
 
-def get_gs_wks(gs_cfg, root_path):
+class BookTable:
+    """
+    Columnar container of books used to diff/export them without creating one object (or dict) per book:
+        * field_names: name of each column (the Book fields followed by any extra column by default)
+        * columns: one list of values per field
+        * row_numbers: row number of each book in the file it was loaded from (the header being row #1)
+        * asin_index: ASIN -> position of the book in the columns
+    """
+    def __init__(self, field_names=None):
+        self.field_names = list(field_names or Book.FIELD_NAMES)
+        self.columns     = {field: [] for field in self.field_names}
+        self.row_numbers = array('l')
+        self.asin_index  = dict()
+        self._asin_col_index = self.field_names.index(Book.FIELD_NAME_ASIN)
+
+    def __len__(self):
+        return len(self.row_numbers)
+
+    def __contains__(self, asin):
+        return asin in self.asin_index
+
+    def append(self, values, row_number):
+        """
+        Add a book from its values in the field_names order
+        """
+        self.asin_index[values[self._asin_col_index]] = len(self.row_numbers)
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+        self.row_numbers.append(row_number)
+
+    def get_book(self, position):
+        return Book(*(self.columns[field][position] if field in self.columns else Book.UNKNOWN_VALUE
+                      for field in Book.FIELD_NAMES))
+
+    @classmethod
+    def from_file(cls, file, field_names=None):
+        """
+        Create a table of books from a "|"-separated file (with the same validation as Book.book_from_dict)
+        Only the specified fields are loaded: by default the Book fields followed by the extra columns of the header
+        Extra (non Book) fields are loaded as-is and are empty when missing
+        """
+        with open_cache_file(file, 'r', newline='') as csv_file:
+            csv_reader = csv.reader(csv_file, delimiter='|')
+            header = next(csv_reader, [])
+            if field_names is None:
+                field_names = Book.FIELD_NAMES + [field for field in header if field and field not in Book.FIELD_NAMES]
+            table = cls(field_names)
+            if Book.FIELD_NAME_ASIN not in header:
+                return table
+            asin_col_index = header.index(Book.FIELD_NAME_ASIN)
+            n_cols = len(header)
+            field_col_indexes = [(field, header.index(field) if field in header else None) for field in table.field_names]
+            book_col_indexes = [col_index for field, col_index in field_col_indexes if field in Book.FIELD_NAMES]
+            all_fields_in_header = all(col_index is not None for _, col_index in field_col_indexes)
+            # the rows are numbered by record (and not by line since a cell can contain newlines)
+            for row_number, row in enumerate(csv_reader, 2):
+                asin = row[asin_col_index] if asin_col_index < len(row) else None
+                if not asin or asin.isspace():
+                    continue
+                if (
+                        all_fields_in_header and len(row) >= n_cols and
+                        all(row[col_index] and not row[col_index].isspace() for col_index in book_col_indexes)
+                ):
+                    values = [row[col_index] for _, col_index in field_col_indexes]
+                else:
+                    # slow path only used to warn about the invalid/missing values
+                    values = []
+                    for field, col_index in field_col_indexes:
+                        if field not in Book.FIELD_NAMES:
+                            value = row[col_index] if col_index is not None and col_index < len(row) else ""
+                        elif col_index is not None and col_index < len(row):
+                            value = row[col_index]
+                            if not value or value.isspace():
+                                warn(f"Invalid value:{value} associated with field:{field} in book dictionary:{dict(zip(header, row))}")
+                                value = Book.UNKNOWN_VALUE
+                        else:
+                            warn(f"Can't find field:{field} in book dictionary:{dict(zip(header, row))}")
+                            value = Book.UNKNOWN_VALUE
+                        values.append(value)
+                table.append(values, row_number)
+
+        return table
+
+
+class QuotaExceededError(Exception):
+    """
+    Raised by LocalWorksheet when more calls than allowed are made within a minute (like the Sheets API would)
+    """
+
+
+class LocalWorksheet:
+    """
+    Local stand-in for a pygsheets Worksheet used to test and benchmark the export path offline
+
+    Only the part of the Worksheet API used by audible2sheet is implemented (get_all_values, get_row, get_col, get_values,
+    insert_rows, update_values_batch, delete_rows and frozen_rows).
+    Every call is counted along with the size of the values sent/received.
+    The rows are kept in memory and saved as JSON to file_path (if specified) after every change.
+    latency (in seconds) is added to every call and more than max_calls_per_minute calls raise QuotaExceededError.
+    """
+    def __init__(self, file_path=None, latency=0.0, max_calls_per_minute=None):
+        self.file_path            = file_path
+        self.latency              = latency
+        self.max_calls_per_minute = max_calls_per_minute
+        self.calls                = defaultdict(int)
+        self.bytes_sent           = 0
+        self.bytes_received       = 0
+        self._call_times          = []
+        self._frozen_rows         = 0
+        self.rows                 = []
+        if file_path and os.path.exists(file_path):
+            with open(file_path, 'r') as local_file:
+                self.rows = json.load(local_file)
+
+    @property
+    def api_calls(self):
+        return sum(self.calls.values())
+
+    def _call(self, name, sent_values=None):
+        now = time.monotonic()
+        if self.max_calls_per_minute is not None:
+            self._call_times = [call_time for call_time in self._call_times if now - call_time < 60]
+            if len(self._call_times) >= self.max_calls_per_minute:
+                raise QuotaExceededError(f"Quota of {self.max_calls_per_minute} calls per minute exceeded by {name}")
+            self._call_times.append(now)
+        self.calls[name] += 1
+        if sent_values is not None:
+            self.bytes_sent += len(json.dumps(sent_values))
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _received(self, values):
+        self.bytes_received += len(json.dumps(values))
+        return values
+
+    def _save(self):
+        if self.file_path:
+            with open(self.file_path, 'w') as local_file:
+                json.dump(self.rows, local_file)
+
+    @staticmethod
+    def _parse_value(value):
+        # like a user typing into the sheet: a leading ' forces the value to be kept as text and isn't shown
+        value = str(value)
+        return value[1:] if value.startswith("'") else value
+
+    @staticmethod
+    def _parse_a1_cell(cell):
+        col_name = cell.rstrip('0123456789')
+        col_number = 0
+        for letter in col_name:
+            col_number = col_number * 26 + ord(letter) - ord('A') + 1
+        return int(cell[len(col_name):]), col_number
+
+    def get_all_values(self, include_tailing_empty_rows=True, **kwargs):
+        self._call('get_all_values')
+        n_cols = max((len(row) for row in self.rows), default=0)
+        rows = [row + [''] * (n_cols - len(row)) for row in self.rows]
+        if not include_tailing_empty_rows:
+            while rows and all(value == '' for value in rows[-1]):
+                rows.pop()
+        return self._received(rows)
+
+    def get_row(self, row, include_tailing_empty=True, **kwargs):
+        self._call('get_row')
+        values = list(self.rows[row - 1]) if row <= len(self.rows) else []
+        if not include_tailing_empty:
+            while values and values[-1] == '':
+                values.pop()
+        return self._received(values)
+
+    def get_col(self, col, include_tailing_empty=True, **kwargs):
+        self._call('get_col')
+        values = [row[col - 1] if col <= len(row) else '' for row in self.rows]
+        if not include_tailing_empty:
+            while values and values[-1] == '':
+                values.pop()
+        return self._received(values)
+
+    def get_values(self, start, end, **kwargs):
+        """
+        start and end are (row, col) tuples (1-based) like in pygsheets
+        """
+        self._call('get_values')
+        (first_row, first_col), (last_row, last_col) = start, end
+        values = []
+        for row in self.rows[first_row - 1:last_row]:
+            row = row + [''] * (last_col - len(row))
+            values.append(row[first_col - 1:last_col])
+        return self._received(values)
+
+    def insert_rows(self, row, number=1, values=None, inherit=False):
+        """
+        Insert number rows after the row number row
+        """
+        self._call('insert_rows', values)
+        values = values or []
+        if values and not isinstance(values[0], list):
+            values = [values]
+        new_rows = [[self._parse_value(value) for value in row_values] for row_values in values]
+        new_rows.extend([] for _ in range(number - len(new_rows)))
+        self.rows[row:row] = new_rows
+        self._save()
+
+    def update_values_batch(self, ranges, values, majordim='ROWS', parse=None):
+        self._call('update_values_batch', values)
+        for a1_range, range_values in zip(ranges, values):
+            first_row, first_col = self._parse_a1_cell(a1_range.split(':')[0])
+            for row_offset, row_values in enumerate(range_values):
+                row_index = first_row - 1 + row_offset
+                while len(self.rows) <= row_index:
+                    self.rows.append([])
+                row = self.rows[row_index]
+                for col_offset, value in enumerate(row_values):
+                    col_index = first_col - 1 + col_offset
+                    row.extend([''] * (col_index + 1 - len(row)))
+                    row[col_index] = self._parse_value(value)
+        self._save()
+
+    def delete_rows(self, index, number=1):
+        self._call('delete_rows')
+        del self.rows[index - 1:index - 1 + number]
+        self._save()
+
+    @property
+    def frozen_rows(self):
+        return self._frozen_rows
+
+    @frozen_rows.setter
+    def frozen_rows(self, value):
+        self._call('frozen_rows')
+        self._frozen_rows = value
+
+
+# Authorized pygsheets clients shared by the whole process: creds file path -> client
+pygsheets_clients = dict()
+pygsheets_clients_lock = threading.Lock()
+
+
+def get_pygsheets_client(creds_file_path):
+    """
+    Get the pygsheets client of a service account creds file, authorizing it only the first time
+    """
+    import pygsheets
+    with pygsheets_clients_lock:
+        if creds_file_path not in pygsheets_clients:
+            pygsheets_clients[creds_file_path] = pygsheets.authorize(service_file=creds_file_path)
+
+        return pygsheets_clients[creds_file_path]
+
+
+def get_pygsheets_wks(gs_cfg, root_path):
     """
     Get a Google Sheet API handle to get/set worksheet data
     """
@@ -309,7 +1042,9 @@ def get_gs_wks(gs_cfg, root_path):
     sheet_name      = gs_cfg.get('sheet_name', 'my_audible_books_generated_by_audible2sheet')
     gs_email        = gs_cfg.get('email')
     
-    gc = pygsheets.authorize(service_file=creds_file_path)
+    # pygsheets (and its dependencies) are only imported when the Google Sheet is needed since they're slow to import
+    import pygsheets
+    gc = get_pygsheets_client(creds_file_path)
     try: 
         sheet = gc.open(sheet_name)
     except pygsheets.SpreadsheetNotFound as error:
@@ -324,207 +1059,1855 @@ def get_gs_wks(gs_cfg, root_path):
 
         # Share to all for reading
         sheet.share('', role='reader', type='anyone')
-        wks = sheet.sheet1
+    wks = sheet.sheet1
 
     return wks
 
 
-def get_gs_books_and_save_to_file(wks, gs_library_path):
+def get_local_wks(gs_cfg, root_path):
+    """
+    Get a local worksheet saved in a JSON file instead of a Google Sheet (useful to test/benchmark offline)
+    """
+    local_file_path      = create_full_path(gs_cfg.get('local_file_path', GSHEET_LOCAL_FILE_PATH_DEFAULT), root_path)
+    latency              = float(gs_cfg.get('local_latency', 0))
+    max_calls_per_minute = gs_cfg.get('local_max_calls_per_minute')
+    if max_calls_per_minute:
+        max_calls_per_minute = int(max_calls_per_minute)
+
+    return LocalWorksheet(local_file_path, latency, max_calls_per_minute or None)
+
+
+# Worksheet backends by name as specified by "backend" in the google_sheet_cfg section
+GS_WKS_BACKENDS = {
+    'pygsheets': get_pygsheets_wks,
+    'local':     get_local_wks,
+}
+
+
+def get_gs_wks(gs_cfg, root_path):
+    """
+    Get a worksheet handle from the backend specified in the configuration (a Google Sheet by default)
+    """
+    backend = gs_cfg.get('backend', 'pygsheets')
+    if backend not in GS_WKS_BACKENDS:
+        raise Exception(f"Unknown worksheet backend:{backend} (available: {', '.join(GS_WKS_BACKENDS)})")
+
+    return GS_WKS_BACKENDS[backend](gs_cfg, root_path)
+
+
+def get_gs_books_and_save_to_file(wks, gs_library_path, default_header_cols=None):
     """
     Get the data from the GoogleSheet or create the sheet if it doesn't already exist
+    (with default_header_cols as header, the Book fields by default)
     Return the list of cols in the header
     """
-    gs_rows = wks.get_all_values(include_tailing_empty_rows=False)
+    with profiler.stage('gsheet_download') as counts:
+        gs_rows = wks.get_all_values(include_tailing_empty_rows=False)
+        counts['items'] = len(gs_rows)
 
-    gs_header_cols = gs_rows[0]
+    gs_header_cols = gs_rows[0] if gs_rows else []
     if all(s == '' or s.isspace() for s in gs_header_cols):
         # There's no header yet and so initialize it with some default including freezing the header
-        gs_header_cols = Book.FIELD_NAMES
+        gs_header_cols = list(default_header_cols or Book.FIELD_NAMES)
         wks.insert_rows(0, values=[gs_header_cols])
         wks.frozen_rows = 1
-
-    with open(gs_library_path, 'w', newline='') as csv_file:
-        csv_writer = csv.writer(csv_file, delimiter='|')
-        csv_writer.writerows(gs_rows)
+        # keep the rows in the file aligned with the rows in the sheet
+        gs_rows = [gs_header_cols] + gs_rows
+
+    with profiler.stage('gsheet_save') as counts:
+        with open_cache_file(gs_library_path, 'w', newline='') as csv_file:
+            csv_writer = csv.writer(csv_file, delimiter='|')
+            csv_writer.writerows(gs_rows)
+        counts['items'] = len(gs_rows)
+        counts['bytes'] = os.path.getsize(gs_library_path)
     print(f"Saved {len(gs_rows)} books in {gs_library_path}", file=sys.stderr)
 
     return gs_header_cols
 
 
+def get_book_row_builder(books, gs_header_cols):
+    """
+    Return a function creating the GS row of the book at a given position in the BookTable
+    respecting the order of the columns in the GS header
+    Columns unknown to Book (most likely managed by the user) are left empty
+    """
+    columns = [books.columns.get(gs_field) for gs_field in gs_header_cols]
+
+    def build_book_row(position):
+        row_cols = []
+        for column in columns:
+            if column is not None:
+                field_value = column[position]
+                # Special case with ASIN where leading zeroes would be stripped otherwise
+                if field_value.startswith("0"):
+                    # prefix with a leading ' to tell GS not to strip the leasing zeros
+                    field_value = "'"+field_value
+            else:
+                field_value = ""
+            row_cols.append(field_value)
+        return row_cols
+
+    return build_book_row
+
+
 def get_new_book_rows(audible_books, gs_books, gs_header_cols):
     """
     Go over all the Audible books to see if any new were added vs the GS list of books
     The ASIN is used as a key to map books in Audible and GS
     The user might have added new columns and suffled in the order of the columns; we should respect that
     """
-    new_book_rows = []
-    for asin, audible_book in audible_books.items():
-        if not asin in gs_books:
-            book_dict = audible_book.book_to_dict()
-            new_row_cols = []
-            for gs_field in gs_header_cols:
-                if gs_field in book_dict:
-                    field_value = book_dict[gs_field]
-                    # Special case with ASIN where leading zeroes would be stripped otherwise
-                    if field_value.startswith("0"):
-                        # prefix with a leading ' to tell GS not to strip the leasing zeros
-                        field_value = "'"+field_value
-                else:
-                    field_value = ""
-                new_row_cols.append(field_value)
-            new_book_rows.append(new_row_cols)
-            print(f"ADD: {audible_book}", file=sys.stderr)
+    with profiler.stage('gsheet_diff_new_rows') as counts:
+        build_book_row = get_book_row_builder(audible_books, gs_header_cols)
+        new_book_rows = []
+        for asin, position in audible_books.asin_index.items():
+            if not asin in gs_books:
+                new_book_rows.append(build_book_row(position))
+                print(f"ADD: {audible_books.get_book(position)}", file=sys.stderr)
+        counts['items'] = len(new_book_rows)
 
     return new_book_rows
 
 
-def insert_new_book_row_to_gs_wks(wks, new_book_rows):
-    print(f"Need to insert {len(new_book_rows)} new books/rows...", file=sys.stderr)
-    wks.insert_rows(1, number=len(new_book_rows), values=new_book_rows)
+class BookRowsDiff:
+    """
+    Changes to apply to the GS rows so that they match the Audible books:
+        * insert_rows: new rows to insert at the top of the sheet
+        * update_rows: (row number, row) of the rows where at least one managed field changed
+        * delete_row_numbers: row numbers of books no longer in Audible
+        * managed_fields: fields of the GS header coming from Audible (the other columns are managed by the user)
+    """
+    def __init__(self):
+        self.insert_rows        = []
+        self.update_rows        = []
+        self.delete_row_numbers = []
+        self.managed_fields     = list(Book.FIELD_NAMES)
 
-    
-def create_full_path(path, root_path):
-    """ 
-    check if a path is absolute
-    if absolute return as-is, otherwise return root_path/path
+    def __len__(self):
+        return len(self.insert_rows) + len(self.update_rows) + len(self.delete_row_numbers)
+
+
+def get_book_rows_diff(audible_books, gs_books, gs_header_cols, delete_missing_books=False):
     """
-    if os.path.isabs(path):
-        return path
-    else:
-        return root_path + "/" + path
-    
+    Compare the Audible books with the GS books (BookTables) field by field (only the Audible fields present in the GS header)
+    and sort the rows into insert, update and delete groups
+    """
+    diff = BookRowsDiff()
+    diff.insert_rows = get_new_book_rows(audible_books, gs_books, gs_header_cols)
+    diff.managed_fields = [gs_field for gs_field in gs_header_cols
+                           if gs_field in audible_books.columns and gs_field in gs_books.columns]
+
+    build_book_row = get_book_row_builder(audible_books, gs_header_cols)
+    managed_columns = [(audible_books.columns[gs_field], gs_books.columns[gs_field]) for gs_field in diff.managed_fields]
+    gs_asin_index = gs_books.asin_index
+    for asin, position in audible_books.asin_index.items():
+        gs_position = gs_asin_index.get(asin)
+        if gs_position is not None:
+            if any(audible_column[position] != gs_column[gs_position] for audible_column, gs_column in managed_columns):
+                diff.update_rows.append((gs_books.row_numbers[gs_position], build_book_row(position)))
+                print(f"UPDATE: {audible_books.get_book(position)}", file=sys.stderr)
+
+    if delete_missing_books:
+        for asin, gs_position in gs_asin_index.items():
+            if not asin in audible_books:
+                diff.delete_row_numbers.append(gs_books.row_numbers[gs_position])
+                print(f"DELETE: {gs_books.get_book(gs_position)}", file=sys.stderr)
+
+    return diff
+
+
+def get_a1_column_name(col_number):
+    """
+    Convert a column number (1 for the first column) into its A1 notation name: A, B, ..., Z, AA, AB, ...
+    """
+    name = ""
+    while col_number > 0:
+        col_number, remainder = divmod(col_number - 1, 26)
+        name = chr(ord('A') + remainder) + name
+
+    return name
+
 
-def get_audible_books_and_save_to_file(audible_cfg, root_path):
+def group_consecutive_numbers(numbers):
     """
-    Use the Audible API to get the list of all books from Audible and save the list 
+    Group sorted numbers into (first, last) runs of consecutive numbers: [1, 2, 3, 7, 8] -> [(1, 3), (7, 8)]
     """
-    # Audible cfg data
-    audible_email            = audible_cfg.get('email')
-    audible_password         = audible_cfg.get('password')
-    audible_locale           = audible_cfg.get('locale', 'us')
-    audible_session_path     = create_full_path(audible_cfg.get('session_file_path', 'audible_session.txt'), root_path)
-    audible_library_path     = create_full_path(audible_cfg.get('library_file_path', AUDIBLE_FILE_PATH_DEFAULT), root_path)
-    audible_raw_library_path = create_full_path(audible_cfg.get('raw_library_file_path', AUDIBLE_RAW_FILE_PATH_DEFAULT), root_path)
-    audible_min_length       = int(audible_cfg.get('min_length', 5))
-    content_type_to_omit     = audible_cfg.get('content_type_to_omit', '').split(",")
-    asins_to_omit            = audible_cfg.get('asins_to_omit', '').split(" ")
+    runs = []
+    for number in sorted(numbers):
+        if runs and runs[-1][1] + 1 == number:
+            runs[-1] = (runs[-1][0], number)
+        else:
+            runs.append((number, number))
 
-    # Establish a client session with Audible
-    audible_session = AudibleClient(audible_email, audible_password, audible_locale, audible_session_path)
-    if not audible_session.is_logged_in():
-        raise Exception("Failed to connect to Audible")
+    return runs
 
-    # get list of books from Audible library
-    # since there's no way to know how many books or pages of books, assume that it won't be more that 100*500
-    books = []
-    with open(audible_raw_library_path, 'w') as raw_writer:
-        for page in range(1, 100):
-            print(f"Requesting Audible page #{page}...", file=sys.stderr)
-            library, response = audible_session.get(
-                "library",
-                num_results=500,  # get 500 items at a time
-                page=page,
-                response_groups="product_desc,contributors,product_attrs,category_ladders,series",
-            )
-            items = library["items"]
-            if response and items:
-                for item in items:
-                    raw_writer.write(json.dumps(item)+"\n")
-                    asin = item["asin"]
-                    length_min = item["runtime_length_min"]
-                    if (
-                            (not item["content_type"] in content_type_to_omit) and 
-                            (not asin                 in asins_to_omit) and
-                            length_min >= audible_min_length
-                    ):
-                        title = item["title"]
-                        sub_title = item["subtitle"]
-                        if sub_title:
-                            title = title + ": " + sub_title
-
-                        all_authors = item["authors"]
-                        authors = extract_authors_from_json_data(all_authors)
-
-                        purchase_date_utc = item["purchase_date"]
-                        purchase_date = convert_utc_time_to_ccyymmdd(purchase_date_utc)
-
-                        length_hr_min = convert_length_in_minutes_to_hr_min_str(length_min)
-
-                        books.append(
-                            "|".join([asin, title, authors, length_hr_min, purchase_date])
-                        )
-            else:
-                #        print("Done with getting the library")
-                break
-    if books:
-        # write to cache file
-        with open(audible_library_path, 'w') as writer:
-            # Note the header here that cannot change and is used as info key for each book
-            header = "|".join(Book.FIELD_NAMES)
-            writer.write(header+"\n")
-            for book in books:
-                writer.write(book+"\n")
-        print(f"Saved {len(books)} Audible book in {audible_library_path}", file=sys.stderr);
 
-def print_raw_data_fields_list(raw_library_file_path, specific_field):
-    fields = defaultdict(dict) 
-    with open(raw_library_file_path, 'r') as raw_file:
-        for json_raw_book in raw_file:
-            book_as_dict = (json.loads(json_raw_book))
-            for field in book_as_dict.keys():
-                value = extract_correct_information_from_field_data(field, book_as_dict[field])
-                if len(fields[field]) == 0 or value not in fields[field]:
-                    fields[field][value] = 1
-                else:
-                    fields[field][value] += 1
+def get_update_ranges_and_values(update_rows, gs_header_cols, managed_fields=None):
+    """
+    Create the A1 ranges (and their values) covering only the managed columns (the Book ones by default) of the updated rows
+    Consecutive rows and consecutive columns are merged into a single range to keep the number of ranges small
+    """
+    managed_fields = managed_fields or Book.FIELD_NAMES
+    managed_col_numbers = [col_index + 1 for col_index, gs_field in enumerate(gs_header_cols) if gs_field in managed_fields]
+    rows_by_number = dict(update_rows)
+    ranges = []
+    values = []
+    for first_row, last_row in group_consecutive_numbers(rows_by_number):
+        for first_col, last_col in group_consecutive_numbers(managed_col_numbers):
+            ranges.append(f"{get_a1_column_name(first_col)}{first_row}:{get_a1_column_name(last_col)}{last_row}")
+            values.append([rows_by_number[row_number][first_col - 1:last_col] for row_number in range(first_row, last_row + 1)])
 
-    if specific_field == None:
-        for field in sorted(fields):
-            values = fields[field]
-            n_values = len(values)
-            if n_values == 1:
-                sole_key = list(values.keys())[0]
-                msg = f"Always {sole_key}"
-            else:
-                msg = f"{n_values} different values"
-            print(f"{field} ({msg})")
-    else:
-        values = fields[specific_field]
-        for value, count in values.items():
-            print(f"{value} ({count})")
-            
+    return ranges, values
 
-        
-def print_file_as_is(file_to_print):
-    with open(file_to_print, 'r') as file:
-        print(file.read())
 
-        
-def print_specified_field_from_raw_file(raw_file_path, specified_fields, asin_filter):
-    header = "|".join(specified_fields)
-    print(header)
-    with open(raw_file_path, 'r') as raw_file:
-        for json_raw_book in raw_file:
-            book_as_dict = (json.loads(json_raw_book))
-            if asin_filter is None or asin_filter == book_as_dict["asin"]:
-                columns = []
-                for field in specified_fields:
-                    if field in book_as_dict and book_as_dict[field] is not None:
-                        col_value = extract_correct_information_from_field_data(field, book_as_dict[field])
-                    else:
-                        col_value = '???'
-                    columns.append(col_value)
-                print("|".join(columns))
+def insert_new_book_row_to_gs_wks(wks, new_book_rows):
+    print(f"Need to insert {len(new_book_rows)} new books/rows...", file=sys.stderr)
+    with profiler.stage('gsheet_insert') as counts:
+        wks.insert_rows(1, number=len(new_book_rows), values=new_book_rows)
+        counts['items'] = len(new_book_rows)
 
-def parse_args(args):
-    parser = argparse.ArgumentParser(
-        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-        description="""
+
+def apply_book_rows_diff_to_gs_wks(wks, diff, gs_header_cols):
+    """
+    Apply the changes with as few calls as possible:
+    updates in one batch call, deletes per run of consecutive rows (bottom up) and then inserts at the top
+    Updates and deletes are done first since inserting rows would shift the row numbers
+    """
+    if diff.update_rows:
+        ranges, values = get_update_ranges_and_values(diff.update_rows, gs_header_cols, diff.managed_fields)
+        print(f"Need to update {len(diff.update_rows)} books/rows in {len(ranges)} ranges...", file=sys.stderr)
+        with profiler.stage('gsheet_update') as counts:
+            wks.update_values_batch(ranges, values)
+            counts['items'] = len(diff.update_rows)
+
+    if diff.delete_row_numbers:
+        print(f"Need to delete {len(diff.delete_row_numbers)} books/rows...", file=sys.stderr)
+        with profiler.stage('gsheet_delete') as counts:
+            for first_row, last_row in reversed(group_consecutive_numbers(diff.delete_row_numbers)):
+                wks.delete_rows(first_row, number=last_row - first_row + 1)
+            counts['items'] = len(diff.delete_row_numbers)
+
+    if diff.insert_rows:
+        insert_new_book_row_to_gs_wks(wks, diff.insert_rows)
+
+
+def get_gs_manifest_path(gs_library_path):
+    """
+    The manifest of the GS rows lives next to the GS cache file
+    """
+    return gs_library_path + GSHEET_MANIFEST_SUFFIX
+
+
+def get_gs_row_hash(values):
+    """
+    Hash of the managed values of a GS row (in the GS header order) used to detect changes without reading the row
+    """
+    return hashlib.md5("|".join(values).encode()).hexdigest()
+
+
+def get_book_row_hashes(books, managed_fields):
+    """
+    ASIN -> hash of the managed values of each book of a BookTable
+    """
+    columns = [books.columns[field] for field in managed_fields]
+
+    return {asin: get_gs_row_hash([column[position] for column in columns]) for asin, position in books.asin_index.items()}
+
+
+def load_gs_manifest(manifest_path):
+    """
+    Load the GS header and the ASIN -> row hash of the rows as they were left by the last sync
+    Return (None, {}) if there's no (valid) manifest
+    """
+    if not os.path.exists(manifest_path):
+        return None, dict()
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        return manifest['header'], manifest['hashes']
+    except (ValueError, KeyError):
+        warn(f"Ignoring invalid GS manifest file:{manifest_path}")
+        return None, dict()
+
+
+def save_gs_manifest(manifest_path, gs_header_cols, hashes):
+    with AtomicFileWriter(manifest_path) as manifest_file:
+        json.dump({'header': gs_header_cols, 'hashes': hashes}, manifest_file)
+
+
+def get_gs_row_index_from_manifest(wks, gs_header_cols, manifest_hashes, managed_fields):
+    """
+    Read only the ASIN column of the sheet and return (ASIN -> row number, ASIN -> row hash)
+    The hashes come from the manifest: only the rows whose ASIN is unknown to the manifest (e.g. added by the user)
+    are downloaded to hash them, one call per run of consecutive rows
+    Return None when there are too many such runs (and so the whole sheet should be downloaded instead)
+    """
+    asin_col_index = gs_header_cols.index(Book.FIELD_NAME_ASIN)
+    with profiler.stage('gsheet_download') as counts:
+        asins = wks.get_col(asin_col_index + 1, include_tailing_empty=False)
+        counts['items'] = len(asins)
+
+    row_numbers = dict()
+    for row_number, asin in enumerate(asins[1:], 2):
+        if asin and not asin.isspace():
+            row_numbers[asin] = row_number
+    hashes = {asin: manifest_hashes[asin] for asin in row_numbers if asin in manifest_hashes}
+    unknown_row_runs = group_consecutive_numbers(row_number for asin, row_number in row_numbers.items() if asin not in hashes)
+    if len(unknown_row_runs) > GSHEET_MAX_ROW_FETCHES:
+        print(f"{len(unknown_row_runs)} runs of GS rows unknown to the manifest: downloading the whole sheet", file=sys.stderr)
+        return None
+
+    n_cols = len(gs_header_cols)
+    managed_col_indexes = [gs_header_cols.index(field) for field in managed_fields]
+    with profiler.stage('gsheet_row_fetch') as counts:
+        for first_row, last_row in unknown_row_runs:
+            for row in wks.get_values((first_row, 1), (last_row, n_cols)):
+                row = row + [''] * (n_cols - len(row))
+                hashes[row[asin_col_index]] = get_gs_row_hash([row[col_index] for col_index in managed_col_indexes])
+                counts['items'] += 1
+
+    return row_numbers, hashes
+
+
+def get_book_rows_diff_from_hashes(audible_books, audible_hashes, gs_row_numbers, gs_hashes, gs_header_cols, managed_fields,
+                                   delete_missing_books=False):
+    """
+    Same as get_book_rows_diff but comparing the hashes of the managed values of the rows instead of the values themselves
+    (the GS books being only known by their ASIN, row number and row hash)
+    """
+    diff = BookRowsDiff()
+    diff.insert_rows = get_new_book_rows(audible_books, gs_row_numbers, gs_header_cols)
+    diff.managed_fields = managed_fields
+
+    build_book_row = get_book_row_builder(audible_books, gs_header_cols)
+    for asin, position in audible_books.asin_index.items():
+        row_number = gs_row_numbers.get(asin)
+        if row_number is not None and audible_hashes[asin] != gs_hashes.get(asin):
+            diff.update_rows.append((row_number, build_book_row(position)))
+            print(f"UPDATE: {audible_books.get_book(position)}", file=sys.stderr)
+
+    if delete_missing_books:
+        for asin, row_number in gs_row_numbers.items():
+            if not asin in audible_books:
+                diff.delete_row_numbers.append(row_number)
+                print(f"DELETE: {asin} (row {row_number})", file=sys.stderr)
+
+    return diff
+
+
+class SheetBooks:
+    """
+    GS books as needed to diff them with the Audible books:
+        * header_cols: GS header
+        * books: BookTable of the whole sheet (None if only the ASIN column was downloaded thanks to the manifest)
+        * row_numbers, hashes: ASIN -> row number and ASIN -> row hash (from the manifest, when books is None)
+        * managed_fields: fields of the GS header coming from Audible which are hashed
+    """
+    def __init__(self, header_cols, books=None, row_numbers=None, hashes=None, managed_fields=None):
+        self.header_cols    = header_cols
+        self.books          = books
+        self.row_numbers    = row_numbers
+        self.hashes         = hashes
+        self.managed_fields = managed_fields
+
+
+def load_gs_sheet_books(wks, gs_library_path, field_names, manifest_path=None):
+    """
+    Get the GS books with the specified (Audible) fields
+    With a manifest (ASIN -> row hash saved by the previous sync), only the header and the ASIN column are downloaded
+    as long as the header didn't change; otherwise the whole sheet is downloaded (and saved to gs_library_path)
+    Only the fields (and not the Audible books) are needed and so this can run while the Audible books are fetched
+    """
+    manifest_header, manifest_hashes = load_gs_manifest(manifest_path) if manifest_path else (None, dict())
+    if manifest_header:
+        gs_header_cols = wks.get_row(1, include_tailing_empty=False)
+        if gs_header_cols == manifest_header:
+            managed_fields = [gs_field for gs_field in gs_header_cols if gs_field in field_names]
+            gs_row_index = get_gs_row_index_from_manifest(wks, gs_header_cols, manifest_hashes, managed_fields)
+            if gs_row_index is not None:
+                gs_row_numbers, gs_hashes = gs_row_index
+                return SheetBooks(gs_header_cols, row_numbers=gs_row_numbers, hashes=gs_hashes, managed_fields=managed_fields)
+
+    # The GS books are loaded with the same (Book and extra) columns as the Audible books
+    gs_header_cols = get_gs_books_and_save_to_file(wks, gs_library_path, field_names)
+    with profiler.stage('gsheet_books_load') as counts:
+        gs_books = BookTable.from_file(gs_library_path, field_names)
+        counts['items'] = len(gs_books)
+
+    return SheetBooks(gs_header_cols, books=gs_books)
+
+
+def sync_gs_sheet_books_with_audible_books(wks, sheet_books, audible_books, gs_library_path, delete_missing_books=False,
+                                           manifest_path=None):
+    """
+    Make the GS rows match the Audible books (BookTable) given the GS books loaded by load_gs_sheet_books
+    and save the manifest of the rows (if manifest_path is specified)
+    """
+    gs_header_cols = sheet_books.header_cols
+    if sheet_books.books is None:
+        managed_fields = [gs_field for gs_field in gs_header_cols if gs_field in audible_books.columns]
+        if managed_fields != sheet_books.managed_fields:
+            # the Audible cache file doesn't have the columns of the configuration: the hashes can't be compared
+            sheet_books = load_gs_sheet_books(wks, gs_library_path, audible_books.field_names)
+            gs_header_cols = sheet_books.header_cols
+
+    if sheet_books.books is None:
+        gs_hashes = sheet_books.hashes
+        audible_hashes = get_book_row_hashes(audible_books, managed_fields)
+        with profiler.stage('gsheet_diff') as counts:
+            diff = get_book_rows_diff_from_hashes(audible_books, audible_hashes, sheet_books.row_numbers, gs_hashes,
+                                                  gs_header_cols, managed_fields, delete_missing_books)
+            counts['items'] = len(diff)
+    else:
+        # Create the changes based on the delta between audible and gs and the header columns
+        with profiler.stage('gsheet_diff') as counts:
+            diff = get_book_rows_diff(audible_books, sheet_books.books, gs_header_cols, delete_missing_books)
+            counts['items'] = len(diff)
+        if manifest_path:
+            gs_hashes = get_book_row_hashes(sheet_books.books, diff.managed_fields)
+            audible_hashes = get_book_row_hashes(audible_books, diff.managed_fields)
+
+    if len(diff):
+        apply_book_rows_diff_to_gs_wks(wks, diff, gs_header_cols)
+    else:
+        print("No new or changed books found", file=sys.stderr)
+
+    if manifest_path:
+        # the rows now match the Audible books, except for the rows of the books no longer in Audible (if they were kept)
+        hashes = dict() if delete_missing_books else \
+                 {asin: row_hash for asin, row_hash in gs_hashes.items() if asin not in audible_books}
+        hashes.update(audible_hashes)
+        save_gs_manifest(manifest_path, gs_header_cols, hashes)
+
+
+def load_audible_books(audible_library_path):
+    # Load the list of books from the file into a table for an easy 1x1 comparison based on ASIN
+    with profiler.stage('audible_books_load') as counts:
+        audible_books = BookTable.from_file(audible_library_path)
+        counts['items'] = len(audible_books)
+
+    return audible_books
+
+
+def create_full_path(path, root_path):
+    """ 
+    check if a path is absolute
+    if absolute return as-is, otherwise return root_path/path
+    """
+    if os.path.isabs(path):
+        return path
+    else:
+        return root_path + "/" + path
+    
+
+def get_audible_library_page(audible_session, page, page_size=AUDIBLE_PAGE_SIZE, **params):
+    """
+    Request one page of the Audible library and return it as (items, total_count)
+    total_count is None when Audible doesn't tell us how many books there are in the library
+    Extra params (e.g. sort_by) are passed as-is to Audible
+    """
+    print(f"Requesting Audible page #{page}...", file=sys.stderr)
+    with profiler.stage('audible_page') as counts:
+        library, response = audible_session.get(
+            "library",
+            num_results=page_size,  # get 500 items at a time by default
+            page=page,
+            response_groups=AUDIBLE_RESPONSE_GROUPS,
+            **params
+        )
+        items = library["items"] if response else []
+        headers = getattr(response, 'headers', None)
+        counts['items'] = len(items)
+        if headers is not None and headers.get('Content-Length') is not None:
+            counts['bytes'] = int(headers.get('Content-Length'))
+
+    total_count = None
+    if headers is not None and headers.get('Total-Count') is not None:
+        total_count = int(headers.get('Total-Count'))
+
+    return items, total_count
+
+
+def iter_audible_library_pages(audible_session, fetch_workers=1, executor=None):
+    """
+    Iterate over all the pages of the Audible library (lists of items) in page order as they arrive
+
+    The first page tells us how many books there are in total (Total-Count header) and so the remaining
+    pages are requested ahead using up to fetch_workers threads (never more than fetch_workers pages in flight).
+    The threads of an already existing executor (e.g. shared by several accounts) can be used instead.
+    Without a total count (or with a single worker), ask for one page at a time until an empty page.
+    """
+    items, total_count = get_audible_library_page(audible_session, 1)
+    if not items:
+        return
+    yield items
+
+    if total_count is not None and fetch_workers > 1:
+        n_pages = min(-(-total_count // AUDIBLE_PAGE_SIZE), AUDIBLE_MAX_PAGES)
+        remaining_pages = iter(range(2, n_pages + 1))
+        with contextlib.nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+            pending_pages = deque(executor.submit(get_audible_library_page, audible_session, page)
+                                  for page in islice(remaining_pages, fetch_workers))
+            # the pages are yielded in the order of the pages and not in the order of completion
+            while pending_pages:
+                items, _ = pending_pages.popleft().result()
+                if not items:
+                    for pending_page in pending_pages:
+                        pending_page.cancel()
+                    break
+                for page in islice(remaining_pages, 1):
+                    pending_pages.append(executor.submit(get_audible_library_page, audible_session, page))
+                yield items
+    else:
+        # since there's no way to know how many books or pages of books, assume that it won't be more that 99*500
+        for page in range(2, AUDIBLE_MAX_PAGES + 1):
+            items, _ = get_audible_library_page(audible_session, page)
+            if not items:
+                #        print("Done with getting the library")
+                break
+            yield items
+
+
+def get_file_compression(file_path):
+    """
+    Get the compression of a file from its extension (see COMPRESSED_FILE_EXTENSIONS), None if it's not compressed
+    """
+    for compression, extension in COMPRESSED_FILE_EXTENSIONS.items():
+        if file_path.endswith(extension):
+            return compression
+
+    return None
+
+
+def open_cache_file(file_path, mode='r', newline=None, compression=None):
+    """
+    Open a cache file as a stream which is (de)compressed on the fly if the file is compressed (.gz or .zst extension)
+    so that it never has to be loaded in memory as a whole; the compression can also be specified explicitly
+    zstd requires the (optional) zstandard package
+    """
+    compression = compression or get_file_compression(file_path)
+    text_kwargs = {'newline': newline} if 'b' not in mode else {}
+    if compression is None:
+        return open(file_path, mode, **text_kwargs)
+    compressed_mode = mode if 'b' in mode else mode + 't'
+    if compression == 'gzip':
+        return gzip.open(file_path, compressed_mode, compresslevel=GZIP_COMPRESS_LEVEL, **text_kwargs)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise Exception(f"The zstandard package is needed for the zstd compressed file: {file_path}")
+        if 'r' not in mode:
+            return zstandard.open(file_path, compressed_mode, **text_kwargs)
+        # the zstandard reader can't read lines: buffer it
+        zstd_file = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True))
+        return zstd_file if 'b' in mode else io.TextIOWrapper(zstd_file, **text_kwargs)
+
+    raise Exception(f"Unknown compression: {compression}")
+
+
+def get_audible_cache_file_path(audible_cfg, key, default_path, root_path):
+    """
+    Get the full path of an Audible cache file with the extension of the compression of the Audible cfg data (if any)
+    unless the file already has the extension of a compression
+    """
+    path = create_full_path(audible_cfg.get(key, default_path), root_path)
+    compression = audible_cfg.get('compression', 'none')
+    if compression != 'none' and get_file_compression(path) is None:
+        if compression not in COMPRESSED_FILE_EXTENSIONS:
+            raise Exception(f"Unknown compression: {compression} (must be one of: none, {', '.join(COMPRESSED_FILE_EXTENSIONS)})")
+        path += COMPRESSED_FILE_EXTENSIONS[compression]
+
+    return path
+
+
+def get_audible_library_path(audible_cfg, root_path):
+    return get_audible_cache_file_path(audible_cfg, 'library_file_path', AUDIBLE_FILE_PATH_DEFAULT, root_path)
+
+
+def get_audible_raw_library_path(audible_cfg, root_path):
+    return get_audible_cache_file_path(audible_cfg, 'raw_library_file_path', AUDIBLE_RAW_FILE_PATH_DEFAULT, root_path)
+
+
+class AtomicFileWriter:
+    """
+    Write to a temporary file in the same directory as file_path and rename it to file_path when done
+    so that file_path is either the previous version or the complete new version, never a partial one.
+    The temporary file is discarded (and file_path left untouched) on error or if discard() was called.
+    """
+    def __init__(self, file_path, mode='w'):
+        self.file_path = file_path
+        self._mode     = mode
+        self._keep     = True
+
+    def __enter__(self):
+        fd, self._temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.file_path)),
+                                               prefix=os.path.basename(self.file_path) + '.', suffix='.tmp')
+        compression = get_file_compression(self.file_path)
+        if compression is None:
+            self._file = os.fdopen(fd, self._mode)
+        else:
+            # compressed based on the extension of the final file (and not of the temporary one)
+            os.close(fd)
+            self._file = open_cache_file(self._temp_path, self._mode, compression=compression)
+        return self
+
+    def write(self, data):
+        self._file.write(data)
+
+    def discard(self):
+        self._keep = False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        if exc_type is None and self._keep:
+            os.replace(self._temp_path, self.file_path)
+        else:
+            os.remove(self._temp_path)
+
+
+# JSON codecs used for the raw cache file
+class JsonCodec:
+    """
+    A JSON codec: dumps(obj) returns bytes (without newline) and loads(data) accepts bytes or str
+    decode_fields(data, fields) only returns the specified fields present in the JSON object
+    """
+    def __init__(self, name, dumps, loads):
+        self.name  = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def decode_fields(self, data, fields):
+        item = self.loads(data)
+        return {field: item[field] for field in fields if field in item}
+
+
+class MsgspecJsonCodec(JsonCodec):
+    """
+    msgspec can decode only some fields of a JSON object (into a struct) skipping the others
+    """
+    def __init__(self):
+        import msgspec
+        self._msgspec = msgspec
+        self._decoders = dict()
+        encoder = msgspec.json.Encoder()
+        super().__init__('msgspec', encoder.encode, msgspec.json.Decoder().decode)
+
+    def decode_fields(self, data, fields):
+        fields = tuple(fields)
+        # the fields become the attributes of a struct: other names (e.g. some-field or __init__) are decoded as a whole
+        if not all(field.isidentifier() and not field.startswith('__') for field in fields):
+            return super().decode_fields(data, fields)
+        if fields not in self._decoders:
+            msgspec = self._msgspec
+            struct = msgspec.defstruct('RawBook', [(field, typing.Any, msgspec.UNSET) for field in fields])
+            self._decoders[fields] = msgspec.json.Decoder(struct)
+        decoded = self._decoders[fields].decode(data)
+        item = dict()
+        for field in fields:
+            value = getattr(decoded, field)
+            if value is not self._msgspec.UNSET:
+                item[field] = value
+        return item
+
+
+def create_stdlib_json_codec():
+    return JsonCodec('json', lambda obj: json.dumps(obj).encode(), json.loads)
+
+
+def create_orjson_json_codec():
+    import orjson
+    return JsonCodec('orjson', orjson.dumps, orjson.loads)
+
+
+# From the fastest to the slowest (json being always available)
+JSON_CODECS = {
+    'orjson':  create_orjson_json_codec,
+    'msgspec': MsgspecJsonCodec,
+    'json':    create_stdlib_json_codec,
+}
+
+
+def get_json_codec(name='auto'):
+    """
+    Get the JSON codec by name or the fastest one installed if name is auto
+    """
+    if name == 'auto':
+        for codec_name, create_codec in JSON_CODECS.items():
+            try:
+                return create_codec()
+            except ImportError:
+                pass
+    if name not in JSON_CODECS:
+        raise Exception(f"Unknown JSON codec:{name} (available: auto, {', '.join(JSON_CODECS)})")
+
+    return JSON_CODECS[name]()
+
+
+def set_raw_json_codec(name):
+    """
+    Set the JSON codec used to read/write the raw cache file
+    """
+    global raw_json_codec
+    raw_json_codec = get_json_codec(name)
+    logging.info(f"Using the {raw_json_codec.name} JSON codec")
+
+
+raw_json_codec = create_stdlib_json_codec()
+
+
+# On-disk cache of the Audible responses
+class CachedResponse:
+    """
+    Response replayed from the ResponseCache (only its headers are kept)
+    """
+    status_code = 200
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class ResponseCache:
+    """
+    On-disk cache of responses (one file per request key) in cache_dir:
+        * entries younger than ttl seconds are used without any request (older ones are requested again)
+        * the least recently used entries are evicted once the cache is bigger than max_size bytes
+    """
+    CACHED_HEADERS = ('Total-Count',)
+
+    def __init__(self, cache_dir, ttl=0, max_size=100 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.ttl       = ttl
+        self.max_size  = max_size
+        self._lock     = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._sizes    = {entry.path: entry.stat().st_size for entry in os.scandir(cache_dir) if entry.name.endswith('.json')}
+
+    @staticmethod
+    def get_key(*parts):
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def load(self, key):
+        """
+        Return the cached entry (dict with stored_at, headers and body) of a key or None if there's none
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = raw_json_codec.loads(entry_file.read())
+        except (OSError, ValueError):
+            return None
+        os.utime(path)   # most recently used
+
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.ttl
+
+    def save(self, key, body, headers):
+        """
+        Save the body and the (useful) headers of a response and evict the least recently used entries if needed
+        """
+        path = self._get_path(key)
+        entry = {
+            "stored_at": time.time(),
+            "headers": {name: headers.get(name) for name in self.CACHED_HEADERS if headers.get(name) is not None},
+            "body": body,
+        }
+        with AtomicFileWriter(path, 'wb') as writer:
+            writer.write(raw_json_codec.dumps(entry))
+        with self._lock:
+            self._sizes[path] = os.path.getsize(path)
+            if sum(self._sizes.values()) > self.max_size:
+                self._evict()
+
+        return entry
+
+    def _evict(self):
+        paths = sorted(self._sizes, key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        total_size = sum(self._sizes.values())
+        for path in paths:
+            if total_size <= self.max_size:
+                break
+            total_size -= self._sizes.pop(path)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class CachedAudibleSession:
+    """
+    Audible session (AudibleClient or anything with the same get) whose responses go through a ResponseCache
+    The requests are keyed by locale, path and parameters (page, page size, response groups, ...)
+    Only the entries younger than the ttl of the cache are used: the Audible client can't send conditional requests
+    (its keyword arguments are all sent as query parameters) and so older entries can't be revalidated
+    """
+    def __init__(self, audible_session, response_cache, locale='us'):
+        self.audible_session = audible_session
+        self.response_cache  = response_cache
+        self.locale          = locale
+        self.hits            = 0
+        self.misses          = 0
+
+    def get(self, path, **params):
+        cache = self.response_cache
+        key = cache.get_key(self.locale, path, params)
+        entry = cache.load(key)
+        if entry is not None and cache.is_fresh(entry):
+            self.hits += 1
+            return entry["body"], CachedResponse(entry["headers"])
+
+        body, response = self.audible_session.get(path, **params)
+        self.misses += 1
+        cache.save(key, body, getattr(response, 'headers', None) or {})
+
+        return body, response
+
+
+def get_audible_response_cache(audible_cfg, root_path):
+    """
+    Create the cache of the Audible responses from the Audible cfg data (None if disabled with a max size of 0, the default)
+    """
+    max_size_mb = float(audible_cfg.get('response_cache_max_size', AUDIBLE_RESPONSE_CACHE_MAX_SIZE_MB_DEFAULT))
+    if max_size_mb <= 0:
+        return None
+    cache_dir = create_full_path(audible_cfg.get('response_cache_dir', AUDIBLE_RESPONSE_CACHE_DIR_DEFAULT), root_path)
+
+    return ResponseCache(cache_dir, float(audible_cfg.get('response_cache_ttl', 0)), int(max_size_mb * 1024 * 1024))
+
+
+# Raw cache file and its ASIN index
+def get_raw_library_index_path(raw_library_path):
+    """
+    The ASIN index lives next to the raw cache file
+    """
+    return raw_library_path + RAW_LIBRARY_INDEX_SUFFIX
+
+
+def get_file_signature(file_path):
+    """
+    Size and modification time of a file used to check if files derived from it are still up to date
+    """
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class SnapshotStore:
+    """
+    Content-addressed store of the raw Audible items of each fetch (snapshot) where an unchanged item is only stored once:
+        * objects.txt: every distinct raw item (one JSON per line) and objects.idx: item checksum -> (byte offset, length)
+        * HEAD: id of the latest snapshot and the checksum of each of its ASINs
+        * SNAPSHOT_ID.json: delta of each snapshot vs the previous one (ASINs added, removed and changed with the checksums
+          and locations of their items) so that diffing snapshots only reads the changes and not the whole library
+    Snapshot ids are UTC timestamps and so sort chronologically
+    """
+    OBJECTS_FILE       = 'objects.txt'
+    OBJECTS_INDEX_FILE = 'objects.idx'
+    HEAD_FILE          = 'HEAD'
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+        self._objects      = None
+        self._objects_file = None
+        self._objects_size = None
+
+    def _get_path(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def objects(self):
+        """
+        Item checksum -> (byte offset, length) in objects.txt (only loaded when items are added)
+        """
+        if self._objects is None:
+            self._objects = dict()
+            if os.path.exists(self._get_path(self.OBJECTS_INDEX_FILE)):
+                with open(self._get_path(self.OBJECTS_INDEX_FILE), 'rb') as index_file:
+                    self._objects = raw_json_codec.loads(index_file.read())
+        return self._objects
+
+    def add(self, checksum, raw_line):
+        """
+        Store a raw item (JSON line) unless an item with the same checksum is already stored
+        """
+        if checksum in self.objects:
+            return
+        if self._objects_file is None:
+            # objects.txt is only ever appended to (bytes not referenced by the index are left by interrupted fetches)
+            self._objects_file = open(self._get_path(self.OBJECTS_FILE), 'ab')
+            self._objects_size = self._objects_file.seek(0, os.SEEK_END)
+        self._objects_file.write(raw_line)
+        self.objects[checksum] = [self._objects_size, len(raw_line)]
+        self._objects_size += len(raw_line)
+
+    def close(self):
+        if self._objects_file is not None:
+            self._objects_file.close()
+            self._objects_file = None
+
+    def get_snapshot_ids(self):
+        return sorted(name[:-len('.json')] for name in os.listdir(self.path) if name.endswith('.json'))
+
+    def load_head(self):
+        """
+        Return the id of the latest snapshot and its ASIN -> item checksum (None and {} if there's no snapshot yet)
+        """
+        if not os.path.exists(self._get_path(self.HEAD_FILE)):
+            return None, dict()
+        with open(self._get_path(self.HEAD_FILE), 'rb') as head_file:
+            head = raw_json_codec.loads(head_file.read())
+
+        return head['id'], head['asins']
+
+    def find_snapshot_id(self, prefix):
+        """
+        Get the id of the only snapshot starting with prefix (e.g. 20240131 for the snapshot of that day)
+        """
+        snapshot_ids = self.get_snapshot_ids()
+        matching_ids = [snapshot_id for snapshot_id in snapshot_ids if snapshot_id.startswith(prefix)]
+        if len(matching_ids) != 1:
+            problem = "Several snapshots" if matching_ids else "No snapshot"
+            raise Exception(f"{problem} matching:{prefix} (available: {', '.join(snapshot_ids) or 'none'})")
+
+        return matching_ids[0]
+
+    def load_snapshot(self, snapshot_id):
+        snapshot_path = self._get_path(snapshot_id + '.json')
+        if not os.path.exists(snapshot_path):
+            raise Exception(f"Unknown snapshot:{snapshot_id} (available: {', '.join(self.get_snapshot_ids()) or 'none'})")
+        with open(snapshot_path, 'rb') as snapshot_file:
+            return raw_json_codec.loads(snapshot_file.read())
+
+    def commit(self, checksums):
+        """
+        Create a snapshot of the ASIN -> item checksum of the items added to the store and return its id
+        """
+        self.close()
+        parent_id, parent_checksums = self.load_head()
+        added   = {asin: checksum for asin, checksum in checksums.items() if asin not in parent_checksums}
+        removed = {asin: checksum for asin, checksum in parent_checksums.items() if asin not in checksums}
+        changed = {asin: [parent_checksums[asin], checksum] for asin, checksum in checksums.items()
+                   if asin in parent_checksums and parent_checksums[asin] != checksum}
+        referenced = list(added.values()) + list(removed.values()) + [checksum for pair in changed.values() for checksum in pair]
+        now = datetime.now(timezone.utc)
+        snapshot_id = now.strftime("%Y%m%dT%H%M%S.%fZ")
+        snapshot = {
+            'id':      snapshot_id,
+            'parent':  parent_id,
+            'created': now.isoformat(),
+            'n_items': len(checksums),
+            'added':   added,
+            'removed': removed,
+            'changed': changed,
+            'objects': {checksum: self.objects[checksum] for checksum in referenced if checksum in self.objects},
+        }
+        # the objects first so that a snapshot never refers to items that aren't indexed
+        with AtomicFileWriter(self._get_path(self.OBJECTS_INDEX_FILE), 'wb') as index_file:
+            index_file.write(raw_json_codec.dumps(self.objects))
+        with AtomicFileWriter(self._get_path(snapshot_id + '.json'), 'wb') as snapshot_file:
+            snapshot_file.write(raw_json_codec.dumps(snapshot))
+        with AtomicFileWriter(self._get_path(self.HEAD_FILE), 'wb') as head_file:
+            head_file.write(raw_json_codec.dumps({'id': snapshot_id, 'asins': checksums}))
+
+        return snapshot_id
+
+    def read_items(self, objects):
+        """
+        Read the items at the locations (checksum -> (byte offset, length)) and return checksum -> item
+        """
+        items = dict()
+        with open(self._get_path(self.OBJECTS_FILE), 'rb') as objects_file:
+            for checksum, (offset, length) in sorted(objects.items(), key=lambda location: location[1][0]):
+                objects_file.seek(offset)
+                items[checksum] = raw_json_codec.loads(objects_file.read(length))
+
+        return items
+
+    def diff(self, old_id, new_id):
+        """
+        Compare 2 snapshots by composing the deltas of the snapshots in between (either way)
+        Return (added, removed, changed) with ASIN -> item for added and removed and ASIN -> (old item, new item) for changed
+        """
+        snapshot_ids = self.get_snapshot_ids()
+        for snapshot_id in (old_id, new_id):
+            if snapshot_id not in snapshot_ids:
+                raise Exception(f"Unknown snapshot:{snapshot_id} (available: {', '.join(snapshot_ids) or 'none'})")
+        first, last = sorted((snapshot_ids.index(old_id), snapshot_ids.index(new_id)))
+        # ASIN -> [checksum in the first snapshot, checksum in the last snapshot] (None when not in the snapshot)
+        checksums = dict()
+        objects = dict()
+        for snapshot_id in snapshot_ids[first + 1:last + 1]:
+            snapshot = self.load_snapshot(snapshot_id)
+            objects.update(snapshot['objects'])
+            changes = [(asin, None, checksum) for asin, checksum in snapshot['added'].items()] + \
+                      [(asin, checksum, None) for asin, checksum in snapshot['removed'].items()] + \
+                      [(asin, old, new) for asin, (old, new) in snapshot['changed'].items()]
+            for asin, old, new in changes:
+                checksums.setdefault(asin, [old, None])[1] = new
+        if snapshot_ids.index(old_id) > snapshot_ids.index(new_id):
+            checksums = {asin: [new, old] for asin, (old, new) in checksums.items()}
+
+        checksums = {asin: pair for asin, pair in checksums.items() if pair[0] != pair[1]}
+        items = self.read_items({checksum: objects[checksum] for pair in checksums.values() for checksum in pair if checksum})
+        added   = {asin: items[new] for asin, (old, new) in checksums.items() if old is None}
+        removed = {asin: items[old] for asin, (old, new) in checksums.items() if new is None}
+        changed = {asin: (items[old], items[new]) for asin, (old, new) in checksums.items() if old and new}
+
+        return added, removed, changed
+
+
+def get_audible_snapshot_store(audible_cfg, root_path):
+    """
+    Get the snapshot store specified by the Audible cfg data (None if snapshot_dir is empty, the default)
+    """
+    snapshot_dir = audible_cfg.get('snapshot_dir', AUDIBLE_SNAPSHOT_DIR_DEFAULT)
+    if not snapshot_dir:
+        return None
+
+    return SnapshotStore(create_full_path(snapshot_dir, root_path))
+
+
+def get_changed_fields(old_item, new_item):
+    """
+    Fields whose value changed between 2 versions of an item: field -> (old value, new value) (None when missing)
+    """
+    fields = list(old_item) + [field for field in new_item if field not in old_item]
+
+    return {field: (old_item.get(field), new_item.get(field)) for field in fields if old_item.get(field) != new_item.get(field)}
+
+
+class RawLibraryWriter:
+    """
+    Write raw Audible items (one JSON per line) to the raw cache file (atomically)
+    and save the ASIN->(byte offset, length) index of the lines, the field stats and the sync state
+    (if sync_state_path is specified) once done
+    The items are also added to the snapshot store (if specified) as a new snapshot once done
+    """
+    def __init__(self, raw_library_path, sync_state_path=None, snapshot_store=None):
+        self.raw_library_path = raw_library_path
+        self.sync_state_path  = sync_state_path
+        self.snapshot_store   = snapshot_store
+        self.asins            = dict()
+        self.stats            = RawFieldStats(max_values=RAW_FIELD_STATS_MAX_VALUES)
+        self.checksums        = dict()
+        self.purchase_date    = None
+        self._offset          = 0
+        self._dumps_seconds   = 0.0
+
+    def __enter__(self):
+        self._raw_writer = AtomicFileWriter(self.raw_library_path, 'wb').__enter__()
+        return self
+
+    def write(self, item):
+        start = time.perf_counter()
+        line = raw_json_codec.dumps(item) + b"\n"
+        self._dumps_seconds += time.perf_counter() - start
+        self._raw_writer.write(line)
+        self.asins.setdefault(item["asin"], [self._offset, len(line)])
+        self._offset += len(line)
+        self.stats.add(item)
+        if self.sync_state_path or self.snapshot_store:
+            checksum = self.checksums[item["asin"]] = get_audible_item_checksum(item)
+            if self.snapshot_store:
+                self.snapshot_store.add(checksum, line)
+            purchase_date = item.get("purchase_date")
+            if purchase_date and (self.purchase_date is None or purchase_date > self.purchase_date):
+                self.purchase_date = purchase_date
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._raw_writer.__exit__(exc_type, exc_value, traceback)
+        profiler.add('raw_json_dumps', self._dumps_seconds, len(self.asins), self._offset)
+        if exc_type is None:
+            save_raw_library_index(self.raw_library_path, self.asins)
+            self.stats.save(get_raw_library_stats_path(self.raw_library_path), get_file_signature(self.raw_library_path))
+            if self.sync_state_path:
+                save_audible_sync_state(self.sync_state_path, self.purchase_date, self.checksums)
+            if self.snapshot_store:
+                snapshot_id = self.snapshot_store.commit(self.checksums)
+                logging.info(f"Saved snapshot {snapshot_id} in {self.snapshot_store.path}")
+        elif self.snapshot_store:
+            self.snapshot_store.close()
+
+
+def save_raw_library_index(raw_library_path, asins):
+    with open(get_raw_library_index_path(raw_library_path), 'w') as index_file:
+        json.dump({'signature': get_file_signature(raw_library_path), 'asins': asins}, index_file)
+
+
+def build_raw_library_index(raw_library_path):
+    """
+    Scan the whole raw cache file to (re)build its ASIN index
+    """
+    asins = dict()
+    offset = 0
+    with open_cache_file(raw_library_path, 'rb') as raw_file:
+        for json_raw_book in raw_file:
+            if json_raw_book.strip():
+                asins.setdefault(raw_json_codec.decode_fields(json_raw_book, ("asin",))["asin"], [offset, len(json_raw_book)])
+            offset += len(json_raw_book)
+    save_raw_library_index(raw_library_path, asins)
+
+    return asins
+
+
+def load_valid_raw_library_index(raw_library_path):
+    """
+    Get the ASIN->(byte offset, length) index of the raw cache file
+    Return None if it's missing or if the raw cache file changed since it was saved
+    """
+    index_path = get_raw_library_index_path(raw_library_path)
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, 'rb') as index_file:
+                index = raw_json_codec.loads(index_file.read())
+            if index.get('signature') == get_file_signature(raw_library_path):
+                return index['asins']
+        except ValueError:
+            pass
+
+    return None
+
+
+def load_raw_library_index(raw_library_path):
+    """
+    Get the ASIN->(byte offset, length) index of the raw cache file
+    The index is rebuilt if it's missing or if the raw cache file changed since it was saved
+    """
+    asins = load_valid_raw_library_index(raw_library_path)
+    if asins is not None:
+        return asins
+    logging.info(f"Rebuilding index of {raw_library_path}")
+
+    return build_raw_library_index(raw_library_path)
+
+
+def decode_raw_item(json_raw_book, fields=None):
+    """
+    Decode a raw cache file line into a dict with only the specified fields (all of them if None)
+    """
+    if fields is None:
+        return raw_json_codec.loads(json_raw_book)
+
+    return raw_json_codec.decode_fields(json_raw_book, fields)
+
+
+def get_raw_library_asin_pattern(asins):
+    """
+    Byte pattern of the "asin" key of any of the ASINs, with or without a space after the colon (json vs orjson/msgspec)
+    """
+    return re.compile(rb'"asin": ?"(' + b"|".join(re.escape(asin.encode()) for asin in sorted(asins)) + rb')"')
+
+
+def iter_raw_library_lines_matching_asins(raw_library_path, asins):
+    """
+    Yield (in the file order) the raw lines with an "asin" key matching one of the ASINs, using a byte-level search over
+    the memory-mapped raw cache file (or over each line of a compressed one) so that nothing is decoded
+    The "asin" keys of the authors/series can match too and so the items still have to be checked once decoded
+    """
+    asin_pattern = get_raw_library_asin_pattern(asins)
+    if get_file_compression(raw_library_path) is not None:
+        with open_cache_file(raw_library_path, 'rb') as raw_file:
+            for json_raw_book in raw_file:
+                if asin_pattern.search(json_raw_book):
+                    yield json_raw_book
+        return
+
+    if not os.path.getsize(raw_library_path):
+        return
+    with open(raw_library_path, 'rb') as raw_file, mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ) as raw_map:
+        line_end = 0
+        for match in asin_pattern.finditer(raw_map):
+            if match.start() < line_end:
+                # another match in the line already yielded
+                continue
+            line_start = raw_map.rfind(b"\n", 0, match.start()) + 1
+            line_end = raw_map.find(b"\n", match.end()) + 1 or len(raw_map)
+            yield raw_map[line_start:line_end]
+
+
+def iter_raw_library_lines_by_asins(raw_library_path, asins):
+    """
+    Yield (in the file order) the raw lines of the ASINs (and maybe a few more, see iter_raw_library_lines_matching_asins)
+    The lines are read directly from the index, which is rebuilt (and saved) if the raw cache file changed since,
+    otherwise (no index or compressed file) they're searched for (which is faster than building an index for a one-off lookup)
+    """
+    index = None
+    if get_file_compression(raw_library_path) is None:
+        index = load_valid_raw_library_index(raw_library_path)
+        if index is None and os.path.exists(get_raw_library_index_path(raw_library_path)):
+            logging.info(f"Rebuilding index of {raw_library_path}")
+            index = build_raw_library_index(raw_library_path)
+    if index is None:
+        yield from iter_raw_library_lines_matching_asins(raw_library_path, asins)
+        return
+
+    with open(raw_library_path, 'rb') as raw_file:
+        for offset, length in sorted(index[asin] for asin in asins if asin in index):
+            raw_file.seek(offset)
+            yield raw_file.read(length)
+
+
+def iter_raw_library_items(raw_library_path, asin_filter=None, fields=None):
+    """
+    Iterate over the items of the raw cache file (only the ones matching asin_filter if specified: an ASIN or several)
+    Only the specified fields are decoded (all of them if None)
+    """
+    if asin_filter is not None:
+        asins = {asin_filter} if isinstance(asin_filter, str) else set(asin_filter)
+        decoded_fields = None if fields is None else list(fields) + ([] if "asin" in fields else ["asin"])
+        for json_raw_book in iter_raw_library_lines_by_asins(raw_library_path, asins):
+            item = decode_raw_item(json_raw_book, decoded_fields)
+            if item.get("asin") in asins:
+                if fields is not None and "asin" not in fields:
+                    del item["asin"]
+                yield item
+        return
+    with open_cache_file(raw_library_path, 'rb') as raw_file:
+        for json_raw_book in raw_file:
+            yield decode_raw_item(json_raw_book, fields)
+
+
+def get_audible_session(audible_cfg, root_path):
+    """
+    Establish a client session with Audible using the Audible cfg data
+    """
+    audible_email            = audible_cfg.get('email')
+    audible_password         = audible_cfg.get('password')
+    audible_locale           = audible_cfg.get('locale', 'us')
+    audible_session_path     = create_full_path(audible_cfg.get('session_file_path', 'audible_session.txt'), root_path)
+
+    with profiler.stage('audible_auth'):
+        audible_session = get_audible_client(audible_email, audible_password, audible_locale, audible_session_path,
+                                             get_audible_request_scheduler(audible_cfg))
+    if not audible_session.is_logged_in():
+        raise Exception("Failed to connect to Audible")
+
+    response_cache = get_audible_response_cache(audible_cfg, root_path)
+    if response_cache is not None:
+        audible_session = CachedAudibleSession(audible_session, response_cache, audible_locale)
+
+    return audible_session
+
+
+def format_book_row(values):
+    """
+    Join the values of a book row with "|" and quote them like csv.writer(delimiter='|') does
+    when they contain a "|", a quote or a newline so that the row can be read back with csv.reader(delimiter='|')
+    """
+    row = "|".join(values)
+    if row.count("|") == len(values) - 1 and not any(char in row for char in '"\r\n'):
+        return row
+    buffer = io.StringIO()
+    csv.writer(buffer, delimiter='|', lineterminator='').writerow(values)
+
+    return buffer.getvalue()
+
+
+def get_audible_book_rows(items, audible_min_length, content_type_to_omit, asins_to_omit, columns=DEFAULT_BOOK_COLUMNS):
+    """
+    Convert a batch of raw Audible items into "|"-separated book rows (None for the items filtered out
+    based on their length, content type or ASIN)
+    The rows are built column by column (so the dates and durations of the batch are converted all at once)
+    using the compiled projection plan of the columns
+    """
+    books = [
+        (index, item) for index, item in enumerate(items)
+        if (
+                (not item["content_type"] in content_type_to_omit) and 
+                (not item["asin"]         in asins_to_omit) and
+                item["runtime_length_min"] >= audible_min_length
+        )
+    ]
+    projection_plan = compile_projection_plan(columns)
+
+    rows = [None] * len(items)
+    for (index, _), values in zip(books, projection_plan.project([item for _, item in books])):
+        rows[index] = format_book_row(values)
+
+    return rows
+
+
+def get_audible_item_checksum(item):
+    """
+    Checksum of a raw Audible item used to detect changes between two syncs
+    """
+    return hashlib.md5(json.dumps(item, sort_keys=True).encode()).hexdigest()
+
+
+def load_audible_sync_state(sync_state_path):
+    """
+    Load the watermark saved by the previous sync: newest purchase_date and the checksum of each ASIN
+    Return None if there's no (valid) watermark
+    """
+    if not os.path.exists(sync_state_path):
+        return None
+    try:
+        with open(sync_state_path, 'r') as sync_state_file:
+            sync_state = json.load(sync_state_file)
+    except ValueError as error:
+        warn(f"Ignoring invalid sync state file:{sync_state_path} because {error}")
+        return None
+    if 'purchase_date' not in sync_state or 'asins' not in sync_state:
+        return None
+
+    return sync_state
+
+
+def save_audible_sync_state(sync_state_path, purchase_date, checksums):
+    """
+    Save the watermark (newest purchase_date and checksum of each ASIN) of the items now in the raw cache file
+    """
+    sync_state = {
+        'purchase_date': purchase_date,
+        'asins': checksums,
+    }
+    with open(sync_state_path, 'w') as sync_state_file:
+        json.dump(sync_state, sync_state_file)
+
+
+def get_new_audible_library_items(audible_session, sync_state):
+    """
+    Get the items bought since the last sync, newest first
+    Stop at the first page containing an already known ASIN (or an item older than the watermark).
+    Known ASINs on that page whose checksum changed are returned as well so that they can be updated.
+    """
+    known_asins = sync_state['asins']
+    watermark   = sync_state['purchase_date']
+    new_items = []
+    for page in range(1, AUDIBLE_MAX_PAGES + 1):
+        items, _ = get_audible_library_page(audible_session, page, AUDIBLE_INCREMENTAL_PAGE_SIZE, sort_by='-PurchaseDate')
+        reached_known_items = False
+        for item in items:
+            checksum = known_asins.get(item["asin"])
+            if checksum is None and not (watermark and item.get("purchase_date") and item["purchase_date"] < watermark):
+                new_items.append(item)
+            else:
+                reached_known_items = True
+                if checksum is not None and checksum != get_audible_item_checksum(item):
+                    new_items.append(item)
+        if reached_known_items or len(items) < AUDIBLE_INCREMENTAL_PAGE_SIZE:
+            break
+
+    return new_items
+
+
+def save_audible_items_to_files(pages, audible_raw_library_path, audible_library_path, audible_sync_state_path,
+                                audible_min_length, content_type_to_omit, asins_to_omit, columns=DEFAULT_BOOK_COLUMNS,
+                                snapshot_store=None):
+    """
+    Stream the pages (lists) of items to the raw cache file and the ones that aren't filtered out to the "|"-separated cache file
+    (with the specified columns)
+    Both files are written atomically: a failure while iterating over the pages leaves the previous files intact
+    The "|"-separated cache file is left as-is if no books are left after filtering
+    The items are also saved as a new snapshot in the snapshot store (if specified)
+    """
+    n_books = 0
+    with RawLibraryWriter(audible_raw_library_path, audible_sync_state_path, snapshot_store) as raw_writer, \
+         AtomicFileWriter(audible_library_path) as writer:
+        # Note the header here that is used as info key for each book
+        header = "|".join(compile_projection_plan(columns).headers)
+        writer.write(header+"\n")
+        for items in pages:
+            books = get_audible_book_rows(items, audible_min_length, content_type_to_omit, asins_to_omit, columns)
+            for item, book in zip(items, books):
+                raw_writer.write(item)
+                if book:
+                    writer.write(book+"\n")
+                    n_books += 1
+        if not n_books:
+            writer.discard()
+
+    return n_books
+
+
+def get_audible_books_and_save_to_file(audible_cfg, root_path, audible_session=None, incremental=False,
+                                       columns=DEFAULT_BOOK_COLUMNS, fetch_executor=None):
+    """
+    Use the Audible API to get the list of all books from Audible and save the list (with the specified columns)
+    An already established audible_session can be provided instead of creating one from the cfg
+    as well as an already existing executor to request the pages
+    With incremental, only the books bought since the last sync are requested and merged into the existing files
+    (as long as the columns haven't changed since)
+    """
+    # Audible cfg data
+    audible_library_path     = get_audible_library_path(audible_cfg, root_path)
+    audible_raw_library_path = get_audible_raw_library_path(audible_cfg, root_path)
+    audible_sync_state_path  = create_full_path(audible_cfg.get('sync_state_file_path', AUDIBLE_SYNC_STATE_FILE_PATH_DEFAULT), root_path)
+    audible_min_length       = int(audible_cfg.get('min_length', 5))
+    content_type_to_omit     = audible_cfg.get('content_type_to_omit', '').split(",")
+    asins_to_omit            = audible_cfg.get('asins_to_omit', '').split(" ")
+    audible_fetch_workers    = int(audible_cfg.get('fetch_workers', AUDIBLE_FETCH_WORKERS_DEFAULT))
+    snapshot_store           = get_audible_snapshot_store(audible_cfg, root_path)
+
+    # Establish a client session with Audible
+    if audible_session is None:
+        audible_session = get_audible_session(audible_cfg, root_path)
+
+    if incremental:
+        sync_state = load_audible_sync_state(audible_sync_state_path)
+        if sync_state and os.path.exists(audible_raw_library_path) and os.path.exists(audible_library_path):
+            with open_cache_file(audible_library_path, 'r') as library_file:
+                same_columns = library_file.readline().rstrip("\n") == "|".join(compile_projection_plan(columns).headers)
+            if same_columns:
+                new_items = get_new_audible_library_items(audible_session, sync_state)
+                merge_new_audible_items_to_files(new_items, audible_raw_library_path, audible_library_path, audible_sync_state_path,
+                                                 audible_min_length, content_type_to_omit, asins_to_omit, columns, snapshot_store)
+                return
+            print("The columns have changed since the last sync: getting the whole library", file=sys.stderr)
+        else:
+            print("No previous sync found: getting the whole library", file=sys.stderr)
+
+    # stream the books from the Audible library pages to the cache files as the pages arrive
+    pages = iter_audible_library_pages(audible_session, audible_fetch_workers, fetch_executor)
+    with profiler.stage('audible_fetch') as counts:
+        n_books = save_audible_items_to_files(pages, audible_raw_library_path, audible_library_path, audible_sync_state_path,
+                                              audible_min_length, content_type_to_omit, asins_to_omit, columns, snapshot_store)
+        counts['items'] = n_books
+        counts['bytes'] = os.path.getsize(audible_raw_library_path)
+    if n_books:
+        print(f"Saved {n_books} Audible book in {audible_library_path}", file=sys.stderr);
+
+
+def merge_new_audible_items_to_files(new_items, audible_raw_library_path, audible_library_path, audible_sync_state_path,
+                                     audible_min_length, content_type_to_omit, asins_to_omit, columns=DEFAULT_BOOK_COLUMNS,
+                                     snapshot_store=None):
+    """
+    Merge the new/changed items into the raw and "|"-separated cache files
+    Changed items are replaced in place while new items are added at the top (newest first)
+    The rows of the "|"-separated cache file follow the order of the raw cache file and so a changed item
+    which was filtered out until now gets its row at the same place
+    """
+    if not new_items:
+        print("No new Audible books since the last sync", file=sys.stderr)
+        return
+
+    new_items_by_asin = {item["asin"]: item for item in new_items}
+    new_rows          = get_audible_book_rows(new_items, audible_min_length, content_type_to_omit, asins_to_omit, columns)
+    new_rows_by_asin  = {item["asin"]: row for item, row in zip(new_items, new_rows)}
+    old_asins = load_raw_library_index(audible_raw_library_path)
+    added_items = [item for item in new_items if item["asin"] not in old_asins]
+
+    # raw cache file
+    with RawLibraryWriter(audible_raw_library_path, audible_sync_state_path, snapshot_store) as raw_writer:
+        for item in added_items:
+            raw_writer.write(item)
+        for item in iter_raw_library_items(audible_raw_library_path):
+            raw_writer.write(new_items_by_asin.get(item["asin"], item))
+
+    # "|"-separated cache file
+    # read by record (and not by line) since a value can contain newlines
+    with open_cache_file(audible_library_path, 'r', newline='') as library_file, AtomicFileWriter(audible_library_path) as writer:
+        csv_reader = csv.reader(library_file, delimiter='|')
+        writer.write(format_book_row(next(csv_reader))+"\n")
+        book = next(csv_reader, None)
+        for asin in raw_writer.asins:
+            old_book = None
+            if book is not None and book[0] == asin:
+                old_book, book = book, next(csv_reader, None)
+            if asin in new_rows_by_asin:
+                if new_rows_by_asin[asin]:
+                    writer.write(new_rows_by_asin[asin]+"\n")
+            elif old_book is not None:
+                writer.write(format_book_row(old_book)+"\n")
+
+    n_added = len(added_items)
+    print(f"Merged {n_added} new and {len(new_items) - n_added} changed Audible books in {audible_library_path}", file=sys.stderr)
+
+
+def convert_raw_lines_to_book_rows(raw_lines, audible_min_length, content_type_to_omit, asins_to_omit,
+                                   columns=DEFAULT_BOOK_COLUMNS, json_codec_name=None):
+    """
+    Decode a batch of raw cache file lines and convert them into "|"-separated book rows (None when filtered out)
+    json_codec_name is used to set the JSON codec when running in a separate process
+    """
+    if json_codec_name is not None and raw_json_codec.name != json_codec_name:
+        set_raw_json_codec(json_codec_name)
+    items = [decode_raw_item(raw_line) for raw_line in raw_lines]
+
+    return get_audible_book_rows(items, audible_min_length, content_type_to_omit, asins_to_omit, columns)
+
+
+def iter_raw_library_lines_batches(raw_library_path, batch_size=None):
+    """
+    Iterate over the lines of the raw cache file by batches of batch_size lines (REBUILD_BATCH_SIZE by default)
+    """
+    batch_size = batch_size or REBUILD_BATCH_SIZE
+    with open_cache_file(raw_library_path, 'rb') as raw_file:
+        while True:
+            raw_lines = list(islice(raw_file, batch_size))
+            if not raw_lines:
+                break
+            yield raw_lines
+
+
+def get_raw_library_byte_ranges(raw_library_path, chunk_size=None):
+    """
+    Split an uncompressed raw cache file into (start, end) byte ranges of about chunk_size bytes (REBUILD_CHUNK_SIZE by default)
+    each made of whole lines
+    """
+    chunk_size = chunk_size or REBUILD_CHUNK_SIZE
+    file_size = os.path.getsize(raw_library_path)
+    byte_ranges = []
+    with open(raw_library_path, 'rb') as raw_file:
+        start = 0
+        while start < file_size:
+            # the range ends at the end of the line where chunk_size is reached
+            raw_file.seek(min(start + chunk_size, file_size) - 1)
+            raw_file.readline()
+            end = raw_file.tell()
+            byte_ranges.append((start, end))
+            start = end
+
+    return byte_ranges
+
+
+def read_raw_library_lines_in_range(raw_library_path, start, end):
+    """
+    Read the lines of the raw cache file within a byte range (as returned by get_raw_library_byte_ranges)
+    """
+    raw_lines = []
+    with open(raw_library_path, 'rb') as raw_file:
+        raw_file.seek(start)
+        position = start
+        for raw_line in raw_file:
+            raw_lines.append(raw_line)
+            position += len(raw_line)
+            if position >= end:
+                break
+
+    return raw_lines
+
+
+def convert_raw_library_range_to_book_rows(raw_library_path, start, end, audible_min_length, content_type_to_omit, asins_to_omit,
+                                           columns=DEFAULT_BOOK_COLUMNS, json_codec_name=None):
+    """
+    Same as convert_raw_lines_to_book_rows for the lines within a byte range of the raw cache file (read by the worker itself)
+    """
+    raw_lines = read_raw_library_lines_in_range(raw_library_path, start, end)
+
+    return convert_raw_lines_to_book_rows(raw_lines, audible_min_length, content_type_to_omit, asins_to_omit, columns,
+                                          json_codec_name)
+
+
+def iter_raw_library_ranges_results(raw_library_path, function, args, workers):
+    """
+    Run function(raw_library_path, start, end, *args, json_codec_name) on the byte ranges of an uncompressed raw cache file
+    across workers processes and yield the results in the file order (never more than 2*workers ranges in flight)
+    Only the byte ranges are sent to the workers which read the lines themselves
+    """
+    byte_ranges = iter(get_raw_library_byte_ranges(raw_library_path))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        def submit(byte_range):
+            return executor.submit(function, raw_library_path, *byte_range, *args, raw_json_codec.name)
+
+        pending_ranges = deque(submit(byte_range) for byte_range in islice(byte_ranges, 2 * workers))
+        while pending_ranges:
+            result = pending_ranges.popleft().result()
+            for byte_range in islice(byte_ranges, 1):
+                pending_ranges.append(submit(byte_range))
+            yield result
+
+
+def iter_book_rows_from_raw_file(raw_library_path, audible_min_length, content_type_to_omit, asins_to_omit, workers=1,
+                                 columns=DEFAULT_BOOK_COLUMNS):
+    """
+    Stream the raw cache file through the filter and transform steps and yield batches of book rows in the file order
+    Large files are split by byte ranges across up to workers processes; compressed files can't be split that way
+    and so their batches of lines are sent to the processes instead (never more than 2*workers batches in flight)
+    """
+    filters = (audible_min_length, content_type_to_omit, asins_to_omit, columns)
+    batches = iter_raw_library_lines_batches(raw_library_path)
+    if workers <= 1 or os.path.getsize(raw_library_path) < REBUILD_PROCESS_POOL_MIN_SIZE:
+        for raw_lines in batches:
+            yield convert_raw_lines_to_book_rows(raw_lines, *filters)
+        return
+
+    if get_file_compression(raw_library_path) is None:
+        yield from iter_raw_library_ranges_results(raw_library_path, convert_raw_library_range_to_book_rows, filters, workers)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending_batches = deque(executor.submit(convert_raw_lines_to_book_rows, raw_lines, *filters, raw_json_codec.name)
+                                for raw_lines in islice(batches, 2 * workers))
+        while pending_batches:
+            book_rows = pending_batches.popleft().result()
+            for raw_lines in islice(batches, 1):
+                pending_batches.append(executor.submit(convert_raw_lines_to_book_rows, raw_lines, *filters, raw_json_codec.name))
+            yield book_rows
+
+
+def rebuild_audible_books_file_from_raw_file(audible_cfg, root_path, columns=DEFAULT_BOOK_COLUMNS):
+    """
+    Rebuild the "|"-separated cache file from the raw cache file using the current filters of the configuration
+    (min_length, content_type_to_omit, asins_to_omit) and the specified columns without requesting anything from Audible
+    """
+    # Audible cfg data
+    audible_library_path     = get_audible_library_path(audible_cfg, root_path)
+    audible_raw_library_path = get_audible_raw_library_path(audible_cfg, root_path)
+    audible_min_length       = int(audible_cfg.get('min_length', 5))
+    content_type_to_omit     = audible_cfg.get('content_type_to_omit', '').split(",")
+    asins_to_omit            = audible_cfg.get('asins_to_omit', '').split(" ")
+    rebuild_workers          = int(audible_cfg.get('rebuild_workers', os.cpu_count() or 1))
+
+    n_books = 0
+    with profiler.stage('audible_rebuild') as counts, AtomicFileWriter(audible_library_path) as writer:
+        # Note the header here that is used as info key for each book
+        header = "|".join(compile_projection_plan(columns).headers)
+        writer.write(header+"\n")
+        for books in iter_book_rows_from_raw_file(audible_raw_library_path, audible_min_length, content_type_to_omit,
+                                                  asins_to_omit, rebuild_workers, columns):
+            for book in books:
+                if book:
+                    writer.write(book+"\n")
+                    n_books += 1
+        if not n_books:
+            writer.discard()
+        counts['items'] = n_books
+        counts['bytes'] = os.path.getsize(audible_raw_library_path)
+    print(f"Rebuilt {audible_library_path} with {n_books} Audible book from {audible_raw_library_path}", file=sys.stderr)
+
+    return n_books
+
+
+class RawFieldStats:
+    """
+    Histograms (value -> count) of the raw data fields computed in a single pass over the raw items
+    Only the specified fields are computed (all of them if fields is None)
+    The histogram of a field with more than max_values different values is dropped (and the field added to overflowed)
+    so that the memory used doesn't grow with the size of the library
+    """
+    def __init__(self, fields=None, max_values=None):
+        self._fields_to_compute = set(fields) if fields is not None else None
+        self.max_values = max_values
+        self.fields = defaultdict(dict)
+        self.overflowed = set()
+
+    def add(self, item):
+        for field, data in item.items():
+            if (self._fields_to_compute is None or field in self._fields_to_compute) and field not in self.overflowed:
+                value = extract_correct_information_from_field_data(field, data)
+                values = self.fields[field]
+                values[value] = values.get(value, 0) + 1
+                if self.max_values is not None and len(values) > self.max_values:
+                    del self.fields[field]
+                    self.overflowed.add(field)
+
+    def save(self, stats_path, signature):
+        # values can be None and so save them as [value, count] pairs instead of a dict
+        stats = {field: [[value, count] for value, count in values.items()] for field, values in self.fields.items()}
+        with open(stats_path, 'w') as stats_file:
+            json.dump({'signature': signature, 'max_values': self.max_values, 'fields': stats,
+                       'overflowed': sorted(self.overflowed)}, stats_file)
+
+    @classmethod
+    def load(cls, stats_path, signature):
+        """
+        Load the saved stats if they were computed for the file with the given signature, otherwise return None
+        """
+        if not os.path.exists(stats_path):
+            return None
+        try:
+            with open(stats_path, 'r') as stats_file:
+                saved_stats = json.load(stats_file)
+        except ValueError:
+            return None
+        if saved_stats.get('signature') != signature:
+            return None
+        stats = cls(max_values=saved_stats.get('max_values'))
+        for field, values in saved_stats['fields'].items():
+            stats.fields[field] = {value: count for value, count in values}
+        stats.overflowed = set(saved_stats.get('overflowed', []))
+
+        return stats
+
+
+def get_raw_library_stats_path(raw_library_path):
+    """
+    The precomputed field stats live next to the raw cache file
+    """
+    return raw_library_path + RAW_LIBRARY_STATS_SUFFIX
+
+
+def get_raw_field_stats(raw_library_path, specific_field=None):
+    """
+    Get the field stats of the raw cache file from its sidecar summary file if it's up to date
+    (and has the histogram of the specific field)
+    Otherwise compute the whole stats of the specific field only (or the bounded stats of all the fields and save them)
+    """
+    stats_path = get_raw_library_stats_path(raw_library_path)
+    signature = get_file_signature(raw_library_path)
+    stats = RawFieldStats.load(stats_path, signature)
+    if stats is not None and specific_field not in stats.overflowed:
+        return stats
+
+    logging.info(f"Computing field stats of {raw_library_path}")
+    if specific_field is not None:
+        fields = [specific_field]
+        stats = RawFieldStats(fields)
+    else:
+        fields = None
+        stats = RawFieldStats(max_values=RAW_FIELD_STATS_MAX_VALUES)
+    for book_as_dict in iter_raw_library_items(raw_library_path, fields=fields):
+        stats.add(book_as_dict)
+    if specific_field is None:
+        stats.save(stats_path, signature)
+
+    return stats
+
+
+def print_raw_data_fields_list(raw_library_file_path, specific_field):
+    stats = get_raw_field_stats(raw_library_file_path, specific_field)
+    fields = stats.fields
+
+    if specific_field == None:
+        for field in sorted(set(fields) | stats.overflowed):
+            if field in stats.overflowed:
+                print(f"{field} (more than {stats.max_values} different values)")
+                continue
+            values = fields[field]
+            n_values = len(values)
+            if n_values == 1:
+                sole_key = list(values.keys())[0]
+                msg = f"Always {sole_key}"
+            else:
+                msg = f"{n_values} different values"
+            print(f"{field} ({msg})")
+    else:
+        values = fields[specific_field]
+        for value, count in values.items():
+            print(f"{value} ({count})")
+            
+
+        
+def print_snapshots_list(snapshot_store):
+    """
+    Print the snapshots with the number of items as well as the ASINs added/removed/changed since the previous one
+    """
+    print("SNAPSHOT|ITEMS|ADDED|REMOVED|CHANGED")
+    for snapshot_id in snapshot_store.get_snapshot_ids():
+        snapshot = snapshot_store.load_snapshot(snapshot_id)
+        print(format_book_row([snapshot_id] + [str(value) for value in (snapshot['n_items'], len(snapshot['added']),
+                                                                        len(snapshot['removed']), len(snapshot['changed']))]))
+
+
+def print_snapshots_diff(snapshot_store, snapshot_prefixes):
+    """
+    Print the changes between 2 snapshots ("|"-separated and quoted if needed as the cache file): the previous and the latest snapshots by default
+    or the specified snapshot and the latest one or the 2 specified snapshots
+    Each changed field of a changed item is on its own line with its old and new values
+    """
+    snapshot_ids = [snapshot_store.find_snapshot_id(prefix) for prefix in snapshot_prefixes]
+    all_snapshot_ids = snapshot_store.get_snapshot_ids()
+    if not snapshot_ids:
+        if len(all_snapshot_ids) < 2:
+            raise Exception(f"Not enough snapshots to diff in {snapshot_store.path} (available: {', '.join(all_snapshot_ids) or 'none'})")
+        snapshot_ids = all_snapshot_ids[-2:]
+    elif len(snapshot_ids) == 1:
+        snapshot_ids.append(all_snapshot_ids[-1])
+    old_id, new_id = snapshot_ids
+    added, removed, changed = snapshot_store.diff(old_id, new_id)
+    print(f"{len(added)} added, {len(removed)} removed and {len(changed)} changed books from snapshot {old_id} to {new_id}",
+          file=sys.stderr)
+
+    def format_value(field, data):
+        return extract_correct_information_from_field_data(field, data) if data is not None else Book.UNKNOWN_VALUE
+
+    print("CHANGE|ASIN|TITLE|FIELD|OLD|NEW")
+    for asin, item in sorted(added.items()):
+        print(format_book_row(["ADDED", asin, str(item.get('title')), "", "", ""]))
+    for asin, item in sorted(removed.items()):
+        print(format_book_row(["REMOVED", asin, str(item.get('title')), "", "", ""]))
+    for asin, (old_item, new_item) in sorted(changed.items()):
+        for field, (old_data, new_data) in get_changed_fields(old_item, new_item).items():
+            print(format_book_row(["CHANGED", asin, str(new_item.get('title')), field,
+                                   str(format_value(field, old_data)), str(format_value(field, new_data))]))
+
+
+def print_file_as_is(file_to_print):
+    # streamed (and decompressed if needed) instead of read as a whole
+    with open_cache_file(file_to_print, 'r') as file:
+        shutil.copyfileobj(file, sys.stdout)
+    print()
+
+        
+def project_raw_items(items, specified_fields):
+    """
+    Project the specified fields of a batch of raw items into "|"-separated rows
+    The fields are compiled once into a projection plan (cached) which is run on the whole batch
+    The rows are only displayed and so, unlike the cache files, the values aren't quoted
+    """
+    projection_plan = compile_projection_plan(tuple((field, field) for field in specified_fields))
+
+    return ["|".join(columns) for columns in projection_plan.project(items)]
+
+
+def project_raw_library_range(raw_library_path, start, end, specified_fields, json_codec_name=None):
+    """
+    Project the specified fields of the items within a byte range of the raw cache file (read by the worker itself)
+    """
+    if json_codec_name is not None and raw_json_codec.name != json_codec_name:
+        set_raw_json_codec(json_codec_name)
+    raw_lines = read_raw_library_lines_in_range(raw_library_path, start, end)
+
+    return project_raw_items([decode_raw_item(raw_line, specified_fields) for raw_line in raw_lines], specified_fields)
+
+
+def parse_asin_filter(asin_filter):
+    """
+    Get the list of ASINs of the ASIN filter: comma-separated or read from a file (@FILE) with one or more ASINs per line
+    """
+    if asin_filter is None:
+        return None
+    if asin_filter.startswith("@"):
+        with open(asin_filter[1:], 'r') as asins_file:
+            asin_filter = asins_file.read()
+
+    return [asin for asin in re.split(r"[\s,]+", asin_filter) if asin]
+
+
+def print_specified_field_from_raw_file(raw_file_path, specified_fields, asin_filter, workers=1):
+    """
+    Print the specified fields of the raw items ("|"-separated)
+    Large uncompressed files are split by byte ranges across up to workers processes
+    """
+    header = "|".join(specified_fields)
+    print(header)
+    if (
+            workers > 1 and asin_filter is None and get_file_compression(raw_file_path) is None and
+            os.path.getsize(raw_file_path) >= REBUILD_PROCESS_POOL_MIN_SIZE
+    ):
+        for rows in iter_raw_library_ranges_results(raw_file_path, project_raw_library_range, (specified_fields,), workers):
+            if rows:
+                print("\n".join(rows))
+        return
+
+    # The ASIN filter is handled by the raw cache file index (or a byte-level search) and so only those books are decoded
+    books_as_dict = iter_raw_library_items(raw_file_path, asin_filter, specified_fields)
+    while True:
+        batch = list(islice(books_as_dict, REBUILD_BATCH_SIZE))
+        if not batch:
+            break
+        for row in project_raw_items(batch, specified_fields):
+            print(row)
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description="""
 Pull Audible library books and output them to the screen or to a Google Sheet.
 The list of books to the screen/STDOUT is "|"-separated
 """,
     )
-    parser.add_argument("-c", "--cfg_file", help="Configuation file", default=CONFIG_FILE_PATH)
+    parser.add_argument(
+        "-c",
+        "--cfg_file",
+        help="Configuation file(s): the accounts of several files (or [audible_cfg.NAME] sections) are synced concurrently",
+        nargs='+',
+        default=[CONFIG_FILE_PATH],
+    )
     parser.add_argument(
         "-r",
         "--print_raw_data",
@@ -545,7 +2928,9 @@ The list of books to the screen/STDOUT is "|"-separated
     parser.add_argument(
         "-L",
         "--list_values_of_specified_field",
-        help="List all the values associated with the raw data specified field",
+        help="List all the values associated with the raw data specified field (from the stats saved with the raw cache "
+             f"file, except for the fields with more than {RAW_FIELD_STATS_MAX_VALUES} different values, e.g. asin or title, "
+             "which are always read again from the raw cache file)",
     )
     parser.add_argument(
         "-g",
@@ -565,10 +2950,48 @@ The list of books to the screen/STDOUT is "|"-separated
         help="Use Audible raw cache file instead of requesting the data",
         action="store_true",
     )
+    parser.add_argument(
+        "-i",
+        "--incremental_sync",
+        help="Only request the Audible books bought since the last sync and merge them into the cache files",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-B",
+        "--rebuild_audible_cache_file",
+        help="Rebuild the Audible cache file from the Audible raw cache file (e.g. after changing the filters in the configuration file) instead of requesting the data",
+        action="store_true",
+    )
     parser.add_argument(
         "-f",
         "--asin_filter",
-        help="Ignore all books except the one with the specified ASIN",
+        help="Ignore all books except the ones with the specified ASINs (comma-separated or @FILE to read them from a file)",
+    )
+    parser.add_argument(
+        "-S",
+        "--list_snapshots",
+        help="List the snapshots of the Audible library (one per fetch when snapshot_dir is set) with the number of books added/removed/changed by each",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-D",
+        "--diff_snapshots",
+        help="Print the books added/removed/changed between 2 snapshots (or prefixes of their ids): the previous and the latest by default",
+        nargs='*',
+        metavar="SNAPSHOT",
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Print the time spent (as well as the number of items and bytes) in each stage to STDERR or save it as JSON to the specified file",
+        nargs='?',
+        const='-',
+        default=None,
+    )
+    parser.add_argument(
+        "--cprofile",
+        help="Save the cProfile stats of the main thread to the specified file (see pstats)",
+        default=None,
     )
     parser.add_argument(
         "-v",
@@ -577,28 +3000,58 @@ The list of books to the screen/STDOUT is "|"-separated
         action="store_true",
     )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.diff_snapshots is not None and len(args.diff_snapshots) > 2:
+        parser.error("argument -D/--diff_snapshots: at most 2 snapshots can be diffed")
+    return args
 
 # --------------------------------------------------------------------------------
-def main():
-    """Main function."""
-    args = parse_args(sys.argv[1:])
+class SyncJob:
+    """
+    Sync of one Audible account/locale (and its Google Sheet) as specified by a configuration file
+        * name: name of the account ([audible_cfg.NAME] section) or of the configuration file (single [audible_cfg] section)
+        * timings: stage -> wall time in seconds
+        * critical_path: (stage, seconds) of the stages that determined the time of the sync (see get_critical_path)
+        * error: exception that stopped the sync (if any)
+    """
+    def __init__(self, name, audible_cfg, gs_cfg, root_path, book_columns=DEFAULT_BOOK_COLUMNS):
+        self.name         = name
+        self.audible_cfg  = audible_cfg
+        self.gs_cfg       = gs_cfg
+        self.root_path    = root_path
+        self.book_columns  = book_columns
+        self.timings       = dict()
+        self.critical_path = []
+        self.error         = None
+
+
+@contextlib.contextmanager
+def timed_stage(timings, stage):
+    """
+    Add the wall time of the block to timings[stage]
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
 
-    if args.verbose:
-        logging.basicConfig(level=logging.INFO)
 
-    # Get the configration file information
-    cfg_file = args.cfg_file
+def read_cfg_file(cfg_file):
     cfg = configparser.ConfigParser()
+    cfg.optionxform = str   # keep the case of the headers of [google_sheet_columns]
     if not os.path.exists(cfg_file):
         raise Exception(f"The configuration file:{cfg_file} doesn't exist")
     
     cfg.read(cfg_file)
 
-    # get and create the root dir if it doesn't already exist
-    root_path = cfg.get('general', 'root_path')
-    if not root_path.startswith("/"):
-        root_path = os.environ["HOME"] + "/" + root_path
+    return cfg
+
+
+def create_root_path(root_path):
+    """
+    Create the root dir if it doesn't already exist
+    """
     if os.path.exists(root_path):
         if not os.path.isdir(root_path):
             warn(f"{root_path} exists but is not a directory")
@@ -606,46 +3059,269 @@ def main():
         # make it visible to the creator of the directory only b/c it contains confidential information
         os.mkdir(root_path, 0o700)
 
-    # Get/save/print Audible books
-    audible_cfg = cfg['audible_cfg']
-    if not (args.use_audible_cache_file or args.use_audible_raw_cache_file):
-        get_audible_books_and_save_to_file(audible_cfg, root_path)
-    if args.list_raw_data_fields or args.list_values_of_specified_field:
-        raw_library_file_path = create_full_path(audible_cfg.get('raw_library_file_path', AUDIBLE_RAW_FILE_PATH_DEFAULT), root_path)
+
+def get_sync_jobs(cfg, cfg_file):
+    """
+    Get the syncs of a configuration file: one per [audible_cfg.NAME] section (with its [google_sheet_cfg.NAME] section
+    or else [google_sheet_cfg]) using root_path/NAME as root path, or a single one for the [audible_cfg] section
+    """
+    # get and create the root dir if it doesn't already exist
+    root_path = cfg.get('general', 'root_path')
+    if not root_path.startswith("/"):
+        root_path = os.environ["HOME"] + "/" + root_path
+    create_root_path(root_path)
+    book_columns = get_book_columns(cfg)
+
+    names = [section.split('.', 1)[1] for section in cfg.sections() if section.startswith('audible_cfg.')]
+    if not names:
+        gs_cfg = cfg['google_sheet_cfg'] if cfg.has_section('google_sheet_cfg') else None
+        return [SyncJob(os.path.basename(cfg_file), cfg['audible_cfg'], gs_cfg, root_path, book_columns)]
+
+    jobs = []
+    for name in names:
+        account_root_path = root_path + "/" + name
+        create_root_path(account_root_path)
+        gs_section = f'google_sheet_cfg.{name}' if cfg.has_section(f'google_sheet_cfg.{name}') else 'google_sheet_cfg'
+        gs_cfg = cfg[gs_section] if cfg.has_section(gs_section) else None
+        jobs.append(SyncJob(name, cfg[f'audible_cfg.{name}'], gs_cfg, account_root_path, book_columns))
+
+    return jobs
+
+
+def check_sync_jobs_root_paths(jobs):
+    """
+    Make sure that no 2 syncs share the same root path since they'd overwrite each other's cache files
+    (e.g. several configuration files with the same root_path)
+    """
+    jobs_by_root_path = defaultdict(list)
+    for job in jobs:
+        jobs_by_root_path[os.path.realpath(job.root_path)].append(job.name)
+    for root_path, names in jobs_by_root_path.items():
+        if len(names) > 1:
+            raise Exception(f"The syncs {', '.join(names)} all use the root path:{root_path} "
+                            "(each configuration file must have its own root_path)")
+
+
+def sync_audible_books(job, args, fetch_executor=None):
+    """
+    Get/save Audible books (or rebuild them from the raw cache file)
+    """
+    with timed_stage(job.timings, 'audible'):
+        if args.rebuild_audible_cache_file:
+            rebuild_audible_books_file_from_raw_file(job.audible_cfg, job.root_path, job.book_columns)
+        elif not (args.use_audible_cache_file or args.use_audible_raw_cache_file):
+            get_audible_books_and_save_to_file(job.audible_cfg, job.root_path, incremental=args.incremental_sync,
+                                               columns=job.book_columns, fetch_executor=fetch_executor)
+
+
+def print_audible_books(job, args):
+    audible_cfg = job.audible_cfg
+    root_path = job.root_path
+    if args.list_snapshots or args.diff_snapshots is not None:
+        snapshot_store = get_audible_snapshot_store(audible_cfg, root_path)
+        if snapshot_store is None:
+            raise Exception("The snapshots are disabled (no snapshot_dir in the audible_cfg section)")
+        if args.list_snapshots:
+            print_snapshots_list(snapshot_store)
+        else:
+            print_snapshots_diff(snapshot_store, args.diff_snapshots)
+    elif args.list_raw_data_fields or args.list_values_of_specified_field:
+        raw_library_file_path = get_audible_raw_library_path(audible_cfg, root_path)
         print_raw_data_fields_list(raw_library_file_path, args.list_values_of_specified_field)
     else:
         if args.print_raw_data or args.print_specific_raw_data:
-            raw_library_file_path = create_full_path(audible_cfg.get('raw_library_file_path', AUDIBLE_RAW_FILE_PATH_DEFAULT), root_path)
+            raw_library_file_path = get_audible_raw_library_path(audible_cfg, root_path)
             if args.print_raw_data:
                 print_file_as_is(raw_library_file_path)
             else:
                 specified_fields = args.print_specific_raw_data.split(" ")
-                asin_filter      = args.asin_filter
-                print_specified_field_from_raw_file(raw_library_file_path, specified_fields, asin_filter)
+                asin_filter      = parse_asin_filter(args.asin_filter)
+                workers          = int(audible_cfg.get('rebuild_workers', os.cpu_count() or 1))
+                print_specified_field_from_raw_file(raw_library_file_path, specified_fields, asin_filter, workers)
         else:
-            library_file_path = create_full_path(audible_cfg.get('library_file_path',     AUDIBLE_FILE_PATH_DEFAULT),     root_path)
+            library_file_path = get_audible_library_path(audible_cfg, root_path)
             print_file_as_is(library_file_path)
 
-    # Get/save GoogleSheet (GS) books
-    if args.google_sheet_export:
-        gs_cfg = cfg['google_sheet_cfg']
-        gs_wks = get_gs_wks(gs_cfg, root_path)
-        gs_library_path = create_full_path(gs_cfg.get('library_file_path', GSHEET_FILE_PATH_DEFAULT), root_path)
-        gs_header_cols = get_gs_books_and_save_to_file(gs_wks, gs_library_path)
-        audible_library_path = create_full_path(audible_cfg.get('library_file_path', AUDIBLE_FILE_PATH_DEFAULT), root_path)
 
-        # Load lists of books from files into dictionaries for an easy 1x1 comparison based on ASIN
-        audible_books = create_books_dict_from_file(audible_library_path)
-        gs_books      = create_books_dict_from_file(gs_library_path)
+def get_gs_library_and_manifest_paths(job):
+    gs_library_path = create_full_path(job.gs_cfg.get('library_file_path', GSHEET_FILE_PATH_DEFAULT), job.root_path)
+    manifest_path = get_gs_manifest_path(gs_library_path) if job.gs_cfg.getboolean('row_hash_index', True) else None
 
-        # Create new rows based on the delta between audible and gs and the header columns
-        new_book_rows = get_new_book_rows(audible_books, gs_books, gs_header_cols)
+    return gs_library_path, manifest_path
 
-        # insert
-        if len(new_book_rows):
-            insert_new_book_row_to_gs_wks(gs_wks, new_book_rows)
-        else:
-            print("No new books found", file=sys.stderr)
+
+def load_gs_books(job):
+    """
+    Open the GoogleSheet (GS) and get its books with the columns of the configuration
+    Return the worksheet and its books (see load_gs_sheet_books)
+    """
+    if job.gs_cfg is None:
+        raise Exception(f"No google_sheet_cfg section to export the books of {job.name}")
+    with timed_stage(job.timings, 'gsheet_load'), profiler.stage('gsheet_load'):
+        gs_wks = get_gs_wks(job.gs_cfg, job.root_path)
+        gs_library_path, manifest_path = get_gs_library_and_manifest_paths(job)
+        field_names = compile_projection_plan(job.book_columns).headers
+
+        return gs_wks, load_gs_sheet_books(gs_wks, gs_library_path, field_names, manifest_path)
+
+
+def export_audible_books_to_gs(job, args, gs_books=None):
+    """
+    Sync the GoogleSheet (GS) books (loaded by load_gs_books, now if not specified) with the Audible books
+    """
+    if not args.google_sheet_export:
+        return
+    gs_wks, sheet_books = gs_books or load_gs_books(job)
+    with timed_stage(job.timings, 'gsheet_sync'), profiler.stage('gsheet_sync'):
+        gs_library_path, manifest_path = get_gs_library_and_manifest_paths(job)
+        audible_books = load_audible_books(get_audible_library_path(job.audible_cfg, job.root_path))
+        delete_missing_books = job.gs_cfg.getboolean('delete_missing_books', False)
+        sync_gs_sheet_books_with_audible_books(gs_wks, sheet_books, audible_books, gs_library_path, delete_missing_books,
+                                               manifest_path)
+
+
+def format_critical_path(critical_path):
+    return " > ".join(f"{stage} {seconds:.2f}s" for stage, seconds in critical_path)
+
+
+def get_critical_path(timings):
+    """
+    Stages on the critical path of a sync: the slower of the Audible books and the GS load (which run at the same time)
+    followed by the GS sync, as (stage, seconds) pairs
+    """
+    critical_path = [max(((stage, timings[stage]) for stage in ('audible', 'gsheet_load') if stage in timings),
+                         key=lambda stage_seconds: stage_seconds[1], default=None)]
+    if 'gsheet_sync' in timings:
+        critical_path.append(('gsheet_sync', timings['gsheet_sync']))
+
+    return [stage_seconds for stage_seconds in critical_path if stage_seconds is not None]
+
+
+def sync_job(job, args, fetch_executor=None, gs_lock=None, print_books=True):
+    """
+    Sync one account: the GS is opened and its books downloaded (in another thread) while the Audible books are fetched
+    since they're only needed together to diff them, then the Audible books are printed (if print_books) and the GS synced
+    gs_lock (if specified) is held while using the GS
+    """
+    gs_lock = gs_lock or contextlib.nullcontext()
+
+    def load_gs_books_with_lock():
+        with gs_lock:
+            return load_gs_books(job)
+
+    with ThreadPoolExecutor(max_workers=1) as gs_executor:
+        gs_future = gs_executor.submit(load_gs_books_with_lock) if args.google_sheet_export else None
+        sync_audible_books(job, args, fetch_executor)
+        gs_books = gs_future.result() if gs_future else None
+    if print_books:
+        print_audible_books(job, args)
+    with gs_lock:
+        export_audible_books_to_gs(job, args, gs_books)
+    job.critical_path = get_critical_path(job.timings)
+
+
+def run_sync_jobs(jobs, args):
+    """
+    Run the syncs concurrently (one thread each) sharing a single pool of threads to request the Audible pages
+    The Google Sheet exports share the same pygsheets client (and quota) and so are done one at a time
+    Return the total wall time
+    """
+    fetch_workers = sum(int(job.audible_cfg.get('fetch_workers', AUDIBLE_FETCH_WORKERS_DEFAULT)) for job in jobs)
+    gs_lock = threading.Lock()
+
+    def run_sync_job(job):
+        with timed_stage(job.timings, 'total'):
+            try:
+                sync_job(job, args, fetch_executor, gs_lock, print_books=False)
+            except Exception as error:
+                job.error = error
+                print(f"Sync of {job.name} failed: {error}", file=sys.stderr)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as fetch_executor, \
+         ThreadPoolExecutor(max_workers=len(jobs)) as job_executor:
+        list(job_executor.map(run_sync_job, jobs))
+
+    return time.perf_counter() - start
+
+
+def print_sync_jobs_summary(jobs, elapsed):
+    """
+    Print the timings of all the syncs to STDERR
+    """
+    name_width = max([len("ACCOUNT")] + [len(job.name) for job in jobs])
+    critical_paths = [format_critical_path(job.critical_path) or "-" for job in jobs]
+    path_width = max([len("CRITICAL PATH")] + [len(critical_path) for critical_path in critical_paths])
+    print(f"{'ACCOUNT':<{name_width}}  {'AUDIBLE':>8}  {'GS LOAD':>8}  {'GS SYNC':>8}  {'TOTAL':>8}  "
+          f"{'CRITICAL PATH':<{path_width}}  STATUS", file=sys.stderr)
+    for job, critical_path in zip(jobs, critical_paths):
+        timings = [job.timings.get(stage) for stage in ('audible', 'gsheet_load', 'gsheet_sync', 'total')]
+        timings = [f"{timing:7.2f}s" if timing is not None else f"{'-':>8}" for timing in timings]
+        status = f"FAILED: {job.error}" if job.error else "OK"
+        print(f"{job.name:<{name_width}}  {'  '.join(timings)}  {critical_path:<{path_width}}  {status}", file=sys.stderr)
+    sequential = sum(job.timings.get('total', 0.0) for job in jobs)
+    print(f"Synced {len(jobs)} accounts in {elapsed:.2f}s ({sequential:.2f}s one after the other)", file=sys.stderr)
+
+
+def main():
+    """Main function."""
+    args = parse_args(sys.argv[1:])
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    # cProfile only profiles the main thread
+    cprofile = None
+    if args.cprofile:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    profiler.reset()
+    try:
+        with profiler.stage('total'):
+            run(args)
+    finally:
+        close_audible_clients()
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(args.cprofile)
+            print(f"Saved the cProfile stats in {args.cprofile}", file=sys.stderr)
+        if args.profile:
+            if args.profile == '-':
+                profiler.print_summary()
+            else:
+                profiler.save(args.profile)
+                print(f"Saved the profile of the stages in {args.profile}", file=sys.stderr)
+
+
+def run(args):
+    """Sync/print the books as specified by the command line arguments."""
+    # Get the configration file(s) information
+    cfgs = [(cfg_file, read_cfg_file(cfg_file)) for cfg_file in args.cfg_file]
+    # the JSON codec is shared by all the syncs (which run at the same time)
+    json_codecs = {cfg_file: cfg.get('general', 'json_codec', fallback='auto') for cfg_file, cfg in cfgs}
+    if len(set(json_codecs.values())) > 1:
+        raise Exception("The configuration files must all use the same json_codec: " +
+                        ", ".join(f"{cfg_file}:{json_codec}" for cfg_file, json_codec in json_codecs.items()))
+    set_raw_json_codec(cfgs[0][1].get('general', 'json_codec', fallback='auto'))
+    jobs = [job for cfg_file, cfg in cfgs for job in get_sync_jobs(cfg, cfg_file)]
+    check_sync_jobs_root_paths(jobs)
+
+    if len(jobs) == 1:
+        job = jobs[0]
+        sync_job(job, args)
+        profiler.critical_path = job.critical_path
+        return
+
+    # batch of accounts
+    elapsed = run_sync_jobs(jobs, args)
+    for job in jobs:
+        if job.error is None:
+            print_audible_books(job, args)
+    print_sync_jobs_summary(jobs, elapsed)
+    failed_jobs = [job.name for job in jobs if job.error is not None]
+    if failed_jobs:
+        raise Exception(f"{len(failed_jobs)} of {len(jobs)} syncs failed: {', '.join(failed_jobs)}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,129 @@
+"""
+Synthetic Audible library generator used by the tests and benchmarks
+
+The raw items look like the ones returned by Audible (authors with translator/foreword variants, narrators,
+category ladders, series, assorted date formats, product descriptions, ...) and are generated at any size:
+
+    python -m tests.synthetic_library 100000 /tmp/audible_raw_books.txt
+"""
+import sys
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+FIRST_NAMES = ['Stephen', 'Andreas', 'Seth', 'Mary', 'Yuval Noah', 'Brandon', 'Ursula K.', 'Haruki', 'Chimamanda', 'Neil',
+               'Agatha', 'Isaac', 'Octavia E.', 'Terry', 'Margaret', 'Kazuo', 'Liu', 'Jane', 'Walter', 'Michelle']
+LAST_NAMES = ['King', 'Eschbach', 'Stephens-Davidowitz', 'Beard', 'Harari', 'Sanderson', 'Le Guin', 'Murakami', 'Adichie',
+              'Gaiman', 'Christie', 'Asimov', 'Butler', 'Pratchett', 'Atwood', 'Ishiguro', 'Cixin', 'Austen', 'Isaacson', 'Obama']
+# Audible adds translators, forewords, adaptors, ... to the list of authors
+CONTRIBUTOR_FORMATS = ['{} (translator)', '{} - foreword', '{} - introduction', '{} (adaptation)', '{} - editor']
+WORDS = ['Dark', 'Tower', 'Song', 'Everybody', 'Lies', 'Sapiens', 'Mistborn', 'Wizard', 'Earthsea', 'Norwegian', 'Wood',
+         'Half', 'Yellow', 'Sun', 'American', 'Gods', 'Murder', 'Orient', 'Express', 'Foundation', 'Kindred', 'Guards',
+         'Handmaid', 'Tale', 'Remains', 'Day', 'Three', 'Body', 'Problem', 'Pride', 'Prejudice', 'Steve', 'Jobs', 'Becoming']
+CATEGORY_LADDERS = [
+    ['Literature & Fiction', 'Horror'],
+    ['Literature & Fiction', 'Classics'],
+    ['Sci-Fi & Fantasy', 'Fantasy', 'Epic'],
+    ['Sci-Fi & Fantasy', 'Science Fiction', 'Hard Science Fiction'],
+    ['Science & Engineering', 'Science', 'Biology'],
+    ['History', 'World'],
+    ['Biographies & Memoirs', 'Professionals & Academics'],
+    ['Mystery, Thriller & Suspense', 'Mystery', 'Traditional Detectives'],
+    ['Business & Careers', 'Management & Leadership'],
+]
+# (content type, weight) similar to what a real library has
+CONTENT_TYPES = [('Product', 900), ('Performance', 20), ('Podcast', 30), ('Speech', 10), ('Newspaper / Magazine', 5),
+                 ('Radio/TV Program', 8), ('Show', 2)]
+PUBLISHERS = ['Random House Audio', 'Audible Studios', 'Brilliance Audio', 'Penguin Audio', 'Macmillan Audio',
+              'HarperAudio', 'Hachette Audio', 'Simon & Schuster Audio', 'Blackstone Audio', 'Tantor Audio']
+LANGUAGES = ['english', 'english', 'english', 'german', 'french', 'spanish']
+NEWEST_PURCHASE_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def make_title(rng, n_words):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def make_purchase_date(rng, index):
+    """
+    Newest purchases first (like Audible) using the assorted formats Audible returns
+    """
+    purchase_date = NEWEST_PURCHASE_DATE - timedelta(hours=5 * index, seconds=rng.randrange(3600))
+    if rng.random() < 0.8:
+        return purchase_date.strftime("%Y-%m-%dT%H:%M:%S.") + f"{rng.randrange(1000):03d}Z"
+    return purchase_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def make_category_ladders(rng):
+    ladders = []
+    for names in rng.sample(CATEGORY_LADDERS, rng.choice([1, 1, 2])):
+        ladders.append({
+            "ladder": [{"id": str(2226000000 + sum(map(ord, name)) * 97), "name": name} for name in names],
+            "root": "Genres",
+        })
+    return ladders
+
+
+def make_synthetic_audible_item(index, rng):
+    """
+    Create the raw Audible item of the index-th book of the library
+    """
+    asin = f"B{index:09d}" if rng.random() < 0.9 else f"{index:010d}"  # some ASINs are ISBNs with leading zeroes
+    authors = [{"asin": f"B{rng.randrange(10 ** 9):09d}", "name": make_name(rng)} for _ in range(rng.choice([1, 1, 1, 2]))]
+    if rng.random() < 0.15:
+        authors.append({"asin": None, "name": rng.choice(CONTRIBUTOR_FORMATS).format(make_name(rng))})
+    runtime_length_min = rng.choice([0, rng.randrange(5), rng.randrange(30, 2400), rng.randrange(300, 1200)])
+    content_type = rng.choices([name for name, _ in CONTENT_TYPES], [weight for _, weight in CONTENT_TYPES])[0]
+    release_date = (NEWEST_PURCHASE_DATE - timedelta(days=rng.randrange(30 * 365))).strftime("%Y-%m-%d")
+    title = make_title(rng, rng.randrange(1, 5))
+    item = {
+        "asin": asin,
+        "title": title,
+        "subtitle": make_title(rng, rng.randrange(2, 6)) if rng.random() < 0.3 else None,
+        "authors": authors,
+        "narrators": [{"asin": None, "name": make_name(rng)} for _ in range(rng.choice([0, 1, 1, 1, 2]))] or None,
+        "category_ladders": make_category_ladders(rng) if rng.random() < 0.95 else [],
+        "series": [{"asin": f"B{rng.randrange(10 ** 9):09d}", "sequence": str(rng.randrange(1, 12)), "title": make_title(rng, 2),
+                    "url": f"/pd/{title.replace(' ', '-')}-Audiobook/{asin}"}] if rng.random() < 0.25 else None,
+        "runtime_length_min": runtime_length_min,
+        "content_type": content_type,
+        "content_delivery_type": "SinglePartBook" if content_type == 'Product' else "Periodical",
+        "format_type": "unabridged" if rng.random() < 0.9 else "abridged",
+        "language": rng.choice(LANGUAGES),
+        "publisher_name": rng.choice(PUBLISHERS),
+        "publication_name": make_title(rng, 2) if content_type != 'Product' else None,
+        "purchase_date": make_purchase_date(rng, index),
+        "release_date": release_date,
+        "issue_date": release_date,
+        "is_adult_product": rng.random() < 0.01,
+        "merchandising_summary": "<p>" + " ".join(rng.choice(WORDS).lower() for _ in range(rng.randrange(10, 30))) + "</p>",
+        "publisher_summary": "<p>" + " ".join(rng.choice(WORDS).lower() for _ in range(rng.randrange(40, 120))) + "</p>",
+        "sku": f"BK_{rng.choice(['ADBL', 'RHCP', 'BLAK', 'HARP'])}_{index:06d}",
+        "status": "Active",
+    }
+    return item
+
+
+def iter_synthetic_audible_items(n_books, seed=0):
+    rng = random.Random(seed)
+    for index in range(n_books):
+        yield make_synthetic_audible_item(index, rng)
+
+
+def write_synthetic_raw_library(raw_library_path, n_books, seed=0):
+    """
+    Write a raw cache file (one JSON item per line) of n_books synthetic books
+    """
+    with open(raw_library_path, 'w') as raw_file:
+        for item in iter_synthetic_audible_items(n_books, seed):
+            raw_file.write(json.dumps(item) + "\n")
+
+    return raw_library_path
+
+
+if __name__ == "__main__":
+    write_synthetic_raw_library(sys.argv[2], int(sys.argv[1]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
@@ -1,7 +1,21 @@
 import pytest
 import re
 import sys
+import json
+import csv
+import configparser
+import time
+import threading
+import subprocess
+import tracemalloc
+import contextlib
+import io
 import warnings
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.error import HTTPError
+from urllib.request import urlopen, Request
 from audible2sheet.audible2sheet import *
 
 def test_main_cached_raw_specified_fields_filtered_by_asin(capsys):
@@ -108,3 +122,1399 @@ def test_extract_authors_from_json_data():
     assert extract_authors_from_json_data('') == 'UNKNOWN AUTHOR'
     assert extract_authors_from_json_data()   == 'UNKNOWN AUTHOR'
 
+
+# --------------------------------------------------------------------------------
+# Local fake Audible endpoint
+def make_fake_audible_item(index):
+    return {
+        "asin": f"B{index:09d}",
+        "title": f"Fake Title {index}",
+        "subtitle": f"Fake Subtitle {index}" if index % 3 == 0 else None,
+        "authors": [{"asin": None, "name": f"Author {index % 50}"},
+                    {"asin": None, "name": f"Translator {index % 7} (translator)"}],
+        "narrators": [{"asin": None, "name": f"Narrator {index % 40}"}],
+        "runtime_length_min": index % 900,
+        "content_type": "Speech" if index % 97 == 0 else "Product",
+        # newest purchases first like Audible does
+        "purchase_date": (datetime(2020, 1, 1, tzinfo=timezone.utc) - timedelta(hours=7 * index)).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+    }
+
+
+class FakeAudibleServer:
+    """
+    Serve fake Audible library pages from a local HTTP server with some made-up latency
+    """
+    def __init__(self, n_books, latency=0.0):
+        self.items = [make_fake_audible_item(index) for index in range(n_books)]
+        self.latency = latency
+        self.requests = []
+        self.fail_pages = set()
+        # page -> statuses returned (once each) before the page is served
+        self.failures = dict()
+        self.retry_after = None
+        # number of requests being served at the same time (and its maximum)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.in_flight_lock = threading.Lock()
+        # called with the page of each request before it's served
+        self.on_request = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                page = int(params['page'][0])
+                num_results = int(params['num_results'][0])
+                server.requests.append(page)
+                with server.in_flight_lock:
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    if server.on_request:
+                        server.on_request(page)
+                    time.sleep(server.latency)
+                    self.serve_page(page, num_results)
+                finally:
+                    with server.in_flight_lock:
+                        server.in_flight -= 1
+
+            def serve_page(self, page, num_results):
+                if page in server.fail_pages:
+                    self.send_error(500)
+                    return
+                if server.failures.get(page):
+                    status = server.failures[page].pop(0)
+                    self.send_response(status)
+                    if server.retry_after is not None:
+                        self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                items = server.items[(page - 1) * num_results:page * num_results]
+                body = json.dumps({"items": items}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Total-Count', str(len(server.items)))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeAudibleSession:
+    """
+    Stand-in for AudibleClient talking to a FakeAudibleServer (through a RequestScheduler if specified)
+    """
+    def __init__(self, url, scheduler=None):
+        self.url = url
+        self.scheduler = scheduler
+
+    def _get(self, path, headers=None, **params):
+        with urlopen(Request(f"{self.url}/{path}?{urlencode(params)}", headers=headers or {})) as response:
+            return json.loads(response.read()), response
+
+    def get(self, path, **params):
+        if self.scheduler:
+            return self.scheduler.run(self._get, path, **params)
+        return self._get(path, **params)
+
+
+@pytest.fixture
+def fake_audible_server():
+    server = FakeAudibleServer(n_books=2600, latency=0.1)
+    yield server
+    server.close()
+
+
+def fetch_from_fake_audible_server(server, root_path, fetch_workers):
+    audible_cfg = {'fetch_workers': str(fetch_workers), 'min_length': '1', 'content_type_to_omit': 'Speech'}
+    server.max_in_flight = 0
+    get_audible_books_and_save_to_file(audible_cfg, str(root_path), FakeAudibleSession(server.url))
+    files = [(root_path / name).read_bytes() for name in (AUDIBLE_RAW_FILE_PATH_DEFAULT, AUDIBLE_FILE_PATH_DEFAULT)]
+
+    return server.max_in_flight, files
+
+
+def test_get_audible_books_concurrently_is_identical_and_overlapping(fake_audible_server, tmp_path):
+    sequential_path = tmp_path / 'sequential'
+    concurrent_path = tmp_path / 'concurrent'
+    sequential_path.mkdir()
+    concurrent_path.mkdir()
+
+    sequential_in_flight, sequential_files = fetch_from_fake_audible_server(fake_audible_server, sequential_path, 1)
+    assert fake_audible_server.requests == [1, 2, 3, 4, 5, 6, 7]
+
+    fake_audible_server.requests = []
+    concurrent_in_flight, concurrent_files = fetch_from_fake_audible_server(fake_audible_server, concurrent_path, 8)
+    # no need to ask for an empty page when the total count is known
+    assert sorted(fake_audible_server.requests) == [1, 2, 3, 4, 5, 6]
+
+    assert concurrent_files == sequential_files
+    assert sequential_files[0].count(b'\n') == 2600
+    # the pages are requested one at a time or several at a time (the wall time is in the benchmarks)
+    assert sequential_in_flight == 1
+    assert 1 < concurrent_in_flight <= 8
+
+
+def test_get_audible_books_incrementally_merges_new_and_changed_books(tmp_path):
+    server = FakeAudibleServer(n_books=1200)
+    audible_cfg = {'fetch_workers': '1', 'min_length': '1', 'content_type_to_omit': 'Speech'}
+    incremental_path = tmp_path / 'incremental'
+    full_path = tmp_path / 'full'
+    incremental_path.mkdir()
+    full_path.mkdir()
+    try:
+        get_audible_books_and_save_to_file(audible_cfg, str(incremental_path), FakeAudibleSession(server.url))
+
+        # buy 2 new books and have Audible change the title of a recent one
+        server.items[0:0] = [make_fake_audible_item(index) for index in (-2, -1)]
+        server.items[5]["title"] = "Changed Title"
+        server.requests = []
+        get_audible_books_and_save_to_file(audible_cfg, str(incremental_path), FakeAudibleSession(server.url), incremental=True)
+        assert server.requests == [1]
+
+        get_audible_books_and_save_to_file(audible_cfg, str(full_path), FakeAudibleSession(server.url))
+    finally:
+        server.close()
+
+    for name in (AUDIBLE_RAW_FILE_PATH_DEFAULT, AUDIBLE_FILE_PATH_DEFAULT, AUDIBLE_SYNC_STATE_FILE_PATH_DEFAULT):
+        assert (incremental_path / name).read_bytes() == (full_path / name).read_bytes()
+    assert "Changed Title" in (incremental_path / AUDIBLE_FILE_PATH_DEFAULT).read_text()
+
+
+def test_get_audible_books_incrementally_adds_changed_books_no_longer_filtered_out(tmp_path):
+    server = FakeAudibleServer(n_books=50)
+    audible_cfg = {'fetch_workers': '1', 'min_length': '1'}
+    incremental_path = tmp_path / 'incremental'
+    full_path = tmp_path / 'full'
+    incremental_path.mkdir()
+    full_path.mkdir()
+    try:
+        get_audible_books_and_save_to_file(audible_cfg, str(incremental_path), FakeAudibleSession(server.url))
+        assert "B000000000" not in (incremental_path / AUDIBLE_FILE_PATH_DEFAULT).read_text()
+
+        # the length of a book filtered out because of its 0 minutes is fixed by Audible
+        server.items[0]["runtime_length_min"] = 30
+        get_audible_books_and_save_to_file(audible_cfg, str(incremental_path), FakeAudibleSession(server.url), incremental=True)
+        get_audible_books_and_save_to_file(audible_cfg, str(full_path), FakeAudibleSession(server.url))
+    finally:
+        server.close()
+
+    assert (incremental_path / AUDIBLE_FILE_PATH_DEFAULT).read_bytes() == (full_path / AUDIBLE_FILE_PATH_DEFAULT).read_bytes()
+    assert "B000000000" in (incremental_path / AUDIBLE_FILE_PATH_DEFAULT).read_text()
+
+
+@pytest.fixture
+def fake_library(tmp_path):
+    """
+    Configuration file and root path with cache files fetched from a fake Audible server
+    """
+    root_path = tmp_path / 'audible2sheet'
+    root_path.mkdir()
+    cfg_path = tmp_path / 'audible2sheet.ini'
+    cfg_path.write_text(f"""[general]
+root_path = {root_path}
+
+[audible_cfg]
+min_length = 1
+content_type_to_omit = Speech
+""")
+    server = FakeAudibleServer(n_books=700)
+    try:
+        cfg = configparser.ConfigParser()
+        cfg.read(cfg_path)
+        get_audible_books_and_save_to_file(cfg['audible_cfg'], str(root_path), FakeAudibleSession(server.url))
+    finally:
+        server.close()
+
+    return cfg_path, root_path
+
+
+def test_raw_library_index_lookup_by_asin(fake_library, capsys):
+    cfg_path, root_path = fake_library
+    raw_library_path = str(root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT)
+    assert os.path.exists(raw_library_path + RAW_LIBRARY_INDEX_SUFFIX)
+    assert len(load_raw_library_index(raw_library_path)) == 700
+
+    sys.argv = ['', '-c', str(cfg_path), '-A', '-R', 'asin title authors', '-f', 'B000000123']
+    main()
+    captured = capsys.readouterr()
+    assert captured.out == """asin|title|authors
+B000000123|Fake Title 123|Author 23
+"""
+    assert list(iter_raw_library_items(raw_library_path, 'BUNKNOWN')) == []
+
+
+def test_raw_library_index_is_rebuilt_when_raw_file_changes(fake_library):
+    cfg_path, root_path = fake_library
+    raw_library_path = root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT
+    # Change the raw file behind the back of the index
+    lines = raw_library_path.read_text().splitlines(keepends=True)
+    raw_library_path.write_text("".join(reversed(lines[1:])))
+
+    assert list(iter_raw_library_items(str(raw_library_path), 'B000000000')) == []
+    assert list(iter_raw_library_items(str(raw_library_path), 'B000000699')) == [make_fake_audible_item(699)]
+    assert load_valid_raw_library_index(str(raw_library_path))['B000000699'] == [0, len(lines[-1])]
+
+
+def test_raw_library_lookup_of_several_asins_without_index(fake_library, tmp_path, capsys):
+    cfg_path, root_path = fake_library
+    raw_library_path = root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT
+    items = [make_fake_audible_item(index) for index in range(10)]
+    # an author with the ASIN of a book and lines written by the different JSON codecs
+    items[2]["authors"][0]["asin"] = "B000000007"
+    raw_library_path.write_text("".join(json.dumps(item, separators=(',', ':') if index % 2 else None) + "\n"
+                                        for index, item in enumerate(items)))
+    os.remove(get_raw_library_index_path(str(raw_library_path)))
+    assert load_valid_raw_library_index(str(raw_library_path)) is None
+
+    lines = raw_library_path.read_bytes().splitlines(keepends=True)
+    asins = ["B000000007", "B000000004", "BUNKNOWN"]
+    # the line of the author is only a candidate
+    assert list(iter_raw_library_lines_matching_asins(str(raw_library_path), asins)) == [lines[2], lines[4], lines[7]]
+    assert list(iter_raw_library_items(str(raw_library_path), asins, ["title"])) == [{"title": "Fake Title 4"},
+                                                                                      {"title": "Fake Title 7"}]
+    assert load_valid_raw_library_index(str(raw_library_path)) is None
+
+    asins_path = tmp_path / 'asins.txt'
+    asins_path.write_text("B000000007\nB000000001, B000000004\n")
+    expected_output = "asin|title\nB000000001|Fake Title 1\nB000000004|Fake Title 4\nB000000007|Fake Title 7\n"
+    for asin_filter in ("B000000007,B000000001,B000000004", f"@{asins_path}"):
+        sys.argv = ['', '-c', str(cfg_path), '-A', '-R', 'asin title', '-f', asin_filter]
+        main()
+        assert capsys.readouterr().out == expected_output
+    # same with the index
+    build_raw_library_index(str(raw_library_path))
+    main()
+    assert capsys.readouterr().out == expected_output
+
+
+def test_snapshots_of_each_fetch(tmp_path, capsys):
+    server = FakeAudibleServer(n_books=700)
+    audible_cfg = {'fetch_workers': '1', 'min_length': '1'}
+    try:
+        # no snapshots by default
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url))
+        assert get_audible_snapshot_store(audible_cfg, str(tmp_path)) is None
+        assert not (tmp_path / 'snapshots').exists()
+
+        audible_cfg['snapshot_dir'] = 'snapshots'
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url))
+        # Audible changes the title of a book and a book is refunded
+        server.items[5]["title"] = "Changed Title"
+        del server.items[10]
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url))
+        # a new book is bought
+        server.items[0:0] = [make_fake_audible_item(-1)]
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url), incremental=True)
+    finally:
+        server.close()
+
+    store = get_audible_snapshot_store(audible_cfg, str(tmp_path))
+    first_id, second_id, third_id = store.get_snapshot_ids()
+    assert store.load_head()[0] == third_id
+    # the unchanged items are only stored once
+    assert len(store.objects) == 702
+    second = store.load_snapshot(second_id)
+    assert (second['parent'], second['n_items'], list(second['removed']), list(second['changed'])) == \
+           (first_id, 699, ["B000000010"], ["B000000005"])
+    assert list(store.load_snapshot(third_id)['added']) == ["B-00000001"]
+
+    # the diffs only read the deltas and the changed items
+    os.remove(os.path.join(store.path, SnapshotStore.OBJECTS_INDEX_FILE))
+    added, removed, changed = store.diff(first_id, third_id)
+    assert (list(added), list(removed)) == (["B-00000001"], ["B000000010"])
+    assert get_changed_fields(*changed["B000000005"]) == {"title": ("Fake Title 5", "Changed Title")}
+    added, removed, changed = store.diff(third_id, first_id)
+    assert (list(added), list(removed), list(changed)) == (["B000000010"], ["B-00000001"], ["B000000005"])
+    assert store.diff(second_id, second_id) == ({}, {}, {})
+
+    print_snapshots_diff(store, [])
+    assert capsys.readouterr().out == "CHANGE|ASIN|TITLE|FIELD|OLD|NEW\nADDED|B-00000001|Fake Title -1|||\n"
+    print_snapshots_diff(store, [first_id[:-4]])
+    assert capsys.readouterr().out.splitlines()[1:] == ["ADDED|B-00000001|Fake Title -1|||",
+                                                        "REMOVED|B000000010|Fake Title 10|||",
+                                                        "CHANGED|B000000005|Changed Title|title|Fake Title 5|Changed Title"]
+    print_snapshots_list(store)
+    assert capsys.readouterr().out.splitlines()[1:] == [f"{first_id}|700|700|0|0", f"{second_id}|699|0|1|1", f"{third_id}|700|1|0|0"]
+    with pytest.raises(Exception, match="No snapshot matching"):
+        store.find_snapshot_id("1999")
+
+
+def test_snapshots_diff_is_quoted(tmp_path, capsys):
+    server = FakeAudibleServer(n_books=3)
+    audible_cfg = {'fetch_workers': '1', 'min_length': '1', 'snapshot_dir': 'snapshots'}
+    try:
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url))
+        server.items[1]["title"] = 'Title | with "separator"'
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url))
+    finally:
+        server.close()
+
+    print_snapshots_diff(get_audible_snapshot_store(audible_cfg, str(tmp_path)), [])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[1] == 'CHANGED|B000000001|"Title | with ""separator"""|title|Fake Title 1|"Title | with ""separator"""'
+    assert list(csv.reader(lines, delimiter='|'))[1] == \
+           ["CHANGED", "B000000001", 'Title | with "separator"', "title", "Fake Title 1", 'Title | with "separator"']
+
+
+def test_main_rejects_more_than_2_snapshots_to_diff(tmp_path, capsys):
+    sys.argv = ['', '-D', '1', '2', '3']
+    with pytest.raises(SystemExit):
+        main()
+    assert "at most 2 snapshots" in capsys.readouterr().err
+
+
+def run_main_and_count_listed_values(cfg_path, field, capsys):
+    sys.argv = ['', '-c', str(cfg_path), '-A', '-L', field]
+    main()
+    output = capsys.readouterr().out
+    field_line_format = re.compile(r"^.+ \(\d+\)$")
+
+    return len([line for line in output.split("\n") if field_line_format.match(line)])
+
+
+def test_raw_field_stats_of_specified_field(fake_library, capsys):
+    cfg_path, root_path = fake_library
+    stats_path = str(root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT) + RAW_LIBRARY_STATS_SUFFIX
+    fields_and_count = {
+        'asin': 700,
+        'authors': 50,
+        'content_type': 2,
+        'narrators': 40,
+        'purchase_date': 700,
+        'title': 700,
+    }
+    # from the stats precomputed during the fetch and then computed on the fly for only the specified field
+    for saved_stats in (True, False):
+        if not saved_stats:
+            os.remove(stats_path)
+        for field, count in fields_and_count.items():
+            assert run_main_and_count_listed_values(cfg_path, field, capsys) == count
+        assert os.path.exists(stats_path) == saved_stats
+
+
+def test_raw_field_stats_only_computes_requested_fields():
+    stats = RawFieldStats(['authors'])
+    for index in range(100):
+        stats.add(make_fake_audible_item(index))
+    assert list(stats.fields) == ['authors']
+    assert stats.fields['authors']['Author 0'] == 2
+
+
+def test_raw_field_stats_drop_the_histograms_of_unbounded_fields(tmp_path, monkeypatch, capsys):
+    stats = RawFieldStats(max_values=60)
+    for index in range(100):
+        stats.add(make_fake_audible_item(index))
+    assert stats.overflowed == {'asin', 'title', 'runtime_length_min', 'purchase_date'}
+    assert len(stats.fields['authors']) == 50 and 'title' not in stats.fields
+
+    # the whole histogram of an overflowed field is computed on the fly with -L
+    monkeypatch.setattr(sys.modules[RawFieldStats.__module__], 'RAW_FIELD_STATS_MAX_VALUES', 60)
+    raw_library_path = str(tmp_path / AUDIBLE_RAW_FILE_PATH_DEFAULT)
+    with RawLibraryWriter(raw_library_path) as raw_writer:
+        for index in range(100):
+            raw_writer.write(make_fake_audible_item(index))
+    print_raw_data_fields_list(raw_library_path, None)
+    output = capsys.readouterr().out
+    assert "title (more than 60 different values)" in output
+    assert "authors (50 different values)" in output
+    print_raw_data_fields_list(raw_library_path, 'title')
+    assert len(capsys.readouterr().out.splitlines()) == 100
+
+
+def test_raw_library_writer_memory_doesnt_grow_with_the_summaries(tmp_path):
+    def measure_peak(n_items):
+        raw_library_path = str(tmp_path / f"raw_{n_items}.txt")
+        tracemalloc.start()
+        try:
+            with RawLibraryWriter(raw_library_path) as raw_writer:
+                for index in range(n_items):
+                    item = make_fake_audible_item(index)
+                    item["publisher_summary"] = f"<p>Summary {index}</p>" + "x" * 2000
+                    raw_writer.write(item)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return peak, os.path.getsize(raw_library_path)
+
+    small_peak, small_size = measure_peak(2000)
+    large_peak, large_size = measure_peak(8000)
+    # only the ASIN index grows with the number of items (and not the summaries)
+    assert large_peak < 2 * small_peak
+    assert large_peak < large_size / 4
+
+
+def test_main_list_of_fields_from_precomputed_stats(fake_library, capsys):
+    cfg_path, root_path = fake_library
+    sys.argv = ['', '-c', str(cfg_path), '-A', '-l']
+    main()
+    from_saved_stats = capsys.readouterr().out
+    os.remove(str(root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT) + RAW_LIBRARY_STATS_SUFFIX)
+    main()
+    assert capsys.readouterr().out == from_saved_stats
+    assert "subtitle (235 different values)" in from_saved_stats
+    assert "content_type (2 different values)" in from_saved_stats
+
+
+def make_book(index, title=None):
+    return Book(f"B{index:09d}", title or f"Title {index}", f"Author {index}", "01h00m", "20200101")
+
+
+def make_book_table(books, first_row_number=2):
+    table = BookTable()
+    for row_number, book in enumerate(books, first_row_number):
+        table.append([book.asin, book.title, book.authors, book.duration, book.purchase_date], row_number)
+    return table
+
+
+def test_get_book_rows_diff_respects_gs_header_order():
+    gs_header_cols = ['TITLE', 'MY_RATING', 'ASIN', 'AUTHORS', 'DURATION', 'PURCHASE_DATE']
+    audible_books  = make_book_table([make_book(1), make_book(2, 'New Title'), make_book(3)])
+    gs_books       = make_book_table([make_book(2), make_book(3), make_book(4)])
+
+    diff = get_book_rows_diff(audible_books, gs_books, gs_header_cols)
+    assert diff.insert_rows == [['Title 1', '', 'B000000001', 'Author 1', "'01h00m", '20200101']]
+    assert diff.update_rows == [(2, ['New Title', '', 'B000000002', 'Author 2', "'01h00m", '20200101'])]
+    assert diff.delete_row_numbers == []
+    assert len(diff) == 2
+
+    diff = get_book_rows_diff(audible_books, gs_books, gs_header_cols, delete_missing_books=True)
+    assert diff.delete_row_numbers == [4]
+
+
+def test_get_update_ranges_and_values_skips_user_columns():
+    gs_header_cols = ['ASIN', 'MY_RATING', 'TITLE', 'AUTHORS', 'DURATION', 'PURCHASE_DATE']
+    books = make_book_table([make_book(row_number) for row_number in (9, 3, 4, 5)])
+    build_book_row = get_book_row_builder(books, gs_header_cols)
+    update_rows = [(row_number, build_book_row(position)) for position, row_number in enumerate((9, 3, 4, 5))]
+
+    ranges, values = get_update_ranges_and_values(update_rows, gs_header_cols)
+    assert ranges == ['A3:A5', 'C3:F5', 'A9:A9', 'C9:F9']
+    assert values[0] == [['B000000003'], ['B000000004'], ['B000000005']]
+    assert values[3] == [['Title 9', 'Author 9', "'01h00m", '20200101']]
+
+
+def test_book_table_from_file_matches_books_dict(tmp_path):
+    library_path = str(tmp_path / GSHEET_FILE_PATH_DEFAULT)
+    with open(library_path, 'w') as writer:
+        writer.write("MY_RATING|PURCHASE_DATE|ASIN|TITLE|AUTHORS|DURATION\n")
+        writer.write("5|20200101|B000000001|Title 1|Author 1|01h00m\n")
+        writer.write("|||||\n")
+        writer.write("3|20200102|B000000002| |Author 2|02h00m\n")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        books_dict = create_books_dict_from_file(library_path)
+        books      = BookTable.from_file(library_path)
+
+    assert len(books) == 2
+    assert list(books.row_numbers) == [2, 4]
+    assert [repr(books.get_book(position)) for position in books.asin_index.values()] == \
+           [repr(book) for book in books_dict.values()]
+    assert repr(books.get_book(1)) == \
+           "Book(asin=B000000002, title=???, authors=Author 2, duration=02h00m, purchase_date=20200102)"
+
+
+def test_get_a1_column_name():
+    assert get_a1_column_name(1)   == 'A'
+    assert get_a1_column_name(26)  == 'Z'
+    assert get_a1_column_name(27)  == 'AA'
+    assert get_a1_column_name(703) == 'AAA'
+
+
+def write_fake_audible_library_file(library_path, n_books, changed_every=None):
+    with open(library_path, 'w') as writer:
+        writer.write("|".join(Book.FIELD_NAMES)+"\n")
+        for index in range(n_books):
+            title = "Changed Title" if changed_every and index % changed_every == 0 else None
+            book = make_book(index, title)
+            writer.write("|".join([book.asin, book.title, book.authors, book.duration, book.purchase_date])+"\n")
+
+
+def sync_wks_with_audible_books(wks, audible_library_path, gs_library_path, delete_missing_books=False, manifest_path=None):
+    # same steps as sync_job without loading the sheet while the Audible books are fetched
+    audible_books = load_audible_books(audible_library_path)
+    sheet_books = load_gs_sheet_books(wks, gs_library_path, audible_books.field_names, manifest_path)
+    sync_gs_sheet_books_with_audible_books(wks, sheet_books, audible_books, gs_library_path, delete_missing_books, manifest_path)
+
+
+def test_sync_local_wks_inserts_then_updates(tmp_path):
+    audible_library_path = str(tmp_path / AUDIBLE_FILE_PATH_DEFAULT)
+    gs_library_path      = str(tmp_path / GSHEET_FILE_PATH_DEFAULT)
+    local_file_path      = str(tmp_path / GSHEET_LOCAL_FILE_PATH_DEFAULT)
+    write_fake_audible_library_file(audible_library_path, 100)
+
+    wks = get_gs_wks({'backend': 'local', 'local_file_path': local_file_path}, str(tmp_path))
+    sync_wks_with_audible_books(wks, audible_library_path, gs_library_path)
+    assert wks.rows[0] == Book.FIELD_NAMES
+    assert len(wks.rows) == 101
+    assert dict(wks.calls) == {'get_all_values': 1, 'insert_rows': 2, 'frozen_rows': 1}
+
+    # from the saved file with some titles changed
+    write_fake_audible_library_file(audible_library_path, 100, changed_every=10)
+    wks = LocalWorksheet(local_file_path)
+    sync_wks_with_audible_books(wks, audible_library_path, gs_library_path)
+    assert dict(wks.calls) == {'get_all_values': 1, 'update_values_batch': 1}
+    assert sum(row[1] == "Changed Title" for row in wks.rows) == 10
+
+    wks = LocalWorksheet(local_file_path)
+    sync_wks_with_audible_books(wks, audible_library_path, gs_library_path)
+    assert dict(wks.calls) == {'get_all_values': 1}
+
+
+def test_sync_local_wks_with_multi_line_cells(tmp_path):
+    audible_library_path = str(tmp_path / AUDIBLE_FILE_PATH_DEFAULT)
+    gs_library_path      = str(tmp_path / GSHEET_FILE_PATH_DEFAULT)
+    write_fake_audible_library_file(audible_library_path, 4)
+    wks = LocalWorksheet()
+    sync_wks_with_audible_books(wks, audible_library_path, gs_library_path)
+    # a user managed column with a note over 2 lines in the first book row
+    wks.rows[0].append("NOTES")
+    wks.rows[1].append("first line\nsecond line")
+
+    write_fake_audible_library_file(audible_library_path, 4, changed_every=2)
+    sync_wks_with_audible_books(wks, audible_library_path, gs_library_path)
+    assert [row[:2] for row in wks.rows[1:]] == [["B000000000", "Changed Title"], ["B000000001", "Title 1"],
+                                                 ["B000000002", "Changed Title"], ["B000000003", "Title 3"]]
+    assert wks.rows[1][-1] == "first line\nsecond line"
+
+
+def test_sync_local_wks_with_manifest(tmp_path):
+    audible_library_path = str(tmp_path / AUDIBLE_FILE_PATH_DEFAULT)
+    gs_library_path      = str(tmp_path / GSHEET_FILE_PATH_DEFAULT)
+    manifest_path        = get_gs_manifest_path(gs_library_path)
+    wks = LocalWorksheet()
+    write_fake_audible_library_file(audible_library_path, 100)
+
+    def sync(delete_missing_books=False):
+        wks.calls.clear()
+        sync_wks_with_audible_books(wks, audible_library_path, gs_library_path, delete_missing_books, manifest_path)
+        return dict(wks.calls)
+
+    # the whole sheet is downloaded the first time
+    assert sync() == {'get_all_values': 1, 'insert_rows': 2, 'frozen_rows': 1}
+    write_fake_audible_library_file(audible_library_path, 100, changed_every=10)
+    assert sync() == {'get_row': 1, 'get_col': 1, 'update_values_batch': 1}
+    assert sum(row[1] == "Changed Title" for row in wks.rows) == 10
+    assert sync() == {'get_row': 1, 'get_col': 1}
+
+    # rows moved around by the user are found by ASIN and only the rows unknown to the manifest are downloaded
+    wks.rows[1:] = wks.rows[:0:-1] + [["B999999999", "User Title", "User", "01h00m", "20200101"]]
+    assert sync() == {'get_row': 1, 'get_col': 1, 'get_values': 1}
+    assert sync(delete_missing_books=True) == {'get_row': 1, 'get_col': 1, 'delete_rows': 1}
+    assert len(wks.rows) == 101 and wks.rows[1][0] == "B000000099"
+
+    # a user managed column: the whole sheet is downloaded again
+    wks.rows[0].append("MY_RATING")
+    assert sync() == {'get_row': 1, 'get_all_values': 1}
+    assert sync() == {'get_row': 1, 'get_col': 1}
+
+
+def test_local_wks_quota():
+    wks = LocalWorksheet(max_calls_per_minute=2)
+    wks.get_all_values()
+    wks.get_all_values()
+    with pytest.raises(QuotaExceededError):
+        wks.get_all_values()
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def get_imported_modules(args):
+    """
+    Run python with the specified arguments and return the modules it imported (see python -X importtime)
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=REPO_ROOT, capture_output=True, text=True,
+                            check=True)
+    return {line.split('|')[-1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+
+
+def test_import_doesnt_load_network_client_libraries():
+    imported = get_imported_modules(['-c', 'import audible2sheet.audible2sheet'])
+    assert 'audible2sheet.audible2sheet' in imported
+    assert 'audible' not in imported
+    assert 'pygsheets' not in imported
+
+
+@pytest.mark.parametrize('cache_only_args', [['-A', '-l'], ['-A', '-R', 'asin title authors series']])
+def test_cache_only_commands_dont_load_network_client_libraries(fake_library, cache_only_args):
+    # the startup time of these commands is in the benchmarks
+    cfg_path, _ = fake_library
+    imported = get_imported_modules(['-m', 'audible2sheet.audible2sheet', '-c', str(cfg_path)] + cache_only_args)
+    assert 'audible' not in imported
+    assert 'pygsheets' not in imported
+    assert 'httpx' not in imported
+
+
+@pytest.mark.parametrize('fetch_workers', [1, 4])
+def test_failed_fetch_leaves_previous_cache_files_intact(fetch_workers, tmp_path):
+    server = FakeAudibleServer(n_books=2000)
+    audible_cfg = {'fetch_workers': str(fetch_workers), 'min_length': '1'}
+    names = (AUDIBLE_RAW_FILE_PATH_DEFAULT, AUDIBLE_FILE_PATH_DEFAULT, AUDIBLE_SYNC_STATE_FILE_PATH_DEFAULT)
+    try:
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url))
+        previous_files = [(tmp_path / name).read_bytes() for name in names]
+
+        server.items[0]["title"] = "Changed Title"
+        server.fail_pages = {3}
+        with pytest.raises(HTTPError):
+            get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url))
+    finally:
+        server.close()
+
+    assert [(tmp_path / name).read_bytes() for name in names] == previous_files
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+def get_installed_json_codecs():
+    codecs = []
+    for name in JSON_CODECS:
+        try:
+            codecs.append(get_json_codec(name))
+        except ImportError:
+            pass
+    return codecs
+
+
+@pytest.mark.parametrize('codec', get_installed_json_codecs(), ids=lambda codec: codec.name)
+def test_json_codecs_decode_same_items(codec):
+    item = make_fake_audible_item(3)
+    item['title'] = 'Café – Fake'
+    line = codec.dumps(item)
+    for other_codec in get_installed_json_codecs():
+        assert other_codec.loads(line) == item
+    assert codec.decode_fields(line, ['asin', 'subtitle', 'series']) == {'asin': 'B000000003', 'subtitle': 'Fake Subtitle 3'}
+
+
+@pytest.mark.parametrize('codec', get_installed_json_codecs(), ids=lambda codec: codec.name)
+def test_json_codecs_decode_fields_which_arent_identifiers(codec):
+    item = make_fake_audible_item(3)
+    item['some-field'] = 'value'
+    line = codec.dumps(item)
+    assert codec.decode_fields(line, ['title', 'some-field', '__init__']) == {'title': 'Fake Title 3', 'some-field': 'value'}
+
+
+def test_main_with_each_json_codec(fake_library, capsys):
+    cfg_path, _ = fake_library
+    outputs = []
+    for codec in get_installed_json_codecs():
+        cfg = configparser.ConfigParser()
+        cfg.read(cfg_path)
+        cfg['general']['json_codec'] = codec.name
+        with open(cfg_path, 'w') as cfg_file:
+            cfg.write(cfg_file)
+        sys.argv = ['', '-c', str(cfg_path), '-A', '-R', 'asin title authors narrators']
+        main()
+        outputs.append(capsys.readouterr().out)
+    set_raw_json_codec('json')
+    assert outputs.count(outputs[0]) == len(outputs)
+
+
+def test_convert_utc_time_to_ccyymmdd_doesnt_print(capsys, recwarn):
+    assert convert_utc_time_to_ccyymmdd("2019-06-30") == "20190630"
+    assert capsys.readouterr().out == ""
+
+
+def test_convert_utc_times_to_ccyymmdd_matches_one_at_a_time():
+    utc_times = ["2019-06-30T23:58:29.551Z", "2019-06-30T23:58:29Z", "2019-06-30T23:58:29.551Z",
+                 "2019-06-30T23:58:29.551+02:00", "2019-06-30T23:58Z", "2020-02-29T00:00:00.000001Z", "2019-06-30", ""]
+    expected = []
+    for utc_time in utc_times:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            ccyymmdd = convert_utc_time_to_ccyymmdd(utc_time)
+        # same as strptime without any cache
+        utc_datetime = None
+        for utc_format in ("%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z"):
+            try:
+                utc_datetime = datetime.strptime(utc_time, utc_format)
+                break
+            except ValueError:
+                pass
+        if utc_datetime:
+            assert ccyymmdd == utc_datetime.replace(tzinfo=timezone.utc).astimezone(tz=None).strftime("%Y%m%d")
+        expected.append(ccyymmdd)
+
+    with warnings.catch_warnings(record=True) as caught_warnings:
+        warnings.simplefilter("always")
+        assert convert_utc_times_to_ccyymmdd(utc_times) == expected
+    # the unknown formats are still reported
+    assert [str(w.message) for w in caught_warnings] == ["Unknown date format for: 2019-06-30T23:58Z",
+                                                 "Unknown date format for: 2019-06-30",
+                                                 "Unknown date format for: "]
+
+
+def test_convert_lengths_in_minutes_to_hr_min_str():
+    assert convert_lengths_in_minutes_to_hr_min_str([123, 0, 123, 6000]) == ["02h03m", "00h00m", "02h03m", "100h00m"]
+
+
+def set_cfg_values(cfg_path, section, **values):
+    cfg = configparser.ConfigParser()
+    cfg.read(cfg_path)
+    for key, value in values.items():
+        cfg[section][key] = value
+    with open(cfg_path, 'w') as cfg_file:
+        cfg.write(cfg_file)
+
+
+def test_rebuild_audible_books_file_from_raw_file(fake_library, capsys):
+    cfg_path, root_path = fake_library
+    library_path = root_path / AUDIBLE_FILE_PATH_DEFAULT
+    fetched_library = library_path.read_bytes()
+    library_path.unlink()
+
+    sys.argv = ['', '-c', str(cfg_path), '-B']
+    main()
+    assert library_path.read_bytes() == fetched_library
+    assert capsys.readouterr().out == fetched_library.decode() + "\n"
+
+    set_cfg_values(cfg_path, 'audible_cfg', min_length='450', content_type_to_omit='', asins_to_omit='B000000451 B000000452')
+    main()
+    expected_books = [index for index in range(700) if index % 900 >= 450 and index not in (451, 452)]
+    assert library_path.read_text().count("\n") == len(expected_books) + 1
+
+
+def test_rebuild_audible_books_file_with_processes(fake_library, monkeypatch):
+    cfg_path, root_path = fake_library
+    library_path = root_path / AUDIBLE_FILE_PATH_DEFAULT
+    fetched_library = library_path.read_bytes()
+    monkeypatch.setattr(sys.modules[rebuild_audible_books_file_from_raw_file.__module__], 'REBUILD_PROCESS_POOL_MIN_SIZE', 0)
+    monkeypatch.setattr(sys.modules[rebuild_audible_books_file_from_raw_file.__module__], 'REBUILD_BATCH_SIZE', 50)
+    monkeypatch.setattr(sys.modules[rebuild_audible_books_file_from_raw_file.__module__], 'REBUILD_CHUNK_SIZE', 20000)
+
+    n_books = rebuild_audible_books_file_from_raw_file({'min_length': '1', 'content_type_to_omit': 'Speech',
+                                                        'rebuild_workers': '3'}, str(root_path))
+    assert n_books == fetched_library.count(b"\n") - 1
+    assert library_path.read_bytes() == fetched_library
+
+
+def test_raw_library_byte_ranges_are_projected_in_parallel(fake_library, monkeypatch, capsys):
+    _, root_path = fake_library
+    raw_library_path = str(root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT)
+    raw_library = (root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT).read_bytes()
+    byte_ranges = get_raw_library_byte_ranges(raw_library_path, 20000)
+    assert len(byte_ranges) > 3
+    assert [start for start, _ in byte_ranges[1:]] == [end for _, end in byte_ranges[:-1]]
+    assert byte_ranges[-1][1] == len(raw_library)
+    assert b"".join(b"".join(read_raw_library_lines_in_range(raw_library_path, *byte_range)) for byte_range in byte_ranges) == \
+           raw_library
+    assert all(raw_library[end - 1:end] == b"\n" for _, end in byte_ranges)
+
+    fields = "asin title authors narrators category_ladders series purchase_date".split()
+    print_specified_field_from_raw_file(raw_library_path, fields, None)
+    sequential_output = capsys.readouterr().out
+    monkeypatch.setattr(sys.modules[print_specified_field_from_raw_file.__module__], 'REBUILD_PROCESS_POOL_MIN_SIZE', 0)
+    monkeypatch.setattr(sys.modules[print_specified_field_from_raw_file.__module__], 'REBUILD_CHUNK_SIZE', 20000)
+    print_specified_field_from_raw_file(raw_library_path, fields, None, workers=3)
+    assert capsys.readouterr().out == sequential_output
+
+
+def test_default_projection_plan_builds_book_rows():
+    items = [make_fake_audible_item(index) for index in range(1, 50)]
+    rows = get_audible_book_rows(items, 1, ['Speech'], [])
+    assert compile_projection_plan(DEFAULT_BOOK_COLUMNS) is compile_projection_plan(DEFAULT_BOOK_COLUMNS)
+    for item, row in zip(items, rows):
+        title = item["title"] + ": " + item["subtitle"] if item["subtitle"] else item["title"]
+        assert row == "|".join([item["asin"], title, extract_authors_from_json_data(item["authors"]),
+                                convert_length_in_minutes_to_hr_min_str(item["runtime_length_min"]),
+                                convert_utc_time_to_ccyymmdd(item["purchase_date"])])
+
+
+def test_get_book_columns():
+    cfg = configparser.ConfigParser()
+    cfg.optionxform = str
+    assert get_book_columns(cfg) == DEFAULT_BOOK_COLUMNS
+    cfg.read_string("""[google_sheet_columns]
+Narrators = narrators
+TITLE = title
+""")
+    columns = get_book_columns(cfg)
+    assert [header for header, _ in columns] == Book.FIELD_NAMES + ['Narrators']
+    assert dict(columns)['TITLE'] == 'title'
+
+    rows = get_audible_book_rows([make_fake_audible_item(3)], 1, [], [], columns)
+    assert rows == ["B000000003|Fake Title 3|Author 3|00h03m|20191231|Narrator 3"]
+
+    # the ASIN column is the key of the books
+    cfg.read_string("""[google_sheet_columns]
+ASIN = isbn
+""")
+    with pytest.raises(Exception, match="The ASIN column can't be mapped"):
+        get_book_columns(cfg)
+
+
+def test_specified_fields_are_displayed_unquoted():
+    item = make_fake_audible_item(3)
+    item["title"] = 'The "Best" Book'
+    assert project_raw_items([item], ['title', 'asin']) == ['The "Best" Book|B000000003']
+
+
+def test_extra_columns_are_exported_to_the_sheet(fake_library, capsys):
+    cfg_path, root_path = fake_library
+    with open(cfg_path, 'a') as cfg_file:
+        cfg_file.write("""
+[google_sheet_columns]
+NARRATORS = narrators
+SERIES = series
+
+[google_sheet_cfg]
+backend = local
+""")
+    sys.argv = ['', '-c', str(cfg_path), '-B', '-g']
+    main()
+    header = "|".join(Book.FIELD_NAMES + ['NARRATORS', 'SERIES'])
+    library_lines = (root_path / AUDIBLE_FILE_PATH_DEFAULT).read_text().splitlines()
+    assert library_lines[0] == header
+    assert library_lines[1].endswith("|Narrator 1|???")
+
+    wks = LocalWorksheet(str(root_path / GSHEET_LOCAL_FILE_PATH_DEFAULT))
+    assert wks.rows[0] == header.split("|")
+    assert len(wks.rows) == len(library_lines)
+    assert wks.rows[1][-2:] == ["Narrator 1", "???"]
+
+    # nothing left to update once exported
+    capsys.readouterr()
+    main()
+    assert "No new or changed books found" in capsys.readouterr().err
+
+
+def test_scheduler_retries_throttled_and_failed_pages(tmp_path):
+    server = FakeAudibleServer(n_books=2000)
+    audible_cfg = {'fetch_workers': '4', 'min_length': '1'}
+    clean_path = tmp_path / 'clean'
+    retried_path = tmp_path / 'retried'
+    clean_path.mkdir()
+    retried_path.mkdir()
+    try:
+        get_audible_books_and_save_to_file(audible_cfg, str(clean_path), FakeAudibleSession(server.url))
+
+        server.failures = {1: [503], 2: [429, 502], 4: [429]}
+        server.retry_after = 0.2
+        server.requests = []
+        scheduler = RequestScheduler(max_in_flight=4, backoff_base=0.01)
+        start = time.perf_counter()
+        get_audible_books_and_save_to_file(audible_cfg, str(retried_path), FakeAudibleSession(server.url, scheduler))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.close()
+
+    assert sorted(server.requests) == [1, 1, 2, 2, 2, 3, 4, 4]
+    assert scheduler.retries == 4
+    # Retry-After is honored
+    assert elapsed >= 0.2
+    for name in (AUDIBLE_RAW_FILE_PATH_DEFAULT, AUDIBLE_FILE_PATH_DEFAULT):
+        assert (retried_path / name).read_bytes() == (clean_path / name).read_bytes()
+
+
+def test_scheduler_gives_up(tmp_path):
+    server = FakeAudibleServer(n_books=10)
+    try:
+        session = FakeAudibleSession(server.url, RequestScheduler(max_retries=2, backoff_base=0.01))
+        server.fail_pages = {1}
+        with pytest.raises(HTTPError):
+            get_audible_library_page(session, 1)
+        assert server.requests == [1, 1, 1]
+
+        # client errors aren't worth retrying
+        server.requests = []
+        server.fail_pages = set()
+        server.failures = {1: [404, 404]}
+        with pytest.raises(HTTPError):
+            get_audible_library_page(session, 1)
+        assert server.requests == [1]
+    finally:
+        server.close()
+
+
+def test_scheduler_rate_limit_and_requests_in_flight():
+    scheduler = RequestScheduler(requests_per_second=50, burst=1)
+    start = time.perf_counter()
+    for _ in range(11):
+        scheduler.run(lambda: None)
+    assert time.perf_counter() - start >= 0.19
+    assert scheduler.requests == 11
+
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def request():
+        with lock:
+            in_flight.append(1)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.02)
+        with lock:
+            in_flight.pop()
+
+    scheduler = RequestScheduler(max_in_flight=2)
+    threads = [threading.Thread(target=scheduler.run, args=(request,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(max_in_flight) == 2
+
+
+class FakeRatelimitError(Exception):
+    """
+    Error raised by audible when throttled: a code and the (httpx) response but no headers of its own
+    """
+    def __init__(self, response):
+        super().__init__("Too Many Requests")
+        self.response = response
+        self.code = response.status_code
+
+
+class FakeHttpxResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+def test_scheduler_honors_retry_after_of_audible_errors():
+    error = FakeRatelimitError(FakeHttpxResponse(429, {'Retry-After': '7'}))
+    assert get_error_status_and_headers(error) == (429, {'Retry-After': '7'})
+    scheduler = RequestScheduler(backoff_base=0.01)
+    assert scheduler.get_retry_delay(error, 0) == 7.0
+    assert scheduler._paused_until > time.monotonic() + 6
+
+
+def test_scheduler_doesnt_hold_the_lock_while_waiting():
+    scheduler = RequestScheduler(requests_per_second=1, burst=1)
+    scheduler.run(lambda: None)
+    waiting = threading.Thread(target=scheduler.run, args=(lambda: None,))
+    waiting.start()
+    time.sleep(0.1)
+    # the request waits for its token without blocking the others (e.g. a pause after a 429)
+    assert scheduler._lock.acquire(timeout=0.5)
+    assert scheduler.requests == 1
+    scheduler._lock.release()
+    waiting.join()
+    assert scheduler.requests == 2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_response_cache_reuses_fresh_pages(tmp_path):
+    server = FakeAudibleServer(n_books=1200)
+    audible_cfg = {'fetch_workers': '4', 'min_length': '1'}
+    cache = ResponseCache(str(tmp_path / AUDIBLE_RESPONSE_CACHE_DIR_DEFAULT))
+    try:
+        session = CachedAudibleSession(FakeAudibleSession(server.url), cache)
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), session)
+        assert (session.misses, session.hits) == (3, 0)
+
+        # expired pages are requested again
+        server.items[600]["title"] = "Changed Title"
+        server.requests = []
+        session = CachedAudibleSession(FakeAudibleSession(server.url), cache)
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), session)
+        assert (session.misses, session.hits) == (3, 0)
+        assert sorted(server.requests) == [1, 2, 3]
+        assert "Changed Title" in (tmp_path / AUDIBLE_FILE_PATH_DEFAULT).read_text()
+
+        # fresh pages aren't even requested
+        cache.ttl = 3600
+        server.requests = []
+        session = CachedAudibleSession(FakeAudibleSession(server.url), cache)
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), session)
+        assert (session.misses, session.hits) == (0, 3)
+        assert server.requests == []
+
+        # the pages are cached per locale
+        session = CachedAudibleSession(FakeAudibleSession(server.url), cache, locale='de')
+        get_audible_library_page(session, 1)
+        assert session.misses == 1
+    finally:
+        server.close()
+
+
+def test_response_cache_is_opt_in(tmp_path):
+    assert get_audible_response_cache({}, str(tmp_path)) is None
+    cache = get_audible_response_cache({'response_cache_max_size': '1', 'response_cache_ttl': '60'}, str(tmp_path))
+    assert (cache.ttl, cache.max_size) == (60, 1024 * 1024)
+
+
+def test_response_cache_evicts_least_recently_used_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_size=3000)
+    body = {"items": ["x" * 900]}
+    for page in range(1, 4):
+        cache.save(cache.get_key('us', 'library', page), body, {})
+        time.sleep(0.01)
+    # page 1 becomes the most recently used
+    assert cache.load(cache.get_key('us', 'library', 1))["body"] == body
+    cache.save(cache.get_key('us', 'library', 4), body, {})
+
+    assert cache.load(cache.get_key('us', 'library', 2)) is None
+    assert all(cache.load(cache.get_key('us', 'library', page)) for page in (1, 4))
+    assert sum(path.stat().st_size for path in tmp_path.glob('*.json')) <= 3000
+    # the cache size is known when reopened
+    assert sum(ResponseCache(str(tmp_path), max_size=3000)._sizes.values()) <= 3000
+
+
+class FakeAudibleModule:
+    """
+    Stand-in for the audible package recording how the authenticators are created
+    """
+    def __init__(self):
+        self.calls = []
+        module = self
+
+        class FakeAuthenticator:
+            def __init__(self, expires):
+                self.expires = expires
+
+            def refresh_access_token(self, force=False):
+                module.calls.append(('refresh_access_token', force))
+                self.expires = time.time() + 3600
+
+            def to_file(self, filename, encryption=False):
+                module.calls.append(('to_file', filename))
+                with open(filename, 'w') as session_file:
+                    json.dump({"expires": self.expires, "adp_token": "token", "device_private_key": "key"}, session_file)
+
+        def FileAuthenticator(filename, locale, register=False):
+            module.calls.append(('FileAuthenticator', register))
+            with open(filename) as session_file:
+                return FakeAuthenticator(json.load(session_file)["expires"])
+
+        def LoginAuthenticator(email, password, locale, register=False):
+            module.calls.append(('LoginAuthenticator', register))
+            return FakeAuthenticator(time.time() + 3600)
+
+        self.FileAuthenticator = FileAuthenticator
+        self.LoginAuthenticator = LoginAuthenticator
+        self.AudibleAPI = lambda auth: object()
+
+
+@pytest.fixture
+def fake_audible_module(monkeypatch):
+    module = FakeAudibleModule()
+    monkeypatch.setitem(sys.modules, 'audible', module)
+    monkeypatch.setattr(sys.modules[AudibleClient.__module__], 'audible_clients', dict())
+    return module
+
+
+def test_audible_client_reuses_registered_session(fake_audible_module, tmp_path):
+    session_path = tmp_path / 'audible_session.txt'
+    session_path.write_text(json.dumps({"expires": time.time() + 3600, "adp_token": "token", "device_private_key": "key"}))
+    client = get_audible_client('me@example.com', 'secret', 'us', str(session_path))
+    assert fake_audible_module.calls == [('FileAuthenticator', False)]
+    assert get_audible_client('me@example.com', 'secret', 'us', str(session_path)) is client
+    # the CLI stops refreshing the access tokens once done
+    close_audible_clients()
+    assert client._refresh_timer.finished.is_set()
+    assert get_audible_client('me@example.com', 'secret', 'us', str(session_path)) is not client
+    close_audible_clients()
+
+    # not registered yet: registered once and saved
+    session_path.write_text(json.dumps({"expires": time.time() + 3600}))
+    fake_audible_module.calls = []
+    AudibleClient('me@example.com', 'secret', 'us', str(session_path)).close()
+    assert fake_audible_module.calls == [('FileAuthenticator', True), ('to_file', str(session_path))]
+    assert is_audible_device_registered(load_audible_session_file(str(session_path)))
+
+    # expired: only log in with the credentials
+    session_path.write_text(json.dumps({"expires": time.time() - 1}))
+    fake_audible_module.calls = []
+    AudibleClient('me@example.com', 'secret', 'us', str(session_path)).close()
+    assert fake_audible_module.calls == [('LoginAuthenticator', True), ('to_file', str(session_path))]
+
+
+def test_audible_client_refreshes_access_token_in_background(fake_audible_module, tmp_path):
+    session_path = tmp_path / 'audible_session.txt'
+    session_path.write_text(json.dumps({"expires": time.time() + AUDIBLE_TOKEN_REFRESH_MARGIN + 0.2,
+                                        "adp_token": "token", "device_private_key": "key"}))
+    client = AudibleClient('me@example.com', 'secret', 'us', str(session_path))
+    try:
+        time.sleep(0.6)
+        assert ('refresh_access_token', True) in fake_audible_module.calls
+        assert not has_audible_session_expired(load_audible_session_file(str(session_path)))
+        assert load_audible_session_file(str(session_path))["expires"] > time.time() + 3000
+    finally:
+        client.close()
+
+
+def test_main_syncs_several_accounts_concurrently(tmp_path, monkeypatch, capsys):
+    servers = {locale: FakeAudibleServer(n_books=n_books, latency=0.1)
+               for locale, n_books in (('us', 1200), ('de', 700), ('fr', 300))}
+    sessions = []
+
+    def get_fake_audible_session(audible_cfg, root_path):
+        sessions.append(audible_cfg.get('locale'))
+        return FakeAudibleSession(servers[audible_cfg.get('locale')].url)
+
+    monkeypatch.setattr(sys.modules[main.__module__], 'get_audible_session', get_fake_audible_session)
+    root_path = tmp_path / 'audible2sheet'
+    accounts_cfg_path = tmp_path / 'accounts.ini'
+    accounts_cfg_path.write_text(f"""[general]
+root_path = {root_path}
+
+[audible_cfg.us]
+locale = us
+min_length = 1
+
+[audible_cfg.de]
+locale = de
+min_length = 1
+
+[google_sheet_cfg]
+backend = local
+""")
+    single_root_path = tmp_path / 'single'
+    single_cfg_path = tmp_path / 'single.ini'
+    single_cfg_path.write_text(f"""[general]
+root_path = {single_root_path}
+
+[audible_cfg]
+locale = fr
+min_length = 1
+
+[google_sheet_cfg]
+backend = local
+""")
+    try:
+        sys.argv = ['', '-c', str(accounts_cfg_path), str(single_cfg_path), '-g']
+        main()
+
+        captured = capsys.readouterr()
+        assert sorted(sessions) == ['de', 'fr', 'us']
+        for account_root_path, n_books in ((root_path / 'us', 1200), (root_path / 'de', 700), (single_root_path, 300)):
+            n_long_books = sum(index % 900 >= 1 for index in range(n_books))
+            library = (account_root_path / AUDIBLE_FILE_PATH_DEFAULT).read_text()
+            assert library.count("\n") == n_long_books + 1
+            assert library in captured.out
+            assert len(LocalWorksheet(str(account_root_path / GSHEET_LOCAL_FILE_PATH_DEFAULT)).rows) == n_long_books + 1
+        assert "Synced 3 accounts" in captured.err
+
+        # a failed account doesn't stop the others
+        servers['de'].fail_pages = {1}
+        servers["us"].items[1]["title"] = "Changed Title"
+        with pytest.raises(Exception, match="1 of 3 syncs failed: de"):
+            main()
+        assert "Changed Title" in (root_path / 'us' / AUDIBLE_FILE_PATH_DEFAULT).read_text()
+        assert re.search(r"^de .* FAILED", capsys.readouterr().err, re.MULTILINE)
+    finally:
+        for server in servers.values():
+            server.close()
+
+
+def test_main_rejects_several_syncs_with_the_same_root_path(fake_library, tmp_path, monkeypatch):
+    cfg_path, root_path = fake_library
+    other_cfg_path = tmp_path / 'other.ini'
+    other_cfg_path.write_text(cfg_path.read_text())
+    sessions = []
+    monkeypatch.setattr(sys.modules[main.__module__], 'get_audible_session', lambda *args: sessions.append(args))
+    sys.argv = ['', '-c', str(cfg_path), str(other_cfg_path), '-g']
+    with pytest.raises(Exception, match="audible2sheet.ini, other.ini all use the root path"):
+        main()
+    assert sessions == []
+
+
+def test_main_rejects_several_json_codecs(fake_library, tmp_path):
+    cfg_path, root_path = fake_library
+    other_cfg_path = tmp_path / 'other.ini'
+    other_cfg_path.write_text(cfg_path.read_text().replace(f"root_path = {root_path}\n",
+                                                           f"root_path = {tmp_path / 'other'}\njson_codec = json\n"))
+    sys.argv = ['', '-c', str(cfg_path), str(other_cfg_path), '-A', '-l']
+    with pytest.raises(Exception, match="must all use the same json_codec"):
+        main()
+
+
+def test_main_profile(fake_library, tmp_path, capsys):
+    cfg_path, root_path = fake_library
+    with open(cfg_path, 'a') as cfg_file:
+        cfg_file.write("\n[google_sheet_cfg]\nbackend = local\n")
+    n_books = (root_path / AUDIBLE_FILE_PATH_DEFAULT).read_text().count("\n") - 1
+
+    sys.argv = ['', '-c', str(cfg_path), '-B', '-g', '--profile']
+    main()
+    err = capsys.readouterr().err
+    assert re.search(rf"^gsheet_insert +1 +[0-9.]+ +{n_books} ", err, re.MULTILINE)
+    assert re.search(r"^total +1 ", err, re.MULTILINE)
+
+    profile_path = tmp_path / 'profile.json'
+    cprofile_path = tmp_path / 'audible2sheet.prof'
+    sys.argv = ['', '-c', str(cfg_path), '-B', '-g', '--profile', str(profile_path), '--cprofile', str(cprofile_path)]
+    main()
+    stages = json.loads(profile_path.read_text())
+    assert stages['audible_rebuild']['items'] == n_books
+    assert stages['gsheet_download']['items'] == n_books + 1
+    assert stages['gsheet_diff']['items'] == 0
+    assert 'gsheet_insert' not in stages
+    assert stages['total']['seconds'] >= stages['audible_rebuild']['seconds'] + stages['gsheet_download']['seconds']
+    import pstats
+    assert pstats.Stats(str(cprofile_path)).total_calls > 0
+
+
+def test_main_loads_the_sheet_while_fetching_the_audible_books(fake_library, tmp_path, monkeypatch, capsys):
+    cfg_path, root_path = fake_library
+    with open(cfg_path, 'a') as cfg_file:
+        cfg_file.write("fetch_workers = 1\n\n[google_sheet_cfg]\nbackend = local\nlocal_latency = 0.3\n")
+    server = FakeAudibleServer(n_books=700)
+    module = sys.modules[main.__module__]
+    monkeypatch.setattr(module, 'get_audible_session', lambda audible_cfg, root_path: FakeAudibleSession(server.url))
+    # the first Audible page and the opening of the sheet wait for each other: the sync fails (the barrier times out)
+    # unless they're done at the same time
+    rendezvous = threading.Barrier(2, timeout=10)
+    get_gs_wks = module.get_gs_wks
+
+    def get_gs_wks_once_audible_is_fetched(gs_cfg, root_path):
+        rendezvous.wait()
+        return get_gs_wks(gs_cfg, root_path)
+
+    profile_path = tmp_path / 'profile.json'
+    try:
+        sys.argv = ['', '-c', str(cfg_path), '-g']
+        main()
+        capsys.readouterr()
+        # the sheet (header and ASIN column) is loaded while the 2 pages are fetched
+        server.on_request = lambda page: rendezvous.wait() if page == 1 else None
+        monkeypatch.setattr(module, 'get_gs_wks', get_gs_wks_once_audible_is_fetched)
+        sys.argv = ['', '-c', str(cfg_path), '-g', '--profile', str(profile_path)]
+        main()
+    finally:
+        server.close()
+
+    assert not rendezvous.broken
+    stages = json.loads(profile_path.read_text())
+    assert stages['gsheet_load']['calls'] == 1 and stages['audible_fetch']['calls'] == 1
+    assert "No new or changed books found" in capsys.readouterr().err
+
+    monkeypatch.setattr(module, 'get_gs_wks', get_gs_wks)
+    sys.argv = ['', '-c', str(cfg_path), '-a', '-g', '--profile']
+    main()
+    assert re.search(r"^Critical path: gsheet_load [0-9.]+s > gsheet_sync [0-9.]+s$", capsys.readouterr().err, re.MULTILINE)
+
+
+def test_profile_of_audible_pages(tmp_path):
+    server = FakeAudibleServer(n_books=1200)
+    profiler.reset()
+    try:
+        get_audible_books_and_save_to_file({'fetch_workers': '4', 'min_length': '1'}, str(tmp_path), FakeAudibleSession(server.url))
+    finally:
+        server.close()
+
+    assert profiler.stages['audible_page']['calls'] == 3
+    assert profiler.stages['audible_page']['items'] == 1200
+    assert profiler.stages['audible_page']['bytes'] > 0
+    assert profiler.stages['raw_json_dumps']['items'] == 1200
+    assert profiler.stages['raw_json_dumps']['bytes'] == (tmp_path / AUDIBLE_RAW_FILE_PATH_DEFAULT).stat().st_size
+    assert profiler.stages['date_conversion']['items'] == profiler.stages['audible_fetch']['items']
+
+
+def get_compressions():
+    compressions = ['gzip']
+    try:
+        import zstandard
+        compressions.append('zstd')
+    except ImportError:
+        compressions.append(pytest.param('zstd', marks=pytest.mark.skip(reason="zstandard isn't installed")))
+    return compressions
+
+
+def run_main_and_get_output(cfg_path, args, capsys):
+    sys.argv = ['', '-c', str(cfg_path)] + args
+    main()
+    return capsys.readouterr().out
+
+
+@pytest.mark.parametrize('compression', get_compressions())
+def test_compressed_cache_files(compression, fake_library, tmp_path, capsys):
+    cfg_path, root_path = fake_library
+    compressed_root_path = tmp_path / 'compressed'
+    compressed_root_path.mkdir()
+    compressed_cfg_path = tmp_path / 'compressed.ini'
+    compressed_cfg_path.write_text(cfg_path.read_text().replace(str(root_path), str(compressed_root_path)) +
+                                   f"compression = {compression}\n")
+    server = FakeAudibleServer(n_books=700)
+    try:
+        # both libraries written with the same JSON codec (main uses the fastest one)
+        set_raw_json_codec('json')
+        for path in (cfg_path, compressed_cfg_path):
+            cfg = configparser.ConfigParser()
+            cfg.read(path)
+            get_audible_books_and_save_to_file(cfg['audible_cfg'], cfg['general']['root_path'], FakeAudibleSession(server.url))
+    finally:
+        server.close()
+    commands = [['-a'], ['-A', '-r'], ['-A', '-l'], ['-A', '-L', 'authors'], ['-A', '-R', 'asin title authors series'],
+                ['-A', '-R', 'title narrators', '-f', 'B000000345'], ['-B']]
+    outputs = [run_main_and_get_output(cfg_path, args, capsys) for args in commands]
+
+    extension = COMPRESSED_FILE_EXTENSIONS[compression]
+    for name in (AUDIBLE_RAW_FILE_PATH_DEFAULT, AUDIBLE_FILE_PATH_DEFAULT):
+        compressed_path = compressed_root_path / (name + extension)
+        assert not (compressed_root_path / name).exists()
+        with open_cache_file(str(compressed_path), 'rb') as compressed_file:
+            assert compressed_file.read() == (root_path / name).read_bytes()
+        assert compressed_path.stat().st_size < (root_path / name).stat().st_size / 3
+    for args, output in zip(commands, outputs):
+        assert run_main_and_get_output(compressed_cfg_path, args, capsys) == output
+
+
+def test_compressed_cache_files_are_streamed(tmp_path):
+    raw_library_path = str(tmp_path / (AUDIBLE_RAW_FILE_PATH_DEFAULT + '.gz'))
+    with RawLibraryWriter(raw_library_path) as raw_writer:
+        for index in range(20000):
+            raw_writer.write(make_fake_audible_item(index))
+    with open_cache_file(raw_library_path, 'rb') as raw_file:
+        raw_size = sum(len(line) for line in raw_file)
+
+    class CountingOutput(io.TextIOBase):
+        def __init__(self):
+            self.size = 0
+
+        def write(self, data):
+            self.size += len(data)
+            return len(data)
+
+    output = CountingOutput()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(output):
+            print_file_as_is(raw_library_path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert output.size == raw_size + 1
+    assert peak < raw_size / 10
+
+    assert [item["title"] for item in iter_raw_library_items(raw_library_path, 'B000019999')] == ["Fake Title 19999"]
+
+
+def test_book_rows_with_separator_and_newline_are_read_back(tmp_path):
+    server = FakeAudibleServer(n_books=30)
+    summary = "<p>Part 1 | Part 2</p>\n<p>more</p>"
+    server.items[3]["publisher_summary"] = summary
+    audible_cfg = {'fetch_workers': '1', 'min_length': '1'}
+    columns = DEFAULT_BOOK_COLUMNS + (('SUMMARY', 'publisher_summary'),)
+    try:
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url), columns=columns)
+        # a new book has the separator as well and is merged at the top of the file
+        server.items[0:0] = [make_fake_audible_item(-1)]
+        server.items[0]["publisher_summary"] = 'New | "quoted"\nbook'
+        get_audible_books_and_save_to_file(audible_cfg, str(tmp_path), FakeAudibleSession(server.url), incremental=True,
+                                           columns=columns)
+    finally:
+        server.close()
+
+    table = BookTable.from_file(str(tmp_path / AUDIBLE_FILE_PATH_DEFAULT))
+    assert table.columns[Book.FIELD_NAME_ASIN] == [item["asin"] for item in server.items if item["runtime_length_min"] >= 1]
+    summaries = dict(zip(table.columns[Book.FIELD_NAME_ASIN], table.columns['SUMMARY']))
+    assert "Part 1 | Part 2" in summaries["B000000003"] and "\n" in summaries["B000000003"]
+    assert summaries["B-00000001"] == 'New | "quoted"\nbook'
@@ -0,0 +1,263 @@
+import pytest
+import sys
+import os
+import io
+import time
+import contextlib
+import warnings
+import tracemalloc
+import subprocess
+from audible2sheet.audible2sheet import *
+from tests.synthetic_library import iter_synthetic_audible_items, write_synthetic_raw_library
+from tests.test_audible2sheet import get_installed_json_codecs, sync_wks_with_audible_books, FakeAudibleServer, \
+                                    FakeAudibleSession, REPO_ROOT
+
+# Library sizes to benchmark: the 100k and 1M books libraries take minutes and so are opt-in,
+# e.g. AUDIBLE2SHEET_BENCHMARK_SIZES=1000,10000,100000,1000000
+BENCHMARK_SIZES = [int(size) for size in os.environ.get('AUDIBLE2SHEET_BENCHMARK_SIZES', '1000,10000').split(',')]
+# Share of the books already in the Google Sheet
+GS_BOOKS_RATIO = 0.9
+
+try:
+    import pytest_benchmark
+except ImportError:
+    class OneShotBenchmark:
+        """
+        Stand-in for the pytest-benchmark fixture (when it's not installed): run the function once and report its time
+        """
+        def __init__(self, name):
+            self.name = name
+            self.extra_info = dict()
+            self.elapsed = None
+
+        def pedantic(self, function, args=(), kwargs=None, rounds=1, iterations=1):
+            start = time.perf_counter()
+            for _ in range(rounds * iterations):
+                result = function(*args, **(kwargs or {}))
+            self.elapsed = (time.perf_counter() - start) / (rounds * iterations)
+            return result
+
+        def __call__(self, function, *args, **kwargs):
+            return self.pedantic(function, args, kwargs)
+
+    @pytest.fixture
+    def benchmark(request):
+        # the report (time and extra info) is printed once the test is done
+        benchmark = OneShotBenchmark(request.node.name)
+        yield benchmark
+        if benchmark.elapsed is not None:
+            print(f"{benchmark.name}: {benchmark.elapsed:.4f}s", *(f"{key}={value}" for key, value in benchmark.extra_info.items()))
+
+
+@pytest.fixture(scope='module', params=BENCHMARK_SIZES, ids=lambda n_books: f"{n_books}_books")
+def synthetic_library(request, tmp_path_factory):
+    """
+    Raw cache file, "|"-separated cache file and GS cache file (with GS_BOOKS_RATIO of the books) of a synthetic library
+    """
+    n_books = request.param
+    root_path = tmp_path_factory.mktemp(f"synthetic_{n_books}")
+    raw_library_path = str(root_path / AUDIBLE_RAW_FILE_PATH_DEFAULT)
+    library_path = str(root_path / AUDIBLE_FILE_PATH_DEFAULT)
+    gs_library_path = str(root_path / GSHEET_FILE_PATH_DEFAULT)
+    write_synthetic_raw_library(raw_library_path, n_books)
+    rebuild_audible_books_file_from_raw_file({'min_length': '1', 'rebuild_workers': '1'}, str(root_path))
+    with open(library_path) as library_file, open(gs_library_path, 'w') as gs_library_file:
+        books = library_file.readlines()
+        gs_library_file.write(books[0])
+        gs_library_file.writelines(books[-int((len(books) - 1) * GS_BOOKS_RATIO):])
+
+    return n_books, raw_library_path, library_path, gs_library_path
+
+
+def remove_sidecar_files(raw_library_path):
+    for path in (get_raw_library_index_path(raw_library_path), get_raw_library_stats_path(raw_library_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_synthetic_items_are_valid_audible_items():
+    items = list(iter_synthetic_audible_items(2000))
+    assert len({item["asin"] for item in items}) == 2000
+    rows = get_audible_book_rows(items, 1, ['Speech'], [])
+    assert 0 < sum(row is not None for row in rows) < 2000
+    authors = [extract_authors_from_json_data(item["authors"]) for item in items]
+    assert not any("(translator)" in author or " - foreword" in author for author in authors)
+    assert any(len(item["authors"]) > 1 for item in items)
+    assert any(item["purchase_date"].endswith("Z") and "." not in item["purchase_date"] for item in items)
+    assert list(iter_synthetic_audible_items(10, seed=1)) == list(iter_synthetic_audible_items(10, seed=1))
+
+
+def test_benchmark_raw_parsing(synthetic_library, benchmark):
+    n_books, raw_library_path, _, _ = synthetic_library
+    items = benchmark.pedantic(lambda: list(iter_raw_library_items(raw_library_path)))
+    assert len(items) == n_books
+
+
+def test_benchmark_list_of_fields(synthetic_library, benchmark):
+    # -l without the precomputed stats
+    n_books, raw_library_path, _, _ = synthetic_library
+    remove_sidecar_files(raw_library_path)
+    stats = benchmark.pedantic(get_raw_field_stats, args=(raw_library_path,))
+    assert len(stats.fields["asin"]) == n_books or "asin" in stats.overflowed
+
+
+def test_benchmark_list_of_specified_field(synthetic_library, benchmark):
+    # -L authors without the precomputed stats
+    _, raw_library_path, _, _ = synthetic_library
+    remove_sidecar_files(raw_library_path)
+    stats = benchmark.pedantic(get_raw_field_stats, args=(raw_library_path, 'authors'))
+    assert list(stats.fields) == ['authors']
+
+
+def test_benchmark_specified_fields_projection(synthetic_library, benchmark):
+    # -R "asin title authors narrators category_ladders series"
+    n_books, raw_library_path, _, _ = synthetic_library
+
+    def print_specified_fields():
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            print_specified_field_from_raw_file(raw_library_path, "asin title authors narrators category_ladders series".split(), None)
+        return output.getvalue()
+
+    output = benchmark.pedantic(print_specified_fields)
+    assert output.count("\n") == n_books + 1
+
+
+def test_benchmark_create_books_dict_from_file(synthetic_library, benchmark):
+    _, _, library_path, _ = synthetic_library
+    books_dict = benchmark.pedantic(create_books_dict_from_file, args=(library_path,))
+    with open(library_path) as library_file:
+        assert len(books_dict) == sum(1 for _ in library_file) - 1
+
+
+def test_benchmark_get_new_book_rows(synthetic_library, benchmark):
+    _, _, library_path, gs_library_path = synthetic_library
+    audible_books = BookTable.from_file(library_path)
+    gs_books = BookTable.from_file(gs_library_path)
+    with contextlib.redirect_stderr(io.StringIO()):
+        new_book_rows = benchmark.pedantic(get_new_book_rows, args=(audible_books, gs_books, Book.FIELD_NAMES))
+    assert len(new_book_rows) == len(audible_books) - len(gs_books)
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_benchmark_rebuild(synthetic_library, benchmark, workers, tmp_path, monkeypatch):
+    # -B split by byte ranges across the processes (whatever the size of the library)
+    _, raw_library_path, library_path, _ = synthetic_library
+    audible_cfg = {'min_length': '1', 'rebuild_workers': str(workers), 'library_file_path': str(tmp_path / AUDIBLE_FILE_PATH_DEFAULT),
+                   'raw_library_file_path': raw_library_path}
+    monkeypatch.setattr(sys.modules[rebuild_audible_books_file_from_raw_file.__module__], 'REBUILD_PROCESS_POOL_MIN_SIZE', 0)
+    with contextlib.redirect_stderr(io.StringIO()):
+        benchmark.pedantic(rebuild_audible_books_file_from_raw_file, args=(audible_cfg, str(tmp_path)))
+    with open(library_path, 'rb') as library_file:
+        assert (tmp_path / AUDIBLE_FILE_PATH_DEFAULT).read_bytes() == library_file.read()
+
+
+def test_benchmark_asin_filter_without_index(synthetic_library, benchmark):
+    # -R ... -f with 100 ASINs and no index: byte-level search over the memory-mapped raw cache file
+    n_books, raw_library_path, _, _ = synthetic_library
+    remove_sidecar_files(raw_library_path)
+    asins = [item["asin"] for item in iter_synthetic_audible_items(n_books)][::max(1, n_books // 100)]
+    items = benchmark.pedantic(lambda: list(iter_raw_library_items(raw_library_path, asins, ["asin", "title"])))
+    assert [item["asin"] for item in items] == asins
+
+
+@pytest.mark.parametrize('codec', get_installed_json_codecs(), ids=lambda codec: codec.name)
+def test_benchmark_json_codec_dumps(synthetic_library, benchmark, codec):
+    _, raw_library_path, _, _ = synthetic_library
+    items = list(iter_raw_library_items(raw_library_path))
+    raw_lines = benchmark.pedantic(lambda: [codec.dumps(item) + b"\n" for item in items])
+    assert [codec.loads(raw_line) for raw_line in raw_lines] == items
+
+
+@pytest.mark.parametrize('codec', get_installed_json_codecs(), ids=lambda codec: codec.name)
+def test_benchmark_json_codec_loads(synthetic_library, benchmark, codec):
+    n_books, raw_library_path, _, _ = synthetic_library
+    with open(raw_library_path, 'rb') as raw_file:
+        raw_lines = raw_file.readlines()
+    items = benchmark.pedantic(lambda: [codec.loads(raw_line) for raw_line in raw_lines])
+    assert len(items) == n_books
+
+
+@pytest.mark.parametrize('codec', get_installed_json_codecs(), ids=lambda codec: codec.name)
+def test_benchmark_json_codec_decode_fields(synthetic_library, benchmark, codec):
+    n_books, raw_library_path, _, _ = synthetic_library
+    with open(raw_library_path, 'rb') as raw_file:
+        raw_lines = raw_file.readlines()
+    items = benchmark.pedantic(lambda: [codec.decode_fields(raw_line, ('asin', 'title', 'authors')) for raw_line in raw_lines])
+    assert len({item["asin"] for item in items}) == n_books
+
+
+def test_benchmark_book_table_from_file(synthetic_library, benchmark):
+    _, _, library_path, _ = synthetic_library
+
+    def measure_size(function, *args):
+        tracemalloc.start()
+        try:
+            result = function(*args)
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return result, size
+
+    books_dict, dict_size = measure_size(create_books_dict_from_file, library_path)
+    _, table_size = measure_size(BookTable.from_file, library_path)
+    audible_books = benchmark.pedantic(BookTable.from_file, args=(library_path,))
+    assert len(audible_books) == len(books_dict)
+    # most of the memory is taken by the values themselves which are the same in both cases
+    assert table_size < dict_size * 1.1
+
+
+def test_benchmark_get_book_rows_diff(synthetic_library, benchmark):
+    _, _, library_path, gs_library_path = synthetic_library
+    audible_books = BookTable.from_file(library_path)
+    gs_books = BookTable.from_file(gs_library_path)
+    with contextlib.redirect_stderr(io.StringIO()):
+        diff = benchmark.pedantic(get_book_rows_diff, args=(audible_books, gs_books, Book.FIELD_NAMES))
+    assert len(diff.insert_rows) == len(audible_books) - len(gs_books)
+
+
+def test_benchmark_sync_local_wks(synthetic_library, benchmark):
+    # the sheet already has the books of the GS cache file and the books bought since then are added
+    _, _, library_path, gs_library_path = synthetic_library
+    root_path = os.path.dirname(library_path)
+    sheet_library_path = os.path.join(root_path, 'sheet_' + GSHEET_FILE_PATH_DEFAULT)
+    wks = LocalWorksheet(latency=0.001)
+    with contextlib.redirect_stderr(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        sync_wks_with_audible_books(wks, gs_library_path, sheet_library_path)
+        wks.calls.clear()
+        wks.bytes_sent = wks.bytes_received = 0
+        benchmark.pedantic(sync_wks_with_audible_books, args=(wks, library_path, sheet_library_path))
+    # reported along with the wall time
+    benchmark.extra_info.update(api_calls=wks.api_calls, calls=dict(wks.calls), bytes_sent=wks.bytes_sent,
+                                bytes_received=wks.bytes_received)
+    assert wks.api_calls <= 4
+    assert len(wks.rows) == len(BookTable.from_file(library_path)) + 1
+
+
+def test_benchmark_import(benchmark):
+    # startup of the cache-only commands (the network client libraries are only imported when needed)
+    benchmark.pedantic(subprocess.run, args=([sys.executable, '-c', 'import audible2sheet.audible2sheet'],),
+                       kwargs=dict(cwd=REPO_ROOT, check=True))
+
+
+@pytest.mark.parametrize('cache_only_args', [['-A', '-l'], ['-A', '-R', 'asin title authors series']])
+def test_benchmark_cache_only_command(synthetic_library, benchmark, cache_only_args, tmp_path):
+    _, _, library_path, _ = synthetic_library
+    cfg_path = tmp_path / 'audible2sheet.ini'
+    cfg_path.write_text(f"[general]\nroot_path = {os.path.dirname(library_path)}\n\n[audible_cfg]\nmin_length = 1\n")
+    command = [sys.executable, '-m', 'audible2sheet.audible2sheet', '-c', str(cfg_path)] + cache_only_args
+    benchmark.pedantic(subprocess.run, args=(command,), kwargs=dict(cwd=REPO_ROOT, capture_output=True, check=True))
+
+
+@pytest.mark.parametrize('fetch_workers', [1, 8])
+def test_benchmark_fetch_with_latency(benchmark, fetch_workers, tmp_path):
+    # the pages are requested concurrently to hide the latency of Audible
+    server = FakeAudibleServer(n_books=2600, latency=0.25)
+    audible_cfg = {'fetch_workers': str(fetch_workers), 'min_length': '1'}
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            benchmark.pedantic(get_audible_books_and_save_to_file, args=(audible_cfg, str(tmp_path), FakeAudibleSession(server.url)))
+    finally:
+        server.close()
+    benchmark.extra_info.update(requests=len(server.requests), max_in_flight=server.max_in_flight)